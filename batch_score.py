@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+"""
+Out-of-core batch scoring of every donor x recipient candidate pair
+
+Donors and recipients are read from CSV or Parquet files or from the
+database into the compact columns of ``ml.feature_store`` (a few hundred
+bytes per record), which are saved as .npy files and memory-mapped by a
+pool of worker processes. Donors are split, in id order, into chunks of
+about ``--chunk-pairs`` organ- and ABO-compatible pairs. Each worker
+computes the pair features of a chunk vectorized, scores them with the
+saved model and hands the scores back. Only a few chunks are in flight at
+a time, so memory stays bounded however many pairs there are in total.
+
+A model trained on features beyond the twelve the vectorized pipeline
+computes (like the shipped artifact) is scored through ``create_features``
+instead: the raw records are pickled next to the columns and each worker
+runs the feature pipeline over its chunk's candidate blocks, which is much
+slower but gives the features the model was trained on.
+
+Results are written as they arrive: one ``part-<chunk>`` Parquet or CSV
+file per chunk, or bulk-inserted into pair_scores under the model version.
+Finished chunks are logged next to a manifest of the chunk plan, so an
+interrupted run picks up where it stopped when run again with the same
+inputs and model.
+
+Usage:
+    python batch_score.py --donors data/donors.parquet --recipients data/recipients.parquet --output scores/
+    python batch_score.py --database-uri postgresql://... --output scores/ --format csv
+    python batch_score.py --database-uri postgresql://... --format db --processes 8
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from ml.feature_store import (DONOR_COLUMNS, RECIPIENT_COLUMNS, FeatureStore, compatible_blood, missing_features,
+                              pair_features)
+from ml.model_registry import DEFAULT_MODEL_PATH, DEFAULT_REGISTRY_DIR, current_version
+from ml.retrain_worker import _default_n_jobs, load_frames
+from startup import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_CHUNK_PAIRS = 500_000
+DEFAULT_DB_STATE_DIR = 'models/batch_scoring'
+READ_CHUNK_ROWS = 50_000
+INSERT_BATCH_SIZE = 5000
+IN_FLIGHT_PER_PROCESS = 2
+PROGRESS_INTERVAL = 5.0
+FORMATS = ('parquet', 'csv', 'db')
+
+# Underscore-prefixed so Parquet dataset readers skip them in the output directory
+MANIFEST = '_batch.json'
+COMPLETED_LOG = '_completed.log'
+RECORDS_DIR = '_records'
+COLUMNS = {'donors': DONOR_COLUMNS, 'recipients': RECIPIENT_COLUMNS}
+
+
+class AlleleBits:
+    """HLA typings as allele bitsets over a dictionary local to one run.
+
+    Files carry only the free-text typing; any consistent allele numbering
+    gives the same match scores as the database's ``hla_bits``.
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, hla_typing):
+        from models import parse_hla_typing
+
+        mask = 0
+        for allele in parse_hla_typing(hla_typing):
+            mask |= 1 << self.ids.setdefault(allele, len(self.ids))
+        return mask.to_bytes((mask.bit_length() + 7) // 8, 'little') if mask else None
+
+
+def _record_frames(path, chunk_rows=READ_CHUNK_ROWS):
+    """Yield DataFrames of at most ``chunk_rows`` records from a CSV or Parquet file"""
+    if path.endswith(('.parquet', '.pq')):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading Parquet needs pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+def load_files(donors_path, recipients_path):
+    """FeatureStore filled from donor and recipient files"""
+    store = FeatureStore()
+    alleles = AlleleBits()
+    for path, records in ((donors_path, store.donors), (recipients_path, store.recipients)):
+        for frame in _record_frames(path):
+            frame = frame.astype(object).where(frame.notna(), None)
+            for record in frame.to_dict('records'):
+                if record.get('id') is None:
+                    raise ValueError(f"{path}: every record needs an id")
+                record['id'] = int(record['id'])
+                record['hla_bits'] = alleles.encode(record.get('hla_typing'))
+                records.update(record)
+    return store
+
+
+def read_file(path):
+    """A whole donor or recipient file as one DataFrame, for the create_features path"""
+    return pd.concat(list(_record_frames(path)), ignore_index=True)
+
+
+def load_database(database_uri):
+    """FeatureStore filled from the database with a private engine"""
+    from sqlalchemy import create_engine
+
+    engine = create_engine(database_uri)
+    try:
+        with engine.connect() as connection:
+            return FeatureStore().load(connection)
+    finally:
+        engine.dispose()
+
+
+def save_records(store, records_dir, raw_frames=None):
+    """Write the live records of both sides, in id order, as .npy files,
+    plus the raw (donors, recipients) frames as pickles when given.
+
+    Returns a fingerprint of their contents, which decides whether an
+    earlier run's chunk plan still applies.
+    """
+    os.makedirs(records_dir, exist_ok=True)
+    digest = hashlib.sha1(json.dumps([store.organ_codes.names, store.gender_codes.names]).encode())
+    for kind, frame in zip(('donors', 'recipients'), raw_frames or ()):
+        frame = frame.drop_duplicates('id', keep='last').sort_values('id').reset_index(drop=True)
+        digest.update(pd.util.hash_pandas_object(frame.astype(str), index=False).to_numpy().tobytes())
+        frame.to_pickle(os.path.join(records_dir, f'{kind}_raw.pkl'))
+    for kind, records in (('donors', store.donors), ('recipients', store.recipients)):
+        live, columns, hla = records.view()
+        order = live[np.argsort(records.ids[live], kind='stable')]
+        arrays = {'id': records.ids[order], 'hla': hla[order]}
+        arrays.update((name, columns[name][order]) for name, _ in COLUMNS[kind])
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            digest.update(f'{kind}.{name}{array.shape}'.encode())
+            digest.update(array.tobytes())
+            np.save(os.path.join(records_dir, f'{kind}_{name}.npy'), array)
+    return digest.hexdigest()[:16]
+
+
+def load_records(records_dir, kind, mmap_mode='r'):
+    names = ['id', 'hla'] + [name for name, _ in COLUMNS[kind]]
+    return {name: np.load(os.path.join(records_dir, f'{kind}_{name}.npy'), mmap_mode=mmap_mode) for name in names}
+
+
+def candidate_counts(donors, recipients):
+    """Number of organ- and ABO-compatible recipients of each donor"""
+    n_organs = int(max(donors['organ_code'].max(initial=-1), recipients['organ_code'].max(initial=-1))) + 1
+    known = recipients['organ_code'] >= 0
+    per_group = np.zeros((max(n_organs, 1), compatible_blood().shape[1]), dtype=np.int64)
+    np.add.at(per_group, (recipients['organ_code'][known], recipients['blood_code'][known]), 1)
+    counts = (per_group[donors['organ_code']] * compatible_blood()[donors['blood_code']]).sum(axis=1)
+    return np.where(donors['organ_code'] >= 0, counts, 0)
+
+
+def plan_chunks(counts, chunk_pairs=DEFAULT_CHUNK_PAIRS):
+    """[(start, stop, pairs)] runs of consecutive donors with about ``chunk_pairs`` pairs each.
+
+    A donor goes to the chunk its first pair falls into, so a chunk
+    overshoots ``chunk_pairs`` by at most one donor's recipients.
+    """
+    offsets = np.cumsum(counts) - counts
+    chunk_of = offsets // max(1, int(chunk_pairs))
+    starts = np.flatnonzero(np.diff(chunk_of, prepend=-1))
+    stops = np.append(starts[1:], len(counts))
+    return [(int(start), int(stop), int(counts[start:stop].sum())) for start, stop in zip(starts, stops)]
+
+
+def resolve_model(model_version=None, registry_dir=DEFAULT_REGISTRY_DIR, model_path=None):
+    """(model_version, artifact path): a registry version (the current one by
+    default), or a model file stamped like ``score_store.model_version_for``"""
+    if model_path:
+        stat = os.stat(model_path)
+        return f'{stat.st_mtime_ns:x}-{stat.st_size:x}', model_path
+    model_version = model_version or current_version(registry_dir)
+    if model_version:
+        return model_version, os.path.join(registry_dir, model_version, 'model.joblib')
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        return resolve_model(model_path=DEFAULT_MODEL_PATH)
+    raise ValueError("No trained model found; train one first or pass --model")
+
+
+def model_feature_columns(artifact_path):
+    """Feature columns of a model artifact (from the registry's meta.json when there is one)"""
+    meta_path = os.path.join(os.path.dirname(artifact_path), 'meta.json')
+    if os.path.basename(artifact_path) == 'model.joblib' and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return json.load(f)['feature_columns']
+    import joblib
+    return list(joblib.load(artifact_path, mmap_mode='r')['feature_columns'])
+
+
+# Memory-mapped records and the model, loaded once per pool worker
+_worker = None
+
+
+def _init_worker(records_dir, artifact_path, organ_names, raw=False):
+    global _worker
+    import joblib
+
+    artifact = joblib.load(artifact_path, mmap_mode='r')
+    model = artifact['model']
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = 1
+    classes = list(model.classes_)
+    _worker = {
+        'donors': load_records(records_dir, 'donors'),
+        'recipients': load_records(records_dir, 'recipients'),
+        'model': model,
+        'positive': classes.index(1) if 1 in classes else -1,
+        'feature_columns': list(artifact['feature_columns']),
+        'organ_names': organ_names,
+        'raw': None,
+    }
+    if raw:
+        from ml.feature_engineering import create_features
+        _worker['raw'] = (pd.read_pickle(os.path.join(records_dir, 'donors_raw.pkl')),
+                          pd.read_pickle(os.path.join(records_dir, 'recipients_raw.pkl')),
+                          create_features)
+
+
+def _score_raw_chunk(chunk, start, stop, started):
+    """``_score_chunk`` through create_features on the chunk's raw records"""
+    from ml.candidates import create_candidate_features_with_pairs
+
+    donors_df, recipients_df, create_features = _worker['raw']
+    donor_ids = np.asarray(_worker['donors']['id'][start:stop])
+    X, _, donor_ids, recipient_ids = create_candidate_features_with_pairs(
+        donors_df[donors_df['id'].isin(donor_ids)], recipients_df, feature_fn=create_features
+    )
+    scores = np.empty(0)
+    if len(X):
+        missing = [column for column in _worker['feature_columns'] if column not in X]
+        if missing:
+            raise ValueError(f"create_features does not produce the model's features: {missing}")
+        X = X[_worker['feature_columns']]
+        scores = np.round(_worker['model'].predict_proba(X)[:, _worker['positive']] * 100, 2)
+    return chunk, donor_ids, recipient_ids, scores, time.perf_counter() - started
+
+
+def _score_chunk(task):
+    """Score every candidate pair of donors ``start:stop``; returns
+    (chunk, donor_ids, recipient_ids, scores, seconds)"""
+    chunk, start, stop, n_pairs = task
+    started = time.perf_counter()
+    if _worker['raw'] is not None:
+        return _score_raw_chunk(chunk, start, stop, started)
+    donors, recipients = _worker['donors'], _worker['recipients']
+    feature_columns = _worker['feature_columns']
+    X = np.empty((n_pairs, len(feature_columns)))
+    donor_ids = np.empty(n_pairs, dtype=np.int64)
+    recipient_ids = np.empty(n_pairs, dtype=np.int64)
+
+    organ_codes = np.asarray(donors['organ_code'][start:stop])
+    blood_codes = np.asarray(donors['blood_code'][start:stop])
+    offset = 0
+    # Donors sharing (organ, blood group) share their candidate recipients
+    for organ_code, blood_code in sorted(set(zip(organ_codes.tolist(), blood_codes.tolist()))):
+        if organ_code < 0:
+            continue
+        eligible = np.flatnonzero((np.asarray(recipients['organ_code']) == organ_code)
+                                  & compatible_blood()[blood_code, recipients['blood_code']])
+        if not len(eligible):
+            continue
+        candidates = {name: np.asarray(column[eligible]) for name, column in recipients.items()}
+        positions = start + np.flatnonzero((organ_codes == organ_code) & (blood_codes == blood_code))
+        for position in positions:
+            donor = {name: column[position] for name, column in donors.items()}
+            features = pair_features(donor, candidates, _worker['organ_names'][organ_code])
+            missing = [column for column in feature_columns if column not in features]
+            if missing:
+                raise ValueError(f"The model expects features batch scoring cannot compute: {missing}")
+            end = offset + len(eligible)
+            for j, column in enumerate(feature_columns):
+                X[offset:end, j] = features[column]
+            donor_ids[offset:end] = donor['id']
+            recipient_ids[offset:end] = candidates['id']
+            offset = end
+
+    scores = np.empty(0)
+    if offset:
+        frame = pd.DataFrame(X[:offset], columns=feature_columns)
+        scores = np.round(_worker['model'].predict_proba(frame)[:, _worker['positive']] * 100, 2)
+    return chunk, donor_ids[:offset], recipient_ids[:offset], scores, time.perf_counter() - started
+
+
+class PartFileWriter:
+    """One ``part-<chunk>`` Parquet or CSV file per chunk, renamed into place when complete"""
+
+    def __init__(self, output_dir, export_format, model_version):
+        if export_format == 'parquet':
+            if importlib.util.find_spec('pyarrow') is None:
+                raise ValueError("Parquet output needs pyarrow (pip install pyarrow)")
+        self.output_dir = output_dir
+        self.export_format = export_format
+        self.model_version = model_version
+        os.makedirs(output_dir, exist_ok=True)
+
+    def reset(self):
+        for name in os.listdir(self.output_dir):
+            if name.startswith('part-'):
+                os.remove(os.path.join(self.output_dir, name))
+
+    def write(self, chunk, donor_ids, recipient_ids, scores):
+        frame = pd.DataFrame({
+            'donor_id': donor_ids,
+            'recipient_id': recipient_ids,
+            'model_version': self.model_version,
+            'compatibility_score': scores,
+        })
+        path = os.path.join(self.output_dir, f'part-{chunk:06d}.{self.export_format}')
+        temp_path = f'{path}.tmp'
+        if self.export_format == 'parquet':
+            frame.to_parquet(temp_path, index=False)
+        else:
+            frame.to_csv(temp_path, index=False)
+        os.replace(temp_path, path)
+
+    def finish(self, started_at, pairs_scored):
+        pass
+
+    def close(self):
+        pass
+
+
+class DatabaseWriter:
+    """Bulk-inserts each chunk into pair_scores in its own transaction.
+
+    A chunk's donors are a contiguous id range, so rewriting a chunk after
+    an interruption first deletes whatever that range already holds.
+    """
+
+    def __init__(self, database_uri, model_version, batch_size=INSERT_BATCH_SIZE):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+
+        self.engine = create_engine(database_uri)
+        self.session = Session(self.engine)
+        self.model_version = model_version
+        self.batch_size = batch_size
+
+    def reset(self):
+        from sqlalchemy import delete
+        from models import PairScore
+
+        self.session.execute(delete(PairScore).where(PairScore.model_version == self.model_version))
+        self.session.commit()
+
+    def write(self, chunk, donor_ids, recipient_ids, scores):
+        from sqlalchemy import delete, insert
+        from models import PairScore
+
+        if not len(donor_ids):
+            return
+        self.session.execute(delete(PairScore).where(
+            PairScore.model_version == self.model_version,
+            PairScore.donor_id.between(int(donor_ids.min()), int(donor_ids.max()))
+        ))
+        scored_at = datetime.utcnow()
+        for start in range(0, len(donor_ids), self.batch_size):
+            end = start + self.batch_size
+            self.session.execute(insert(PairScore), [
+                {
+                    'donor_id': donor_id,
+                    'recipient_id': recipient_id,
+                    'model_version': self.model_version,
+                    'compatibility_score': score,
+                    'scored_at': scored_at
+                }
+                for donor_id, recipient_id, score in zip(
+                    donor_ids[start:end].tolist(), recipient_ids[start:end].tolist(), scores[start:end].tolist()
+                )
+            ])
+        self.session.commit()
+
+    def finish(self, started_at, pairs_scored):
+        """Record the run so the matches pages serve this version"""
+        from models import PairScoreRun
+
+        self.session.merge(PairScoreRun(
+            model_version=self.model_version,
+            scored_through=datetime.fromisoformat(started_at),
+            pairs_scored=pairs_scored,
+            completed_at=datetime.utcnow()
+        ))
+        self.session.commit()
+
+    def close(self):
+        self.session.close()
+        self.engine.dispose()
+
+
+class BatchState:
+    """Chunk plan (manifest) and append-only log of finished chunks"""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.manifest_path = os.path.join(state_dir, MANIFEST)
+        self.log_path = os.path.join(state_dir, COMPLETED_LOG)
+        os.makedirs(state_dir, exist_ok=True)
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, manifest):
+        temp_path = f'{self.manifest_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def start(self, manifest):
+        self.save(manifest)
+        open(self.log_path, 'w').close()
+
+    def completed(self):
+        """{chunk: pairs} of logged chunks (a torn last line is ignored)"""
+        done = {}
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and line.endswith('\n'):
+                        done[int(parts[0])] = int(parts[1])
+        except FileNotFoundError:
+            pass
+        return done
+
+    def mark(self, chunk, pairs):
+        with open(self.log_path, 'a') as f:
+            f.write(f'{chunk} {pairs}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def run_batch(store, writer, state, model_version, artifact_path, export_format,
+              chunk_pairs=DEFAULT_CHUNK_PAIRS, processes=None, restart=False, raw_frames=None):
+    """Score every candidate pair of ``store`` into ``writer``, resuming an
+    interrupted run of the same plan; returns a stats dict.
+
+    With ``raw_frames`` (donors_df, recipients_df) the features come from
+    ``create_features`` on those records instead of ``pair_features``.
+    """
+    import multiprocessing
+
+    records_dir = os.path.join(state.state_dir, RECORDS_DIR)
+    fingerprint = save_records(store, records_dir, raw_frames)
+    donors = load_records(records_dir, 'donors')
+    recipients = load_records(records_dir, 'recipients')
+    plan = {'fingerprint': fingerprint, 'model_version': model_version,
+            'format': export_format, 'chunk_pairs': chunk_pairs}
+
+    previous = state.load()
+    if previous is not None and not restart and all(previous.get(key) == value for key, value in plan.items()) \
+            and previous.get('completed_at'):
+        print(f"✅ Already scored at {previous['completed_at']}; pass --restart to score again")
+        shutil.rmtree(records_dir, ignore_errors=True)
+        return {'pairs_scored': previous['pairs_scored'], 'pairs_this_run': 0,
+                'chunks': len(previous['chunks']), 'seconds': 0.0}
+    resumable = previous is not None and not previous.get('completed_at')
+    if resumable and not restart and any(previous.get(key) != value for key, value in plan.items()):
+        raise ValueError(f"{state.state_dir} holds an unfinished run with other inputs, model or settings; "
+                         f"pass --restart to discard it")
+    if resumable and not restart:
+        manifest = previous
+        done = state.completed()
+        print(f"↩️  Resuming: {len(done)}/{len(manifest['chunks'])} chunks already written")
+    else:
+        chunks = plan_chunks(candidate_counts(donors, recipients), chunk_pairs)
+        manifest = dict(plan, chunks=chunks, total_pairs=sum(pairs for _, _, pairs in chunks),
+                        donors=len(donors['id']), recipients=len(recipients['id']),
+                        started_at=datetime.utcnow().isoformat())
+        writer.reset()
+        state.start(manifest)
+        done = {}
+
+    total_pairs = manifest['total_pairs']
+    pending = [(chunk, start, stop, pairs) for chunk, (start, stop, pairs) in enumerate(manifest['chunks'])
+               if chunk not in done]
+    processes = max(1, min(processes or _default_n_jobs(), len(pending) or 1))
+    print(f"🧮 {manifest['donors']} donors x {manifest['recipients']} recipients: {total_pairs:,} candidate pairs "
+          f"in {len(manifest['chunks'])} chunks, {len(pending)} to score on {processes} processes")
+
+    started = time.perf_counter()
+    scored = sum(done.values())
+    scored_now = 0
+    last_report = started
+    if pending:
+        pool = multiprocessing.get_context('spawn').Pool(
+            processes, initializer=_init_worker,
+            initargs=(records_dir, artifact_path, store.organ_codes.names, raw_frames is not None)
+        )
+        try:
+            tasks = iter(pending)
+            in_flight = deque()
+            for task in tasks:
+                in_flight.append(pool.apply_async(_score_chunk, (task,)))
+                if len(in_flight) >= processes * IN_FLIGHT_PER_PROCESS:
+                    break
+            while in_flight:
+                chunk, donor_ids, recipient_ids, scores, _ = in_flight.popleft().get()
+                task = next(tasks, None)
+                if task is not None:
+                    in_flight.append(pool.apply_async(_score_chunk, (task,)))
+                writer.write(chunk, donor_ids, recipient_ids, scores)
+                state.mark(chunk, len(scores))
+                done[chunk] = len(scores)
+                scored += len(scores)
+                scored_now += len(scores)
+
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_INTERVAL or not in_flight:
+                    rate = scored_now / (now - started)
+                    eta = (total_pairs - scored) / rate if rate else 0
+                    print(f"⏳ {len(done)}/{len(manifest['chunks'])} chunks, {scored:,}/{total_pairs:,} pairs, "
+                          f"{rate:,.0f} pairs/s, ETA {_duration(eta)}")
+                    last_report = now
+        finally:
+            pool.terminate()
+            pool.join()
+
+    writer.finish(manifest['started_at'], scored)
+    manifest['completed_at'] = datetime.utcnow().isoformat()
+    manifest['pairs_scored'] = scored
+    state.save(manifest)
+    shutil.rmtree(records_dir, ignore_errors=True)
+    return {'pairs_scored': scored, 'pairs_this_run': scored_now, 'chunks': len(manifest['chunks']),
+            'seconds': time.perf_counter() - started}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score every candidate donor/recipient pair offline')
+    parser.add_argument('--donors', help='Donor CSV or Parquet file')
+    parser.add_argument('--recipients', help='Recipient CSV or Parquet file')
+    parser.add_argument('--database-uri', help='Read records from (and with --format db, write scores to) '
+                                               'this database')
+    parser.add_argument('--output', help='Directory for the part files (parquet and csv formats)')
+    parser.add_argument('--format', choices=FORMATS, default='parquet')
+    parser.add_argument('--model-version', help='Registry version to score with (default: current)')
+    parser.add_argument('--registry-dir', default=DEFAULT_REGISTRY_DIR)
+    parser.add_argument('--model', help='Score with this model artifact instead of a registry version')
+    parser.add_argument('--chunk-pairs', type=int, default=DEFAULT_CHUNK_PAIRS,
+                        help='Candidate pairs per chunk; bounds each worker\'s memory')
+    parser.add_argument('--processes', type=int, help='Worker processes (default: half the cores)')
+    parser.add_argument('--state-dir', help=f'Manifest and progress log (default: the output directory, '
+                                            f'or {DEFAULT_DB_STATE_DIR} for --format db)')
+    parser.add_argument('--restart', action='store_true', help='Discard an unfinished run instead of resuming it')
+    args = parser.parse_args()
+
+    if bool(args.donors) != bool(args.recipients):
+        parser.error('--donors and --recipients go together')
+    if not args.donors and not args.database_uri:
+        parser.error('give --donors/--recipients files or --database-uri')
+    if args.format == 'db' and not args.database_uri:
+        parser.error('--format db needs --database-uri')
+    if args.format != 'db' and not args.output:
+        parser.error(f'--format {args.format} needs --output')
+
+    print("🚀 OrganMatch batch scoring")
+    print("=" * 50)
+    try:
+        model_version, artifact_path = resolve_model(args.model_version, args.registry_dir, args.model)
+        print(f"🤖 Model {model_version}")
+        missing = missing_features(model_feature_columns(artifact_path))
+        if missing:
+            if importlib.util.find_spec('ml.feature_engineering') is None:
+                raise ValueError(f"The model expects features the vectorized pipeline cannot compute "
+                                 f"({', '.join(missing)}) and ml.feature_engineering is not installed")
+            print(f"⚠️  The model expects {len(missing)} features beyond the vectorized twelve; "
+                  f"computing them with create_features (slower)")
+
+        if args.donors:
+            print(f"📥 Loading {args.donors} and {args.recipients}...")
+            store = load_files(args.donors, args.recipients)
+            raw_frames = (read_file(args.donors), read_file(args.recipients)) if missing else None
+        else:
+            print("📥 Loading donors and recipients from the database...")
+            store = load_database(args.database_uri)
+            raw_frames = load_frames(args.database_uri) if missing else None
+        print(f"✅ Loaded {len(store.donors)} donors and {len(store.recipients)} recipients")
+
+        if args.format == 'db':
+            writer = DatabaseWriter(args.database_uri, model_version)
+            state = BatchState(args.state_dir or DEFAULT_DB_STATE_DIR)
+        else:
+            writer = PartFileWriter(args.output, args.format, model_version)
+            state = BatchState(args.state_dir or args.output)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    try:
+        stats = run_batch(store, writer, state, model_version, artifact_path, args.format,
+                          args.chunk_pairs, args.processes, args.restart, raw_frames)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted; run the same command again to resume")
+        return 130
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        writer.close()
+
+    print(f"\n🎉 Scored {stats['pairs_scored']:,} pairs ({stats['pairs_this_run']:,} in this run) "
+          f"in {_duration(stats['seconds'])}")
+    print(f"📁 Scores written to {'pair_scores' if args.format == 'db' else args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
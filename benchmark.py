@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Scalability benchmark for the OrganMatch ML pipeline and key routes
+
+Synthetic donors/recipients (ml.synthetic_data) are generated at each size
+and every stage (create_features, vectorized_features, train_model,
+predict_compatibility, get_model_metrics, and optionally the main web
+routes) runs in a fresh subprocess, so wall time, peak memory and timeouts
+are measured per stage without earlier stages skewing them. Results are appended to a JSON
+history and compared against a stored baseline; slower or larger stages
+are flagged and the exit code is 1.
+
+Usage:
+    python benchmark.py                          # default sizes
+    python benchmark.py --preset full            # up to 10k donors x 100k recipients
+    python benchmark.py --sizes 100x100,1000x5000 --stages create_features,predict_compatibility
+    python benchmark.py --routes                 # also time pages through the Flask app
+    python benchmark.py --save-baseline          # make this run the new baseline
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+HISTORY_PATH = os.path.join(ROOT, 'benchmarks', 'history.json')
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+PRESETS = {
+    'quick': ['100x100', '1000x1000'],
+    'default': ['100x100', '1000x1000', '1000x10000'],
+    'full': ['100x100', '1000x1000', '1000x10000', '10000x10000', '10000x100000'],
+}
+ML_STAGES = ['create_features', 'vectorized_features', 'train_model', 'predict_compatibility', 'get_model_metrics']
+# The module each ML stage benchmarks; stages whose module is missing are skipped
+STAGE_MODULES = {
+    'create_features': 'ml.feature_engineering',
+    'train_model': 'ml.train_model',
+    'predict_compatibility': 'ml.predict_model',
+    'get_model_metrics': 'ml.train_model',
+}
+DEFAULT_ROUTES = ['/', '/donors', '/recipients', '/matches', '/distances', '/evaluate']
+
+# A stage is a regression when it is this much slower/larger than the
+# baseline and the difference exceeds the absolute noise floor
+TIME_TOLERANCE = 0.25
+MIN_TIME_DELTA = 0.05
+MEMORY_TOLERANCE = 0.25
+MIN_MEMORY_DELTA_MB = 10
+
+
+class PeakMemorySampler:
+    """Samples this process's RSS in a thread and keeps the maximum"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.rss()
+        self.peak = self.baseline
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def parse_size(size):
+    donors, recipients = size.lower().split('x')
+    return int(donors), int(recipients)
+
+
+def _measure(fn):
+    with PeakMemorySampler() as memory:
+        started = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - started
+    return result, seconds, (memory.peak - memory.baseline) / 1024 ** 2
+
+
+def _run_ml_stage(spec, donors_df, recipients_df):
+    """Run one ML stage in this process; returns (seconds, peak_delta_mb, extra)"""
+    stage, model_path = spec['stage'], spec['model_path']
+    if stage == 'create_features':
+        from ml.feature_engineering import create_features
+        (X, _), seconds, memory = _measure(lambda: create_features(donors_df, recipients_df))
+        return seconds, memory, {'rows': len(X)}
+    if stage == 'vectorized_features':
+        from ml.vectorized_features import create_features as vectorized_create_features
+        (X, _), seconds, memory = _measure(lambda: vectorized_create_features(donors_df, recipients_df))
+        return seconds, memory, {'rows': len(X)}
+    if stage == 'train_model':
+        from ml.train_model import train_model
+        _, seconds, memory = _measure(lambda: train_model(donors_df, recipients_df, model_path=model_path))
+        return seconds, memory, {}
+    if stage == 'predict_compatibility':
+        from ml.predict_model import predict_compatibility
+        results, seconds, memory = _measure(
+            lambda: predict_compatibility(donors_df, recipients_df, model_path=model_path)
+        )
+        return seconds, memory, {'rows': len(results)}
+    if stage == 'get_model_metrics':
+        from ml.train_model import get_model_metrics
+        _, seconds, memory = _measure(lambda: get_model_metrics(donors_df, recipients_df, model_path=model_path))
+        return seconds, memory, {}
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _run_routes(spec, donors_df, recipients_df):
+    """Load the data into a scratch database and time each route through the test client"""
+    import io
+
+    workdir = spec['workdir']
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ['MODEL_PATH'] = spec['model_path']
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+
+    from app import app
+    from models import db, User, Donor, Recipient
+    from ingestion import ingest_csv
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for df, model in ((donors_df, Donor), (recipients_df, Recipient)):
+            buffer = io.StringIO(df.to_csv(index=False))
+            ingest_csv(buffer, model, preserve_ids=True, error_path=os.path.join(workdir, 'rejected.csv'))
+        user = User(username='benchmark', email='benchmark@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'benchmark', 'password': 'benchmark'})
+    timings = {}
+    for route in spec['routes']:
+        response, seconds, memory = _measure(lambda: client.get(route))
+        timings[route] = (seconds, memory, {'status_code': response.status_code})
+    return timings
+
+
+def worker(spec):
+    """Subprocess entry point: generate the data, run one stage, print JSON"""
+    from ml.synthetic_data import generate
+
+    os.chdir(ROOT)
+    donors_df, recipients_df = generate(spec['donors'], spec['recipients'], spec['seed'])
+    if spec['stage'] == 'routes':
+        results = _run_routes(spec, donors_df, recipients_df)
+        output = [
+            {'stage': f'route:{route}', 'seconds': seconds, 'peak_delta_mb': memory, **extra}
+            for route, (seconds, memory, extra) in results.items()
+        ]
+    else:
+        seconds, memory, extra = _run_ml_stage(spec, donors_df, recipients_df)
+        output = [{'stage': spec['stage'], 'seconds': seconds, 'peak_delta_mb': memory, **extra}]
+
+    import resource
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for result in output:
+        result['peak_rss_mb'] = peak_rss_mb
+    print('BENCHMARK_RESULT ' + json.dumps(output))
+
+
+def run_stage(stage, donors, recipients, seed, workdir, model_path, routes, timeout):
+    """Run a stage in a subprocess and return its result dicts"""
+    spec = {
+        'stage': stage, 'donors': donors, 'recipients': recipients, 'seed': seed,
+        'workdir': workdir, 'model_path': model_path, 'routes': routes
+    }
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(spec)],
+            capture_output=True, text=True, timeout=timeout, cwd=ROOT
+        )
+    except subprocess.TimeoutExpired:
+        return [{'stage': stage, 'status': 'timeout', 'seconds': timeout}]
+
+    for line in completed.stdout.splitlines():
+        if line.startswith('BENCHMARK_RESULT '):
+            return [{**result, 'status': 'ok'} for result in json.loads(line.split(' ', 1)[1])]
+    error = (completed.stderr.strip().splitlines() or ['no output'])[-1]
+    return [{'stage': stage, 'status': 'error', 'error': error}]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(sizes, stages, seed=0, routes=None, max_pairs=20_000_000, timeout=3600):
+    """Benchmark every stage at every size; returns the run record"""
+    from ml.synthetic_data import generate
+    from ml.candidates import count_candidate_pairs
+
+    run = {
+        'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': _git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'results': [],
+    }
+    workdir = tempfile.mkdtemp(prefix='organmatch-bench-')
+
+    for size in sizes:
+        donors, recipients = parse_size(size)
+        counts = count_candidate_pairs(*generate(donors, recipients, seed))
+        # The feature pipeline pairs every donor with every same-organ recipient
+        pairs = counts['total_pairs'] - counts['organ_pruned']
+        model_path = os.path.join(workdir, f'model_{size}.joblib')
+        print(f"\n📏 {donors} donors x {recipients} recipients "
+              f"({pairs:,} same-organ pairs, {counts['candidate_pairs']:,} ABO-compatible)")
+
+        size_stages = list(stages) + (['routes'] if routes else [])
+        for stage in size_stages:
+            module = STAGE_MODULES.get(stage)
+            if module and importlib.util.find_spec(module) is None:
+                results = [{'stage': stage, 'status': 'skipped', 'reason': f'{module} is not installed'}]
+            elif stage != 'routes' and pairs > max_pairs:
+                results = [{'stage': stage, 'status': 'skipped', 'reason': f'more than {max_pairs:,} pairs'}]
+            elif stage in ('predict_compatibility', 'get_model_metrics', 'routes') \
+                    and not os.path.exists(model_path):
+                results = [{'stage': stage, 'status': 'skipped', 'reason': 'no model trained at this size'}]
+            else:
+                results = run_stage(stage, donors, recipients, seed, workdir, model_path, routes, timeout)
+
+            for result in results:
+                result.update({'size': size, 'donors': donors, 'recipients': recipients, 'pairs': pairs})
+                if result.get('status') == 'ok' and result['seconds'] > 0 and not result['stage'].startswith('route:'):
+                    result['pairs_per_sec'] = pairs / result['seconds']
+                run['results'].append(result)
+                _print_result(result)
+
+    return run
+
+
+def _print_result(result):
+    label = f"{result['stage']:<28}"
+    if result.get('status') != 'ok':
+        detail = result.get('reason') or result.get('error') or ''
+        print(f"  ⏭️  {label} {result.get('status')} {detail}")
+        return
+    rate = f"{result['pairs_per_sec']:>12,.0f} pairs/s" if 'pairs_per_sec' in result else ''
+    print(f"  ⏱️  {label} {result['seconds']:>9.3f}s  {result['peak_delta_mb']:>8.1f} MB peak  {rate}")
+
+
+def _key(result):
+    return f"{result['stage']}@{result['size']}"
+
+
+def compare_to_baseline(run, baseline):
+    """List of regression descriptions for stages slower or larger than the baseline"""
+    reference = {_key(result): result for result in baseline.get('results', []) if result.get('status') == 'ok'}
+    regressions = []
+    for result in run['results']:
+        before = reference.get(_key(result))
+        if before is None:
+            continue
+        if result.get('status') in ('error', 'timeout'):
+            regressions.append(f"{_key(result)}: {result.get('status')} (baseline {before['seconds']:.3f}s)")
+            continue
+        if result.get('status') != 'ok':
+            continue
+        if result['seconds'] > before['seconds'] * (1 + TIME_TOLERANCE) \
+                and result['seconds'] - before['seconds'] > MIN_TIME_DELTA:
+            regressions.append(f"{_key(result)}: {before['seconds']:.3f}s → {result['seconds']:.3f}s")
+        if result['peak_delta_mb'] > before['peak_delta_mb'] * (1 + MEMORY_TOLERANCE) \
+                and result['peak_delta_mb'] - before['peak_delta_mb'] > MIN_MEMORY_DELTA_MB:
+            regressions.append(f"{_key(result)}: {before['peak_delta_mb']:.0f} MB → {result['peak_delta_mb']:.0f} MB")
+    return regressions
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ML pipeline at increasing data sizes')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='default')
+    parser.add_argument('--sizes', help='Comma-separated DONORSxRECIPIENTS sizes (overrides --preset)')
+    parser.add_argument('--stages', default=','.join(ML_STAGES), help='Comma-separated ML stages to run')
+    parser.add_argument('--routes', nargs='?', const=','.join(DEFAULT_ROUTES),
+                        help='Also time these comma-separated routes through the Flask app')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-pairs', type=int, default=20_000_000,
+                        help='Skip ML stages at sizes with more same-organ pairs than this')
+    parser.add_argument('--timeout', type=int, default=3600, help='Seconds allowed per stage')
+    parser.add_argument('--history', default=HISTORY_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(json.loads(args.worker))
+        return 0
+
+    sizes = args.sizes.split(',') if args.sizes else PRESETS[args.preset]
+    stages = [stage for stage in args.stages.split(',') if stage]
+    routes = args.routes.split(',') if args.routes else None
+
+    print("🚀 OrganMatch scalability benchmark")
+    print("=" * 50)
+    run = run_benchmarks(sizes, stages, args.seed, routes, args.max_pairs, args.timeout)
+
+    history = _load_json(args.history, [])
+    history.append(run)
+    _save_json(args.history, history)
+    print(f"\n📁 Appended results to {args.history}")
+
+    if args.save_baseline:
+        _save_json(args.baseline, run)
+        print(f"📌 Saved baseline to {args.baseline}")
+        return 0
+
+    baseline = _load_json(args.baseline, None)
+    if baseline is None:
+        print("ℹ️  No baseline yet - run with --save-baseline to create one")
+        return 0
+
+    regressions = compare_to_baseline(run, baseline)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) against baseline {baseline.get('commit')}:")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    print(f"\n✅ No regressions against baseline {baseline.get('commit')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
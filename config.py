@@ -23,6 +23,7 @@ class Config:
     
     MODEL_PATH = os.environ.get('MODEL_PATH', 'models/random_forest.joblib')
     MODEL_CONFIG_PATH = os.environ.get('MODEL_CONFIG_PATH', 'models/model_config.json')
+    MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'models/registry')
     
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = int(os.environ.get('PORT', 5000))
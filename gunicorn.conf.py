@@ -1,13 +1,35 @@
 import multiprocessing
 import os
+import shutil
+import tempfile
 
-workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
-threads = int(os.environ.get('GUNICORN_THREADS', 2))
+# Worker models, chosen with GUNICORN_PROFILE and compared with loadtest.py:
+#   sync    - one request at a time per process; CPU-heavy scoring never waits on the GIL
+#   gthread - a few threads per process share its model and caches, overlapping database I/O
+#   gevent  - many concurrent clients per process (pip install gevent); a long /matches
+#             request blocks every other request of its worker until it finishes
+PROFILES = {
+    'sync': {'worker_class': 'sync', 'workers': multiprocessing.cpu_count() * 2 + 1, 'threads': 1},
+    'gthread': {'worker_class': 'gthread', 'workers': multiprocessing.cpu_count() * 2 + 1, 'threads': 2,
+                'worker_connections': 1000},
+    'gevent': {'worker_class': 'gevent', 'workers': multiprocessing.cpu_count() + 1, 'threads': 1,
+               'worker_connections': 1000},
+}
 
-bind = os.environ.get('BIND', '0.0.0.0:5000')
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile not in PROFILES:
+    raise ValueError(f"Unknown GUNICORN_PROFILE {profile!r}; choose one of {', '.join(PROFILES)}")
+
+worker_class = PROFILES[profile]['worker_class']
+workers = int(os.environ.get('GUNICORN_WORKERS') or os.environ.get('WEB_CONCURRENCY')
+              or PROFILES[profile]['workers'])
+# Gunicorn silently turns a sync worker with threads > 1 into gthread, so only gthread takes threads
+threads = int(os.environ.get('GUNICORN_THREADS', PROFILES[profile]['threads'])) if profile == 'gthread' else 1
+if 'worker_connections' in PROFILES[profile]:
+    worker_connections = PROFILES[profile]['worker_connections']
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
 
-worker_class = 'sync'
-worker_connections = 1000
 timeout = 120
 keepalive = 5
 
@@ -23,11 +45,29 @@ enable_stdio_inheritance = True
 
 preload_app = False
 
+# Workers write metrics to per-process files here so /metrics can merge them;
+# must be set before any worker imports prometheus_client
+prometheus_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'organmatch-metrics')
+)
+
 def on_starting(server):
-    print(f"Starting Gunicorn server with {workers} workers and {threads} threads per worker")
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir, exist_ok=True)
+    print(f"Starting Gunicorn server ({profile} profile) with {workers} {worker_class} workers"
+          f"{f' and {threads} threads per worker' if threads > 1 else ''}")
+
+def post_worker_init(worker):
+    # Records time to first request per worker; WARMUP_ON_START=1 also warms the ML stack
+    from startup import init_startup
+    init_startup(worker.wsgi)
 
 def worker_int(worker):
     print(f"Worker {worker.pid} received SIGINT, shutting down gracefully")
 
 def worker_abort(worker):
     print(f"Worker {worker.pid} aborted")
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
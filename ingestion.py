@@ -0,0 +1,257 @@
+"""
+Chunked bulk ingestion of donor and recipient CSV files
+
+Files are streamed in chunks, each chunk is validated and type-converted
+column-wise with pandas, and valid rows are bulk-inserted (executemany, or
+COPY through a staging table on PostgreSQL). Rejected rows are written to an error CSV alongside
+the reason, and an optional ``on_complete`` hook (e.g. auto-retraining)
+fires once after the whole file is loaded. Chunks commit one by one, so
+if a later chunk fails the hook still fires for the rows already
+committed and PartialIngestError reports them.
+
+Usage:
+    from ingestion import ingest_csv
+    summary = ingest_csv(file_or_path, Donor, on_complete=auto_retrain_model)
+"""
+
+import csv
+import io
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, text
+
+from metrics import stage_timer
+from models import db, Donor, Recipient, encode_hla_typing
+from startup import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+FLAG_COLUMNS = {
+    Donor: ['diabetes', 'hypertension', 'smoking', 'alcohol'],
+    Recipient: ['diabetes', 'hypertension'],
+}
+INT_COLUMNS = {
+    Donor: ['age'],
+    Recipient: ['age', 'urgency_level'],
+}
+FLOAT_COLUMNS = {
+    Donor: ['bmi', 'latitude', 'longitude', 'organ_storage_hours', 'organ_size'],
+    Recipient: ['bmi', 'latitude', 'longitude', 'organ_size_needed'],
+}
+TEXT_COLUMNS = {
+    Donor: ['name', 'gender', 'blood_group', 'organ_type', 'hla_typing'],
+    Recipient: ['name', 'gender', 'blood_group', 'organ_needed', 'hla_typing'],
+}
+REQUIRED_COLUMNS = {
+    Donor: ['name', 'organ_type'],
+    Recipient: ['name', 'organ_needed'],
+}
+BLOOD_GROUPS = {'A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'}
+
+
+class PartialIngestError(RuntimeError):
+    """A chunk failed after earlier chunks were committed; ``summary`` counts those"""
+
+    def __init__(self, summary):
+        super().__init__(f"Ingest of {summary['table']} stopped after {summary['inserted']} rows: "
+                         f"{summary['error']}")
+        self.summary = summary
+
+
+def validate_chunk(chunk, model, defaults=None, preserve_ids=False):
+    """Split a raw string chunk into (records DataFrame, rejected DataFrame)"""
+    errors = pd.Series('', index=chunk.index)
+    records = pd.DataFrame(index=chunk.index)
+
+    def reject(mask, message):
+        errors[mask & (errors == '')] = message
+
+    for column in TEXT_COLUMNS[model]:
+        if column in chunk:
+            values = chunk[column].astype('string').str.strip()
+            records[column] = values.mask(values == '')
+        else:
+            records[column] = pd.NA
+
+    for column in REQUIRED_COLUMNS[model]:
+        reject(records[column].isna(), f"missing {column}")
+
+    for column in INT_COLUMNS[model] + FLOAT_COLUMNS[model] + FLAG_COLUMNS[model] + (['id'] if preserve_ids else []):
+        if column not in chunk:
+            records[column] = np.nan
+            continue
+        raw = chunk[column].astype('string').str.strip()
+        values = pd.to_numeric(raw, errors='coerce')
+        reject(values.isna() & raw.notna() & (raw != ''), f"invalid {column}")
+        if column not in FLOAT_COLUMNS[model]:
+            reject(values.notna() & (values % 1 != 0), f"{column} must be a whole number")
+        records[column] = values
+
+    for column, value in (defaults or {}).items():
+        records[column] = records[column].fillna(value)
+    for column in FLAG_COLUMNS[model]:
+        records[column] = records[column].fillna(0)
+        reject(~records[column].isin([0, 1]), f"{column} must be 0 or 1")
+
+    reject(records['latitude'].notna() & ~records['latitude'].between(-90, 90), "latitude out of range")
+    reject(records['longitude'].notna() & ~records['longitude'].between(-180, 180), "longitude out of range")
+    reject(records['age'].notna() & (records['age'] < 0), "age must not be negative")
+
+    blood_group = records['blood_group'].str.upper()
+    reject(blood_group.notna() & ~blood_group.isin(BLOOD_GROUPS), "unknown blood_group")
+    records['blood_group'] = blood_group
+
+    valid = errors == ''
+    rejected = chunk[~valid].copy()
+    rejected['error'] = errors[~valid]
+    return records[valid], rejected
+
+
+def _to_rows(records, model, connection, hla_cache):
+    """Plain dicts ready for executemany, with HLA bitsets encoded"""
+    now = datetime.utcnow()
+    records = records.astype(object).where(records.notna(), None)
+    int_columns = INT_COLUMNS[model] + FLAG_COLUMNS[model] + (['id'] if 'id' in records else [])
+    rows = records.to_dict('records')
+    for row in rows:
+        for column in int_columns:
+            if row.get(column) is not None:
+                row[column] = int(row[column])
+        typing = row['hla_typing']
+        if typing not in hla_cache:
+            hla_cache[typing] = encode_hla_typing(connection, typing)
+        row['hla_bits'] = hla_cache[typing]
+        row['created_at'] = now
+        row['updated_at'] = now
+    return rows
+
+
+def _copy_rows(rows, model, connection):
+    """Load rows with PostgreSQL COPY through the session's DBAPI connection; returns their ids.
+
+    COPY has no RETURNING, so the rows go to a temporary staging table and
+    one INSERT ... SELECT ... RETURNING moves them over; ids read back from
+    max(id) would be wrong with concurrent writers or preserved ids.
+    """
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            '' if row[column] is None
+            else '\\x' + row[column].hex() if isinstance(row[column], bytes)
+            else row[column]
+            for column in columns
+        ])
+    buffer.seek(0)
+    table, column_list = model.__tablename__, ', '.join(columns)
+    staging = f'{table}_staging'
+    cursor = connection.connection.dbapi_connection.cursor()
+    # Built from the table, not LIKE it: no NOT NULL id and no default drawing from its sequence
+    cursor.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA")
+    cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    cursor.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} RETURNING id")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _use_copy(connection):
+    return connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2'
+
+
+def ingest_csv(source, model, chunk_size=5000, error_path=None, defaults=None, preserve_ids=False,
+               progress=None, on_complete=None):
+    """Stream a CSV into ``model``'s table.
+
+    ``source`` is a path or file object. ``progress(summary)`` is called
+    after each committed chunk and ``on_complete(summary)`` once at the
+    end if any rows were inserted, also when a later chunk failed (the
+    summary then carries 'error'). Rejected rows go to ``error_path``
+    (default: next to an uploaded path, else uploads/) and the summary
+    dict reports counts, the error file and timing. A failure after
+    earlier chunks were committed raises PartialIngestError.
+    """
+    started = time.perf_counter()
+    summary = {
+        'table': model.__tablename__,
+        'inserted': 0,
+        'rejected': 0,
+        'chunks': 0,
+        'error_file': None,
+        'first_id': None,
+        'last_id': None,
+    }
+    if error_path is None:
+        base = os.path.splitext(source)[0] if isinstance(source, str) else os.path.join('uploads', model.__tablename__)
+        error_path = f"{base}_rejected_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.csv"
+
+    hla_cache = {}
+    error_file = None
+    failure = None
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                                 skipinitialspace=True):
+            chunk.columns = [column.strip() for column in chunk.columns]
+            records, rejected = validate_chunk(chunk, model, defaults, preserve_ids)
+
+            if len(rejected):
+                if error_file is None:
+                    os.makedirs(os.path.dirname(error_path) or '.', exist_ok=True)
+                    error_file = open(error_path, 'w', newline='')
+                    rejected.to_csv(error_file, index=False)
+                else:
+                    rejected.to_csv(error_file, index=False, header=False)
+                summary['rejected'] += len(rejected)
+
+            if len(records):
+                with stage_timer('ingest', items=len(records)):
+                    connection = db.session.connection()
+                    rows = _to_rows(records, model, connection, hla_cache)
+                    if _use_copy(connection):
+                        ids = _copy_rows(rows, model, connection)
+                        # COPY bypasses the ORM events that bump the data version
+                        db.session.info['data_changed'] = True
+                    else:
+                        ids = db.session.execute(insert(model).returning(model.id), rows).scalars().all()
+                    db.session.commit()
+
+                # Preserved ids need not ascend from chunk to chunk
+                summary['first_id'] = min(ids) if summary['first_id'] is None else min(summary['first_id'], min(ids))
+                summary['last_id'] = max(ids) if summary['last_id'] is None else max(summary['last_id'], max(ids))
+                summary['inserted'] += len(rows)
+
+            summary['chunks'] += 1
+            if progress is not None:
+                progress(dict(summary))
+    except Exception as e:
+        db.session.rollback()
+        failure = e
+    finally:
+        if error_file is not None:
+            error_file.close()
+            summary['error_file'] = error_path
+    if failure is not None and not summary['inserted']:
+        raise failure
+
+    if preserve_ids and summary['inserted'] and db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            f"SELECT setval('{model.__tablename__}_id_seq', (SELECT MAX(id) FROM {model.__tablename__}))"
+        ))
+        db.session.commit()
+
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    if failure is not None:
+        summary['error'] = str(failure)
+    if on_complete is not None and summary['inserted']:
+        on_complete(summary)
+    if failure is not None:
+        raise PartialIngestError(summary) from failure
+    return summary
+
+
+def print_progress(summary):
+    """Console progress callback for CLI use"""
+    print(f"  → {summary['table']}: {summary['inserted']} inserted, "
+          f"{summary['rejected']} rejected ({summary['chunks']} chunks)")
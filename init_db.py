@@ -10,13 +10,60 @@ This script will:
 1. Create all database tables
 2. Create a test user (username: admin, password: admin123)
 3. Load sample donor and recipient data
+
+Maintenance commands:
+    python init_db.py --create-user <username> <email> <password>
+    python init_db.py --backfill-hla
+    python init_db.py --upgrade        # add new columns/indexes to an existing database
 """
 
 import os
 import sys
+from datetime import datetime
 from app import app, db
-from models import User, Donor, Recipient
-import pandas as pd
+from models import User, Donor, Recipient, SystemLog, encode_hla_typing
+from ingestion import ingest_csv, print_progress
+from sqlalchemy import bindparam, inspect, select, text, update
+
+LEGACY_LOG_TIMESTAMP = datetime(1970, 1, 1)
+
+def upgrade_schema():
+    """Add columns and indexes introduced after a table was first created (create_all skips them).
+
+    Also dates log entries that have no timestamp, which older schemas allowed.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = inspector.get_table_names()
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"  → Added column {table.name}.{column.name}")
+    
+    # Older databases allowed log entries without a timestamp, which the
+    # (timestamp, id) log paging cannot order; date them to the epoch
+    if 'system_logs' in existing_tables:
+        missing = db.session.execute(
+            update(SystemLog).where(SystemLog.timestamp.is_(None)).values(timestamp=LEGACY_LOG_TIMESTAMP)
+        ).rowcount
+        if missing:
+            print(f"  → Dated {missing} log entries without a timestamp to {LEGACY_LOG_TIMESTAMP:%Y-%m-%d}")
+    db.session.commit()
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine)
+                print(f"  → Created index {index.name}")
 
 def init_database():
     """Initialize database with tables and sample data"""
@@ -28,6 +75,7 @@ def init_database():
         # Create all tables
         print("📋 Creating database tables...")
         db.create_all()
+        upgrade_schema()
         print("✅ Database tables created successfully!")
         
         # Check if admin user exists
@@ -51,51 +99,16 @@ def init_database():
         if donor_count == 0 or recipient_count == 0:
             print("\n📥 Loading sample data...")
             try:
-                donors_csv = pd.read_csv('data/donors_sample.csv')
-                recipients_csv = pd.read_csv('data/recipients_sample.csv')
-                
-                for _, row in donors_csv.iterrows():
-                    donor = Donor(
-                        id=row['id'],
-                        name=row['name'],
-                        age=row.get('age'),
-                        gender=row.get('gender'),
-                        blood_group=row.get('blood_group'),
-                        organ_type=row['organ_type'],
-                        bmi=row.get('bmi'),
-                        hla_typing=row.get('hla_typing'),
-                        latitude=row.get('latitude'),
-                        longitude=row.get('longitude'),
-                        organ_storage_hours=row.get('organ_storage_hours'),
-                        organ_size=row.get('organ_size'),
-                        diabetes=row.get('diabetes', 0),
-                        hypertension=row.get('hypertension', 0),
-                        smoking=row.get('smoking', 0),
-                        alcohol=row.get('alcohol', 0)
-                    )
-                    db.session.merge(donor)
-                
-                for _, row in recipients_csv.iterrows():
-                    recipient = Recipient(
-                        id=row['id'],
-                        name=row['name'],
-                        age=row.get('age'),
-                        gender=row.get('gender'),
-                        blood_group=row.get('blood_group'),
-                        organ_needed=row['organ_needed'],
-                        bmi=row.get('bmi'),
-                        hla_typing=row.get('hla_typing'),
-                        latitude=row.get('latitude'),
-                        longitude=row.get('longitude'),
-                        organ_size_needed=row.get('organ_size_needed'),
-                        diabetes=row.get('diabetes', 0),
-                        hypertension=row.get('hypertension', 0),
-                        urgency_level=row.get('urgency_level', 5)
-                    )
-                    db.session.merge(recipient)
+                if donor_count == 0:
+                    donors = ingest_csv('data/donors_sample.csv', Donor, preserve_ids=True,
+                                        progress=print_progress)
+                    donor_count = donors['inserted']
+                if recipient_count == 0:
+                    recipients = ingest_csv('data/recipients_sample.csv', Recipient, preserve_ids=True,
+                                            defaults={'urgency_level': 5}, progress=print_progress)
+                    recipient_count = recipients['inserted']
                 
-                db.session.commit()
-                print(f"✅ Loaded {len(donors_csv)} donors and {len(recipients_csv)} recipients")
+                print(f"✅ Loaded {donor_count} donors and {recipient_count} recipients")
             except FileNotFoundError as e:
                 print(f"⚠️  Could not load sample data: {str(e)}")
                 print("   Sample data files not found. You can add data manually through the UI.")
@@ -129,6 +142,44 @@ def create_user(username, email, password):
         print(f"✅ User '{username}' created successfully!")
         return True
 
+def backfill_hla_bits(batch_size=1000):
+    """Encode the HLA typing of existing donors and recipients into allele bitsets"""
+    with app.app_context():
+        print("🧬 Backfilling HLA allele bitsets...")
+        db.create_all()
+        upgrade_schema()
+        
+        for model in (Donor, Recipient):
+            encoded = 0
+            last_id = 0
+            table = model.__table__
+            # Setting updated_at to itself keeps the onupdate timestamp from firing:
+            # the rows' data did not change, so caches keyed on it must stay valid
+            set_bits = update(table).where(table.c.id == bindparam('row_id')).values(
+                hla_bits=bindparam('bits'), updated_at=table.c.updated_at
+            )
+            while True:
+                rows = db.session.execute(
+                    select(table.c.id, table.c.hla_typing)
+                    .where(table.c.id > last_id, table.c.hla_bits.is_(None), table.c.hla_typing.isnot(None))
+                    .order_by(table.c.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                
+                connection = db.session.connection()
+                values = [{'row_id': row.id, 'bits': encode_hla_typing(connection, row.hla_typing)} for row in rows]
+                values = [value for value in values if value['bits'] is not None]
+                if values:
+                    db.session.execute(set_bits, values)
+                encoded += len(values)
+                last_id = rows[-1].id
+                db.session.commit()
+            
+            print(f"  ✅ Encoded {encoded} {model.__tablename__}")
+        
+        print("✅ HLA backfill complete!")
+
 if __name__ == '__main__':
     try:
         import sys
@@ -143,6 +194,13 @@ if __name__ == '__main__':
             email = sys.argv[3]
             password = sys.argv[4]
             create_user(username, email, password)
+        elif len(sys.argv) > 1 and sys.argv[1] == '--backfill-hla':
+            backfill_hla_bits()
+        elif len(sys.argv) > 1 and sys.argv[1] == '--upgrade':
+            with app.app_context():
+                db.create_all()
+                upgrade_schema()
+            print("✅ Schema is up to date")
         else:
             init_database()
     except Exception as e:
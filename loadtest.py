@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+End-to-end HTTP load test of the OrganMatch web app under gunicorn
+
+A scratch directory gets a SQLite database seeded with synthetic donors and
+recipients (ml.synthetic_data), a user, and a trained model. Then gunicorn
+is started on it once per worker profile from gunicorn.conf.py (sync,
+gthread, gevent). Each virtual user logs in and replays a weighted mix of
+the app's traffic over a keep-alive connection until the run ends:
+dashboard and listings, the CPU-heavy /matches page, /api/predict, CSV
+uploads and retrain triggers. Requests made during the warm-up are
+discarded. Throughput and p50/p95/p99 latency are reported per route and
+profile, and optionally saved as JSON.
+
+Usage:
+    python loadtest.py                                    # gthread profile, 16 users for 60s
+    python loadtest.py --profiles sync,gthread,gevent --users 32 --duration 120 --output benchmarks/loadtest.json
+    python loadtest.py --size 2000x10000 --mix matches=20,predict=20,upload=0
+    python loadtest.py --url http://staging:5000 --username admin --password ...   # existing server, no seeding
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+PROFILES = ['sync', 'gthread', 'gevent']
+DEFAULT_SIZE = '300x1000'
+LOADTEST_USER = ('loadtest', 'loadtest')
+UPLOAD_ROWS = 5
+READY_TIMEOUT = 300
+REQUEST_TIMEOUT = 120
+
+# Relative request weights of the traffic mix
+DEFAULT_MIX = {
+    'login': 2,
+    'dashboard': 10,
+    'donors': 12,
+    'recipients': 12,
+    'matches': 8,
+    'predict': 15,
+    'upload': 1,
+    'retrain': 0.5,
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def parse_mix(text):
+    """'matches=20,upload=0' on top of DEFAULT_MIX"""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (text or '').split(',')):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown route {name!r} in --mix; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def seed(spec):
+    """Subprocess entry point: create the scratch database, user and model"""
+    import io
+
+    from ml.synthetic_data import generate
+
+    from app import app
+    from ingestion import ingest_csv
+    from models import db, User, Donor, Recipient
+
+    donors_df, recipients_df = generate(spec['donors'], spec['recipients'], spec['seed'])
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for df, model in ((donors_df, Donor), (recipients_df, Recipient)):
+            ingest_csv(io.StringIO(df.to_csv(index=False)), model, preserve_ids=True)
+        user = User(username=LOADTEST_USER[0], email='loadtest@example.com')
+        user.set_password(LOADTEST_USER[1])
+        db.session.add(user)
+        db.session.commit()
+
+    from ml.retrain_worker import run_retrain
+    result = run_retrain(os.environ['DATABASE_URL'])
+    if result['status'] != 'success':
+        raise RuntimeError(f"Training the load-test model failed: {result['message']}")
+    upload_df = generate(UPLOAD_ROWS, 0, spec['seed'] + 1)[0].drop(columns=['id'])
+    upload_df.to_csv(spec['upload_path'], index=False)
+
+
+def server_env(workdir, profile=None, workers=None, port=None):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'SESSION_SECRET': 'loadtest',
+        'MODEL_REGISTRY_DIR': os.path.join(workdir, 'models', 'registry'),
+        'MODEL_PATH': os.path.join(workdir, 'models', 'random_forest.joblib'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+    })
+    if profile:
+        env['GUNICORN_PROFILE'] = profile
+        env['BIND'] = f'127.0.0.1:{port}'
+        # Not the real server's metrics directory, which gunicorn clears on start
+        env['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(workdir, 'metrics')
+        if workers:
+            env['GUNICORN_WORKERS'] = str(workers)
+    return env
+
+
+def _free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, profile, workers=None, app_module='app:app'):
+    """Start gunicorn with ``profile`` on a free port; returns (process, base_url, log_path)"""
+    port = _free_port()
+    log_path = os.path.join(workdir, f'gunicorn-{profile}.log')
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'), app_module],
+            cwd=workdir, env=server_env(workdir, profile, workers, port), stdout=log, stderr=subprocess.STDOUT
+        )
+    base_url = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    while time.perf_counter() - started < READY_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn ({profile}) exited with code {process.returncode}; see {log_path}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/login')
+            connection.getresponse().read()
+            connection.close()
+            return process, base_url, log_path
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"gunicorn ({profile}) did not answer within {READY_TIMEOUT}s; see {log_path}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class VirtualUser:
+    """One browser-like client: its own session cookie and keep-alive connection"""
+
+    def __init__(self, base_url, credentials, n_donors, n_recipients, upload_csv, rng):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self.https = parsed.scheme == 'https'
+        self.credentials = credentials
+        self.n_donors = n_donors
+        self.n_recipients = n_recipients
+        self.upload_csv = upload_csv
+        self.rng = rng
+        self.cookies = {}
+        self.connection = None
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.connection = connection_class(self.host, self.port, timeout=REQUEST_TIMEOUT)
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, seconds); reconnects once if the server closed the connection"""
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in (0, 1):
+            if self.connection is None:
+                self._connect()
+            started = time.perf_counter()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+                continue
+            seconds = time.perf_counter() - started
+            for header in response.headers.get_all('Set-Cookie') or []:
+                name, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[name.strip()] = value.strip()
+            if response.getheader('Connection', '').lower() == 'close':
+                self.connection.close()
+                self.connection = None
+            return response.status, seconds
+
+    def login(self):
+        self.cookies.clear()
+        body = urllib.parse.urlencode({'username': self.credentials[0], 'password': self.credentials[1]})
+        return self.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def predict(self):
+        body = json.dumps({'donor_id': self.rng.randint(1, self.n_donors),
+                           'recipient_id': self.rng.randint(1, self.n_recipients)})
+        return self.request('POST', '/api/predict', body, {'Content-Type': 'application/json'})
+
+    def upload(self):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="donor_file"; filename="donors.csv"\r\n'
+                f'Content-Type: text/csv\r\n\r\n').encode() + self.upload_csv + f'\r\n--{boundary}--\r\n'.encode()
+        return self.request('POST', '/upload', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+    def run(self, route):
+        if route == 'login':
+            return self.login()
+        if route == 'predict':
+            return self.predict()
+        if route == 'upload':
+            return self.upload()
+        if route == 'retrain':
+            return self.request('POST', '/api/retrain')
+        return self.request('GET', f'/{route}')
+
+
+def run_load(base_url, mix, users=16, duration=60.0, warmup=10.0, credentials=LOADTEST_USER,
+             n_donors=1, n_recipients=1, upload_csv=b'', seed=0):
+    """Drive ``users`` virtual users for warmup + duration seconds; returns per-route samples"""
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+    samples = {route: [] for route in routes}
+    errors = {route: {} for route in routes}
+    lock = threading.Lock()
+
+    def user_loop(index):
+        rng = random.Random(seed * 1000 + index)
+        user = VirtualUser(base_url, credentials, n_donors, n_recipients, upload_csv, rng)
+        try:
+            user.login()
+        except (OSError, http.client.HTTPException):
+            pass
+        while time.perf_counter() < stop_at:
+            route = rng.choices(routes, weights)[0]
+            try:
+                status, seconds = user.run(route)
+            except (OSError, http.client.HTTPException) as e:
+                user.connection = None
+                status, seconds = type(e).__name__, REQUEST_TIMEOUT
+            finished = time.perf_counter()
+            if finished < measure_from or finished > stop_at:
+                continue
+            with lock:
+                if isinstance(status, int) and status < 400:
+                    samples[route].append(seconds)
+                else:
+                    errors[route][str(status)] = errors[route].get(str(status), 0) + 1
+
+    threads = [threading.Thread(target=user_loop, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=warmup + duration + REQUEST_TIMEOUT)
+    return summarize(samples, errors, duration)
+
+
+def summarize(samples, errors, duration):
+    """{route: stats} plus an 'all' row; latencies in milliseconds"""
+    def stats(latencies, failures):
+        latencies = sorted(latencies)
+        n_errors = sum(failures.values())
+        return {
+            'requests': len(latencies) + n_errors,
+            'errors': n_errors,
+            'error_statuses': failures,
+            'throughput': round((len(latencies) + n_errors) / duration, 2),
+            **{name: round(percentile(latencies, fraction) * 1000, 1) if latencies else None
+               for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99), ('max_ms', 1.0))},
+        }
+
+    report = {route: stats(samples[route], errors[route]) for route in samples}
+    all_errors = {}
+    for failures in errors.values():
+        for status, count in failures.items():
+            all_errors[status] = all_errors.get(status, 0) + count
+    report['all'] = stats([s for latencies in samples.values() for s in latencies], all_errors)
+    return report
+
+
+def print_report(profile, report):
+    print(f"\n📊 {profile}")
+    print(f"   {'route':<12} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, row in report.items():
+        cells = [f"{row[key]:>9.1f}" if row[key] is not None else f"{'-':>9}"
+                 for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"   {route:<12} {row['requests']:>7} {row['errors']:>5} {row['throughput']:>8.1f} {' '.join(cells)}")
+        if row['errors']:
+            print(f"   {'':<12} errors by status: {row['error_statuses']}")
+
+
+def print_comparison(results):
+    print("\n🏁 Profiles (all routes; /matches p95)")
+    for profile, result in results.items():
+        total, matches = result['routes']['all'], result['routes'].get('matches', {})
+        print(f"   {profile:<8} {total['throughput']:>8.1f} req/s  p95 {total['p95_ms']} ms  "
+              f"p99 {total['p99_ms']} ms  errors {total['errors']}  /matches p95 {matches.get('p95_ms')} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the web app under each gunicorn worker profile')
+    parser.add_argument('--profiles', default='gthread', help=f"Comma-separated profiles ({', '.join(PROFILES)})")
+    parser.add_argument('--workers', type=int, help='Workers per server (default: the profile\'s own)')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60.0, help='Measured seconds per profile')
+    parser.add_argument('--warmup', type=float, default=10.0, help='Unmeasured seconds before each measurement')
+    parser.add_argument('--mix', help='Route weights over the defaults, e.g. matches=20,upload=0')
+    parser.add_argument('--size', default=DEFAULT_SIZE, help='Seeded DONORSxRECIPIENTS')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--app', default='app:app', help='WSGI application for gunicorn')
+    parser.add_argument('--url', help='Load an already running server instead of starting gunicorn')
+    parser.add_argument('--username', default=LOADTEST_USER[0])
+    parser.add_argument('--password', default=LOADTEST_USER[1])
+    parser.add_argument('--workdir', help='Keep the scratch database and server logs here')
+    parser.add_argument('--output', help='Append the results to this JSON file')
+    parser.add_argument('--seed-worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed_worker:
+        seed(json.loads(args.seed_worker))
+        return 0
+
+    try:
+        mix = parse_mix(args.mix)
+        n_donors, n_recipients = (int(n) for n in args.size.lower().split('x'))
+    except ValueError as e:
+        parser.error(str(e))
+    profiles = [profile for profile in args.profiles.split(',') if profile]
+    unknown = set(profiles) - set(PROFILES)
+    if unknown and not args.url:
+        parser.error(f"unknown profiles: {', '.join(sorted(unknown))}")
+
+    print("🚀 OrganMatch load test")
+    print("=" * 50)
+    print(f"👥 {args.users} users, {args.warmup:.0f}s warm-up + {args.duration:.0f}s per profile; mix "
+          + ', '.join(f'{route}={weight:g}' for route, weight in mix.items()))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='organmatch-loadtest-')
+    os.makedirs(workdir, exist_ok=True)
+    upload_path = os.path.join(workdir, 'upload_donors.csv')
+    results = {}
+    try:
+        if args.url:
+            from ml.synthetic_data import generate
+            generate(UPLOAD_ROWS, 0, args.seed + 1)[0].drop(columns=['id']).to_csv(upload_path, index=False)
+            targets = [('external', None)]
+        else:
+            print(f"🌱 Seeding {n_donors} donors x {n_recipients} recipients and training a model in {workdir}...")
+            spec = {'donors': n_donors, 'recipients': n_recipients, 'seed': args.seed, 'upload_path': upload_path}
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--seed-worker', json.dumps(spec)],
+                           cwd=workdir, env=server_env(workdir), check=True)
+            targets = [(profile, profile) for profile in profiles]
+        with open(upload_path, 'rb') as f:
+            upload_csv = f.read()
+
+        for name, profile in targets:
+            process = None
+            base_url = args.url
+            if profile:
+                print(f"\n🔧 Starting gunicorn with the {profile} profile...")
+                process, base_url, log_path = start_server(workdir, profile, args.workers, args.app)
+            try:
+                print(f"🔥 Loading {base_url}...")
+                report = run_load(base_url, mix, args.users, args.duration, args.warmup,
+                                  (args.username, args.password), n_donors, n_recipients, upload_csv, args.seed)
+            finally:
+                if process is not None:
+                    stop_server(process)
+            results[name] = {'routes': report}
+            print_report(name, report)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if len(results) > 1:
+        print_comparison(results)
+    if args.output:
+        history = []
+        if os.path.exists(args.output):
+            with open(args.output) as f:
+                history = json.load(f)
+        history.append({
+            'timestamp': datetime.utcnow().isoformat(),
+            'users': args.users,
+            'duration': args.duration,
+            'size': args.size,
+            'workers': args.workers,
+            'mix': mix,
+            'profiles': results,
+        })
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(history, f, indent=2)
+        print(f"\n📁 Appended results to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Asynchronous, batched SystemLog writer with retention and keyset paging
+
+``log_event()`` only appends to an in-memory queue; every
+``flush_interval`` seconds a background thread writes what has queued up
+with one executemany INSERT per ``batch_size`` entries, so requests no longer
+open a write transaction just to log. The same thread deletes entries
+older than LOG_RETENTION_DAYS in small batches, using the timestamp index.
+
+Reads page by (timestamp, id) instead of OFFSET, so every page is one
+index range scan regardless of depth, optionally filtered by level and
+category.
+
+Usage:
+    from log_sink import init_log_sink, log_event, logs_page
+    init_log_sink(app)
+    log_event("Model retrained", level='success', category='ml')
+    entries, next_cursor = logs_page(cursor=request.args.get('cursor'), level='error')
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, insert, or_, select
+
+from models import db, SystemLog
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', 30))
+PURGE_INTERVAL = 3600
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+logs = SystemLog.__table__
+
+
+def purge_logs(engine, retention_days=DEFAULT_RETENTION_DAYS, batch_size=5000):
+    """Delete entries older than ``retention_days`` in short transactions; returns rows deleted"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            ids = connection.execute(
+                select(logs.c.id).where(logs.c.timestamp < cutoff)
+                .order_by(logs.c.timestamp).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return deleted
+            connection.execute(delete(logs).where(logs.c.id.in_(ids)))
+        deleted += len(ids)
+
+
+class LogSink:
+    """Queue plus writer thread that flushes log entries in batches"""
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_queue=DEFAULT_MAX_QUEUE, retention_days=DEFAULT_RETENTION_DAYS):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._last_purge = 0.0
+
+    def start(self):
+        """Start (or, after a fork, restart) the writer thread"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+        self._thread.start()
+
+    def log(self, message, level='info', category='general'):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self._queue.put_nowait({
+                'timestamp': datetime.utcnow(),
+                'level': level,
+                'message': message,
+                'category': category
+            })
+        except queue.Full:
+            # Never block a request on logging; the count shows up in close()
+            self.dropped += 1
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._write_lock:
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(logs), batch)
+            except Exception as e:
+                print(f"❌ Failed to write {len(batch)} log entries: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self._maybe_purge()
+
+    def _maybe_purge(self):
+        if not self.retention_days or time.monotonic() - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            deleted = purge_logs(self.engine, self.retention_days)
+            if deleted:
+                print(f"🧹 Removed {deleted} log entries older than {self.retention_days} days")
+        except Exception as e:
+            print(f"❌ Log retention failed: {e}")
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        self.flush()
+        if self.dropped:
+            print(f"⚠️  {self.dropped} log entries were dropped because the queue was full")
+
+
+_sink = None
+
+
+def init_log_sink(app, **options):
+    """Create the process-wide sink for ``app`` and flush it at exit"""
+    global _sink
+    with app.app_context():
+        _sink = LogSink(db.engine, **options)
+    _sink.start()
+    atexit.register(_sink.close)
+    return _sink
+
+
+def log_event(message, level='info', category='general'):
+    """Queue a SystemLog entry; written synchronously if no sink was started"""
+    if _sink is not None:
+        _sink.log(message, level, category)
+        return
+    db.session.add(SystemLog(message=message, level=level, category=category))
+    db.session.commit()
+
+
+def encode_cursor(entry):
+    return f"{entry.timestamp.strftime('%Y%m%d%H%M%S%f')}-{entry.id}"
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor string; ValueError if malformed"""
+    stamp, _, entry_id = cursor.partition('-')
+    return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(entry_id)
+
+
+def logs_page(cursor=None, limit=DEFAULT_PAGE_SIZE, level=None, category=None):
+    """Newest-first page of log entries after ``cursor``.
+
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    query = SystemLog.query
+    if level:
+        query = query.filter(SystemLog.level == level)
+    if category:
+        query = query.filter(SystemLog.category == category)
+    if cursor:
+        timestamp, entry_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            SystemLog.timestamp < timestamp,
+            and_(SystemLog.timestamp == timestamp, SystemLog.id < entry_id)
+        ))
+    entries = query.order_by(SystemLog.timestamp.desc(), SystemLog.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+    return entries[:limit], next_cursor
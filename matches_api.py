@@ -0,0 +1,230 @@
+"""
+JSON matching API over the stored pair scores
+
+``/api/matches`` pages through pair_scores best first with an opaque
+keyset cursor (score, id, model version), optionally filtered by organ
+type, recipient, donor and minimum score; ``?format=ndjson`` streams every
+matching row as newline-delimited JSON instead, read with ``yield_per``.
+
+Every response carries an ETag built from the model version, the
+``data_versions`` counter (bumped in the same transaction as any write to
+donors, recipients or pair scores) and the query, plus Last-Modified. A
+poll with a matching If-None-Match (or an If-Modified-Since that is not
+older) gets a 304 after a few primary-key lookups, without touching the
+scores.
+
+Usage:
+    from matches_api import init_matches_api
+    init_matches_api(app)
+
+    GET /api/matches?organ=Kidney&min_score=70&limit=100
+    GET /api/matches?cursor=<next_cursor from the previous page>
+    GET /api/matches?recipient_id=12&format=ndjson
+"""
+
+import base64
+import hashlib
+import json
+import math
+
+from sqlalchemy import and_, or_, select
+from werkzeug.http import http_date, parse_date
+
+from models import db, DATA_VERSION_NAME, DataVersion, PairScore, PairScoreRun, Recipient
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 2000
+
+
+class CursorError(ValueError):
+    pass
+
+
+def number_arg(args, name, cast):
+    """Query parameter ``name`` converted with ``cast`` (None if absent).
+
+    Unlike ``args.get(name, type=...)``, which silently drops a value it
+    cannot convert, a malformed value raises ValueError.
+    """
+    raw = args.get(name)
+    if raw is None or raw == '':
+        return None
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {raw!r}")
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid {name}: {raw!r}")
+    return value
+
+
+def encode_cursor(score, score_id, model_version):
+    raw = json.dumps([score, score_id, model_version], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(score, id, model_version) from a cursor; CursorError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, score_id, model_version = json.loads(raw)
+        return float(score), int(score_id), str(model_version)
+    except (ValueError, TypeError) as e:
+        raise CursorError(f"Invalid cursor: {e}")
+
+
+def data_version():
+    """(version, updated_at) of the match data; (0, None) before the first write"""
+    row = db.session.get(DataVersion, DATA_VERSION_NAME)
+    return (row.version, row.updated_at) if row is not None else (0, None)
+
+
+def scored_version(requested=None):
+    """Model version to serve: the requested one, else the current one once it has
+    been scored, else the most recently completed scoring run"""
+    from ml.score_store import model_version_for
+
+    if requested:
+        return requested
+    try:
+        current = model_version_for()
+    except OSError:
+        current = None
+    if current and db.session.get(PairScoreRun, current) is not None:
+        return current
+    latest = db.session.execute(
+        select(PairScoreRun.model_version).order_by(PairScoreRun.completed_at.desc()).limit(1)
+    ).scalar()
+    return latest or current
+
+
+def filtered_query(model_version, organ=None, recipient_id=None, donor_id=None, min_score=None):
+    query = select(PairScore).where(PairScore.model_version == model_version)
+    if organ:
+        query = query.join(Recipient, Recipient.id == PairScore.recipient_id).where(Recipient.organ_needed == organ)
+    if recipient_id is not None:
+        query = query.where(PairScore.recipient_id == recipient_id)
+    if donor_id is not None:
+        query = query.where(PairScore.donor_id == donor_id)
+    if min_score is not None:
+        query = query.where(PairScore.compatibility_score >= min_score)
+    return query.order_by(PairScore.compatibility_score.desc(), PairScore.id)
+
+
+def matches_page(model_version, cursor=None, limit=DEFAULT_PAGE_SIZE, **filters):
+    """Best-first page of scores after ``cursor``; returns (scores, next_cursor)"""
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    query = filtered_query(model_version, **filters)
+    if cursor:
+        score, score_id, cursor_version = decode_cursor(cursor)
+        if cursor_version != model_version:
+            raise CursorError("Cursor belongs to another model version; restart from the first page")
+        query = query.where(or_(
+            PairScore.compatibility_score < score,
+            and_(PairScore.compatibility_score == score, PairScore.id > score_id)
+        ))
+    scores = db.session.execute(query.limit(limit + 1)).scalars().all()
+    next_cursor = None
+    if len(scores) > limit:
+        last = scores[limit - 1]
+        next_cursor = encode_cursor(last.compatibility_score, last.id, model_version)
+    return scores[:limit], next_cursor
+
+
+def stream_ndjson(model_version, chunk_size=STREAM_CHUNK_SIZE, **filters):
+    """Generator of NDJSON text, one chunk of rows per yielded string"""
+    query = filtered_query(model_version, **filters).with_only_columns(
+        PairScore.donor_id, PairScore.recipient_id, PairScore.compatibility_score, PairScore.scored_at
+    )
+    result = db.session.execute(query.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        yield ''.join(
+            json.dumps({
+                'donor_id': donor_id,
+                'recipient_id': recipient_id,
+                'model_version': model_version,
+                'compatibility_score': score,
+                'scored_at': scored_at.strftime('%Y-%m-%d %H:%M:%S') if scored_at else None
+            }) + '\n'
+            for donor_id, recipient_id, score, scored_at in partition
+        )
+
+
+def _validators(model_version, version, updated_at, args):
+    """(etag, last_modified) for one representation"""
+    query = '&'.join(f'{key}={args.get(key)}' for key in sorted(args) if args.get(key) is not None)
+    digest = hashlib.sha1(f'{model_version}|{version}|{query}'.encode()).hexdigest()[:20]
+    last_modified = updated_at
+    if model_version:
+        run = db.session.get(PairScoreRun, model_version)
+        if run is not None and run.completed_at and (last_modified is None or run.completed_at > last_modified):
+            last_modified = run.completed_at
+    return f'"{digest}"', last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        since = parse_date(if_modified_since)
+        return since is not None and last_modified.replace(microsecond=0) <= since.replace(tzinfo=None)
+    return False
+
+
+def init_matches_api(app, path='/api/matches'):
+    """Register the matches endpoint on ``app``"""
+    from flask import Response, jsonify, request, stream_with_context
+    from flask_login import login_required
+
+    def matches_view():
+        args = request.args
+        try:
+            filters = {
+                'organ': args.get('organ') or None,
+                'recipient_id': number_arg(args, 'recipient_id', int),
+                'donor_id': number_arg(args, 'donor_id', int),
+                'min_score': number_arg(args, 'min_score', float),
+            }
+            limit = number_arg(args, 'limit', int)
+            export_format = args.get('format', 'json')
+            if export_format not in ('json', 'ndjson'):
+                raise ValueError(f"Unsupported format: {export_format}")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        model_version = scored_version(args.get('model_version'))
+        version, updated_at = data_version()
+        etag, last_modified = _validators(model_version, version, updated_at, args)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified)
+        if _not_modified(request, etag, last_modified):
+            return Response(status=304, headers=headers)
+
+        if model_version is None:
+            return jsonify({'error': 'No trained model is published yet'}), 503
+
+        if export_format == 'ndjson':
+            return Response(
+                stream_with_context(stream_ndjson(model_version, **filters)),
+                mimetype='application/x-ndjson',
+                headers=headers
+            )
+
+        try:
+            scores, next_cursor = matches_page(model_version, args.get('cursor'), limit, **filters)
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify({
+            'model_version': model_version,
+            'data_version': version,
+            'matches': [score.to_dict() for score in scores],
+            'next_cursor': next_cursor
+        })
+        response.headers.update(headers)
+        return response
+
+    app.add_url_rule(path, 'api_matches', login_required(matches_view))
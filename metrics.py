@@ -0,0 +1,216 @@
+"""
+Runtime instrumentation and the Prometheus /metrics endpoint
+
+Stage timers for the ML pipeline (feature build, fit, predict, metrics,
+model load, explanations), per-route latency histograms, DB query counts per request,
+retrain duration / queue depth and worker startup times, all exported in
+the Prometheus text format.
+
+Under gunicorn every worker (and the spawned retrain process) writes its
+samples to memory-mapped files in PROMETHEUS_MULTIPROC_DIR, which
+gunicorn.conf.py sets up; /metrics merges them, so counters and
+histograms add up across workers no matter which one serves the scrape.
+Without that variable the metrics live in the process's own registry.
+
+The per-request cost is two perf_counter() calls, a thread-local
+counter bump per SQL statement, and three histogram/counter updates.
+If prometheus_client is not installed every helper is a no-op.
+
+Usage:
+    from metrics import init_metrics, stage_timer
+    init_metrics(app)                      # adds before/after hooks and /metrics
+    with stage_timer('predict', items=len(pairs)):
+        ...
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                                   REGISTRY, generate_latest, multiprocess)
+except ImportError:  # pragma: no cover - metrics are optional
+    Counter = Gauge = Histogram = None
+
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+ENABLED = Counter is not None
+
+if ENABLED:
+    STAGE_SECONDS = Histogram(
+        'organmatch_stage_seconds', 'Time spent in an ML pipeline stage', ['stage'], buckets=STAGE_BUCKETS
+    )
+    STAGE_ITEMS = Counter(
+        'organmatch_stage_items', 'Rows or pairs processed by an ML pipeline stage', ['stage']
+    )
+    STAGE_ERRORS = Counter(
+        'organmatch_stage_errors', 'ML pipeline stage calls that raised', ['stage']
+    )
+    REQUEST_SECONDS = Histogram(
+        'organmatch_http_request_duration_seconds', 'Request latency by route',
+        ['method', 'endpoint', 'status'], buckets=REQUEST_BUCKETS
+    )
+    REQUEST_QUERIES = Histogram(
+        'organmatch_http_request_db_queries', 'SQL statements executed per request',
+        ['endpoint'], buckets=QUERY_BUCKETS
+    )
+    DB_QUERIES = Counter('organmatch_db_queries', 'SQL statements executed')
+    RETRAIN_SECONDS = Histogram(
+        'organmatch_retrain_duration_seconds', 'Duration of model retrains', ['status'], buckets=STAGE_BUCKETS
+    )
+    EXPLAIN_CACHE = Counter(
+        'organmatch_explain_cache_lookups', 'Explanation cache lookups by result', ['result']
+    )
+    RETRAIN_QUEUE_DEPTH = Gauge(
+        'organmatch_retrain_queue_depth', 'Retrain jobs pending or running', multiprocess_mode='livemax'
+    )
+    STARTUP_SECONDS = Histogram(
+        'organmatch_worker_startup_seconds', 'Seconds from worker process start to a startup phase',
+        ['phase'], buckets=STAGE_BUCKETS
+    )
+
+_request_state = threading.local()
+
+
+@contextmanager
+def stage_timer(stage, items=None):
+    """Time a block as one call of ``stage``; ``items`` counts pairs/rows processed"""
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+    if items:
+        STAGE_ITEMS.labels(stage).inc(items)
+
+
+def count_items(stage, items):
+    """Add to a stage's processed-items counter when the count is only known afterwards"""
+    if ENABLED and items:
+        STAGE_ITEMS.labels(stage).inc(items)
+
+
+def timed(stage):
+    """Decorator form of ``stage_timer``"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_retrain(result):
+    """Record a finished retrain from its status dict"""
+    if ENABLED and result.get('duration') is not None:
+        RETRAIN_SECONDS.labels(result.get('status', 'unknown')).observe(result['duration'])
+
+
+def count_explain_cache(hits, misses):
+    if ENABLED:
+        if hits:
+            EXPLAIN_CACHE.labels('hit').inc(hits)
+        if misses:
+            EXPLAIN_CACHE.labels('miss').inc(misses)
+
+
+def set_retrain_queue_depth(depth):
+    if ENABLED:
+        RETRAIN_QUEUE_DEPTH.set(depth)
+
+
+def observe_startup(phase, seconds):
+    """Record one worker reaching ``phase`` (app_ready, first_request, warmup)"""
+    if ENABLED:
+        STARTUP_SECONDS.labels(phase).observe(seconds)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERIES.inc()
+    count = getattr(_request_state, 'queries', None)
+    if count is not None:
+        _request_state.queries = count + 1
+
+
+def _before_request():
+    _request_state.started = time.perf_counter()
+    _request_state.queries = 0
+
+
+def _after_request(response):
+    from flask import request
+
+    started = getattr(_request_state, 'started', None)
+    if started is None:
+        return response
+    # url_rule keeps the label set bounded (no ids or query strings)
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.labels(request.method, endpoint, str(response.status_code)).observe(
+        time.perf_counter() - started
+    )
+    REQUEST_QUERIES.labels(endpoint).observe(_request_state.queries)
+    _request_state.started = None
+    _request_state.queries = None
+    return response
+
+
+def render_metrics():
+    """(body, content type) of all metrics, merged across processes when multiprocess"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app, path='/metrics'):
+    """Install request/query hooks on ``app`` and serve the metrics at ``path``.
+
+    Set METRICS_TOKEN to require ``Authorization: Bearer <token>`` on scrapes.
+    """
+    if not ENABLED:
+        print("⚠️  prometheus_client not installed - /metrics disabled")
+        return
+
+    from flask import Response, abort, request
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+    token = os.environ.get('METRICS_TOKEN')
+
+    def metrics_view():
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        try:
+            from ml.retrain_coordinator import get_coordinator
+            get_coordinator(app).status()
+        except Exception:
+            pass
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
+
+    app.add_url_rule(path, 'metrics', metrics_view)
+
+
+def mark_process_dead(pid):
+    """gunicorn child_exit hook: drop live gauges of a finished worker"""
+    if ENABLED and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -1,189 +1,367 @@
 """
 Migration script to move data from SQLite to PostgreSQL
+
+Columns are taken from the SQLAlchemy models (intersected with what the
+source database actually has), rows are streamed with ``yield_per`` in
+primary-key order and loaded in batches with COPY (psycopg2) or
+executemany. Tables without foreign keys between them are copied
+concurrently. Each batch commits together with a per-table checkpoint in
+the target database, so an interrupted run resumes where it stopped.
+Row counts and checksums of every table are compared at the end.
+
+Usage:
+    python migrate_to_postgres.py
+    python migrate_to_postgres.py --source sqlite:///instance/organmatch.db --target postgresql://...
+    python migrate_to_postgres.py --restart      # empty the target tables and start over
+    python migrate_to_postgres.py --verify-only
 """
+import argparse
+import csv
+import hashlib
+import io
 import os
 import sys
-from app import app, db
-from models import User, Donor, Recipient, MatchHistory, SystemLog
-from sqlalchemy import create_engine, inspect, func, text
-from sqlalchemy.orm import sessionmaker
-
-def migrate_data():
-    """Migrate data from SQLite to PostgreSQL"""
-    
-    # SQLite connection (Flask stores it in instance/ folder)
-    sqlite_path = 'instance/organmatch.db'
-    sqlite_uri = f'sqlite:///{sqlite_path}'
-    sqlite_engine = create_engine(sqlite_uri)
-    SqliteSession = sessionmaker(bind=sqlite_engine)
-    
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, create_engine,
+                        delete, func, inspect, insert, select, text)
+
+from dotenv import load_dotenv
+
+from models import db
+
+load_dotenv()
+
+DEFAULT_SQLITE_PATH = 'instance/organmatch.db'
+DEFAULT_BATCH_SIZE = 5000
+
+checkpoint_metadata = MetaData()
+migration_checkpoints = Table(
+    'migration_checkpoints', checkpoint_metadata,
+    Column('table_name', String(64), primary_key=True),
+    Column('last_key', String(255)),
+    Column('rows_copied', Integer, nullable=False, default=0),
+    Column('completed_at', DateTime),
+    Column('updated_at', DateTime)
+)
+
+
+def log(message):
+    """Whole-line print, so lines from parallel table workers do not interleave"""
+    sys.stdout.write(message + '\n')
+    sys.stdout.flush()
+
+
+def table_levels(tables):
+    """Group tables into levels; a table only depends on tables of earlier levels"""
+    names = {table.name for table in tables}
+    level_of = {}
+
+    def level(table):
+        if table.name not in level_of:
+            parents = [
+                fk.column.table for fk in table.foreign_keys
+                if fk.column.table.name in names and fk.column.table is not table
+            ]
+            level_of[table.name] = 1 + max((level(parent) for parent in parents), default=-1)
+        return level_of[table.name]
+
+    levels = {}
+    for table in tables:
+        levels.setdefault(level(table), []).append(table)
+    return [levels[key] for key in sorted(levels)]
+
+
+def shared_columns(table, source_engine):
+    """Model columns of ``table`` that also exist in the source database"""
+    source_names = {column['name'] for column in inspect(source_engine).get_columns(table.name)}
+    return [column for column in table.columns if column.name in source_names]
+
+
+def primary_key_column(table):
+    columns = list(table.primary_key.columns)
+    if len(columns) != 1:
+        raise ValueError(f"{table.name}: resumable copy needs a single-column primary key")
+    return columns[0]
+
+
+def _decode_key(column, value):
+    if value is None:
+        return None
+    return int(value) if isinstance(column.type, Integer) else value
+
+
+def _missing_defaults(table, columns):
+    """Python-side defaults for model columns the source does not have"""
+    present = {column.name for column in columns}
+    defaults = {}
+    for column in table.columns:
+        if column.name in present or column.default is None:
+            continue
+        if column.default.is_callable:
+            defaults[column.name] = column.default.arg
+        elif column.default.is_scalar:
+            defaults[column.name] = lambda ctx, value=column.default.arg: value
+    return defaults
+
+
+def _copy_batch(connection, table, names, rows):
+    """COPY one batch through the connection's psycopg2 cursor (same transaction)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            '' if row[name] is None
+            else '\\x' + bytes(row[name]).hex() if isinstance(row[name], (bytes, memoryview))
+            else row[name]
+            for name in names
+        ])
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+
+def read_checkpoint(target_engine, table):
+    with target_engine.connect() as connection:
+        return connection.execute(
+            select(migration_checkpoints).where(migration_checkpoints.c.table_name == table.name)
+        ).mappings().first()
+
+
+def copy_table(table, source_engine, target_engine, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream one table from source to target, resuming from its checkpoint"""
+    started = time.perf_counter()
+    key = primary_key_column(table)
+    checkpoint = read_checkpoint(target_engine, table)
+    if checkpoint is not None and checkpoint['completed_at'] is not None:
+        log(f"  ⏭️  {table.name}: already migrated ({checkpoint['rows_copied']} rows)")
+        return checkpoint['rows_copied']
+
+    if not inspect(source_engine).has_table(table.name):
+        log(f"  ⚠️  {table.name}: not in source database, skipped")
+        return 0
+
+    columns = shared_columns(table, source_engine)
+    names = [column.name for column in columns]
+    defaults = _missing_defaults(table, columns)
+    use_copy = target_engine.dialect.name == 'postgresql' and target_engine.dialect.driver == 'psycopg2'
+
+    last_key = _decode_key(key, checkpoint['last_key']) if checkpoint else None
+    copied = checkpoint['rows_copied'] if checkpoint else 0
+    if checkpoint is None:
+        with target_engine.connect() as connection:
+            existing = connection.execute(select(func.count()).select_from(table)).scalar()
+        if existing:
+            raise RuntimeError(
+                f"{table.name} already has {existing} rows in the target; rerun with --restart"
+            )
+    elif last_key is not None:
+        log(f"  ↪️  {table.name}: resuming after {key.name}={last_key} ({copied} rows done)")
+
+    query = select(*columns).order_by(key)
+    if last_key is not None:
+        query = query.where(key > last_key)
+
+    with source_engine.connect() as source:
+        result = source.execution_options(yield_per=batch_size).execute(query)
+        for batch in result.mappings().partitions():
+            rows = [dict(row) for row in batch]
+            for name, default in defaults.items():
+                value = default(None)
+                for row in rows:
+                    row[name] = value
+            last_key = rows[-1][key.name]
+
+            with target_engine.begin() as target:
+                if use_copy:
+                    _copy_batch(target, table, list(rows[0].keys()), rows)
+                else:
+                    target.execute(insert(table), rows)
+                copied += len(rows)
+                _save_checkpoint(target, table, last_key, copied)
+
+            log(f"  → {table.name}: {copied} rows")
+
+    with target_engine.begin() as target:
+        _save_checkpoint(target, table, last_key, copied, completed=True)
+        _reset_sequence(target, table, key)
+
+    log(f"  ✅ {table.name}: {copied} rows in {time.perf_counter() - started:.1f}s")
+    if 'hla_bits' in table.columns and 'hla_bits' not in names:
+        log(f"  💡 {table.name}: source has no HLA bitsets, run `python init_db.py --backfill-hla`")
+    return copied
+
+
+def _save_checkpoint(connection, table, last_key, copied, completed=False):
+    values = {
+        'last_key': None if last_key is None else str(last_key),
+        'rows_copied': copied,
+        'completed_at': datetime.utcnow() if completed else None,
+        'updated_at': datetime.utcnow()
+    }
+    updated = connection.execute(
+        migration_checkpoints.update()
+        .where(migration_checkpoints.c.table_name == table.name)
+        .values(**values)
+    ).rowcount
+    if not updated:
+        connection.execute(insert(migration_checkpoints).values(table_name=table.name, **values))
+
+
+def _reset_sequence(connection, table, key):
+    """Move a PostgreSQL serial sequence past the copied ids"""
+    if connection.dialect.name != 'postgresql' or not isinstance(key.type, Integer):
+        return
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key.name}'), "
+        f"COALESCE((SELECT MAX({key.name}) FROM {table.name}), 0) + 1, false)"
+    ))
+
+
+def _normalize(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def table_checksum(engine, table, columns, batch_size=DEFAULT_BATCH_SIZE):
+    """(row count, sha1 of all rows in primary-key order) over ``columns``"""
+    digest = hashlib.sha1()
+    count = 0
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(
+            select(*columns).order_by(primary_key_column(table))
+        )
+        for batch in result.partitions():
+            for row in batch:
+                digest.update('\x1f'.join(_normalize(value) for value in row).encode())
+                digest.update(b'\x1e')
+            count += len(batch)
+    return count, digest.hexdigest()
+
+
+def verify_table(table, source_engine, target_engine, batch_size=DEFAULT_BATCH_SIZE):
+    if not inspect(source_engine).has_table(table.name):
+        return True
+    columns = shared_columns(table, source_engine)
+    source_count, source_sum = table_checksum(source_engine, table, columns, batch_size)
+    target_count, target_sum = table_checksum(target_engine, table, columns, batch_size)
+    if source_count != target_count:
+        log(f"  ❌ {table.name}: {source_count} rows in source, {target_count} in target")
+        return False
+    if source_sum != target_sum:
+        log(f"  ❌ {table.name}: checksum mismatch ({source_sum[:12]} vs {target_sum[:12]})")
+        return False
+    log(f"  ✅ {table.name}: {target_count} rows, checksum {target_sum[:12]}")
+    return True
+
+
+def _run_levels(levels, fn, workers):
+    """Run ``fn(table)`` level by level, tables of one level in parallel"""
+    results = {}
+    for tables in levels:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tables)))) as pool:
+            for table, result in zip(tables, pool.map(fn, tables)):
+                results[table.name] = result
+    return results
+
+
+def restart(target_engine, tables):
+    """Empty the target tables (children first) and forget all checkpoints"""
+    with target_engine.begin() as connection:
+        for table in reversed(tables):
+            connection.execute(delete(table))
+        connection.execute(delete(migration_checkpoints))
+
+
+def migrate_data(source_uri=None, target_uri=None, batch_size=DEFAULT_BATCH_SIZE, workers=4,
+                 restart_run=False, verify_only=False):
+    """Migrate data from SQLite to PostgreSQL, returns True when verification passes"""
+    source_uri = source_uri or f'sqlite:///{DEFAULT_SQLITE_PATH}'
+    target_uri = target_uri or os.environ.get('DATABASE_URL')
+    if not target_uri:
+        print("❌ Set DATABASE_URL (or pass --target) to the PostgreSQL database")
+        return False
+    if target_uri.startswith('postgres://'):
+        target_uri = target_uri.replace('postgres://', 'postgresql://', 1)
+
     print("🔄 Starting database migration from SQLite to PostgreSQL...")
-    
-    with app.app_context():
-        # Step 1: Create PostgreSQL schema
-        print("📊 Creating PostgreSQL schema...")
-        db.create_all()
-        print("✅ PostgreSQL schema created!")
-        
-        # Check if SQLite database exists
-        if not os.path.exists(sqlite_path):
-            print("⚠️  No SQLite database found. Starting with empty PostgreSQL database.")
-            print("✅ Migration complete - PostgreSQL is ready to use!")
-            return
-        
-        # Step 2: Check if there's any data in SQLite
-        inspector = inspect(sqlite_engine)
-        if not inspector.get_table_names():
-            print("⚠️  SQLite database is empty. Starting with empty PostgreSQL database.")
-            print("✅ Migration complete - PostgreSQL is ready to use!")
-            return
-        
-        # Step 3: Migrate data from SQLite to PostgreSQL
-        print("📦 Migrating data from SQLite to PostgreSQL...")
-        
-        sqlite_session = SqliteSession()
-        
-        try:
-            # Migrate Users (preserve IDs and timestamps)
-            users = sqlite_session.query(User).all()
-            if users:
-                print(f"  → Migrating {len(users)} users...")
-                for user in users:
-                    new_user = User(
-                        id=user.id,
-                        username=user.username,
-                        email=user.email,
-                        password_hash=user.password_hash,
-                        created_at=user.created_at
-                    )
-                    db.session.add(new_user)
-                db.session.flush()
-                db.session.commit()
-                
-                # Reset sequence for users table
-                max_id = db.session.query(func.max(User.id)).scalar() or 0
-                db.session.execute(text(f"SELECT setval('users_id_seq', {max_id})"))
-                db.session.commit()
-                print(f"  ✅ Migrated {len(users)} users (max ID: {max_id})")
-            
-            # Migrate Donors (preserve IDs and timestamps)
-            donors = sqlite_session.query(Donor).all()
-            if donors:
-                print(f"  → Migrating {len(donors)} donors...")
-                for donor in donors:
-                    new_donor = Donor(
-                        id=donor.id,
-                        name=donor.name,
-                        age=donor.age,
-                        blood_group=donor.blood_group,
-                        organ_type=donor.organ_type,
-                        bmi=donor.bmi,
-                        hla_typing=donor.hla_typing,
-                        latitude=donor.latitude,
-                        longitude=donor.longitude,
-                        organ_storage_hours=donor.organ_storage_hours,
-                        organ_size=donor.organ_size,
-                        diabetes=donor.diabetes,
-                        hypertension=donor.hypertension,
-                        smoking=donor.smoking,
-                        alcohol=donor.alcohol,
-                        created_at=donor.created_at
-                    )
-                    db.session.add(new_donor)
-                db.session.flush()
-                db.session.commit()
-                
-                # Reset sequence for donors table
-                max_id = db.session.query(func.max(Donor.id)).scalar() or 0
-                db.session.execute(text(f"SELECT setval('donors_id_seq', {max_id})"))
-                db.session.commit()
-                print(f"  ✅ Migrated {len(donors)} donors (max ID: {max_id})")
-            
-            # Migrate Recipients (preserve IDs and timestamps)
-            recipients = sqlite_session.query(Recipient).all()
-            if recipients:
-                print(f"  → Migrating {len(recipients)} recipients...")
-                for recipient in recipients:
-                    new_recipient = Recipient(
-                        id=recipient.id,
-                        name=recipient.name,
-                        age=recipient.age,
-                        blood_group=recipient.blood_group,
-                        organ_needed=recipient.organ_needed,
-                        bmi=recipient.bmi,
-                        hla_typing=recipient.hla_typing,
-                        latitude=recipient.latitude,
-                        longitude=recipient.longitude,
-                        organ_size_needed=recipient.organ_size_needed,
-                        diabetes=recipient.diabetes,
-                        hypertension=recipient.hypertension,
-                        urgency_level=recipient.urgency_level,
-                        created_at=recipient.created_at
-                    )
-                    db.session.add(new_recipient)
-                db.session.flush()
-                db.session.commit()
-                
-                # Reset sequence for recipients table
-                max_id = db.session.query(func.max(Recipient.id)).scalar() or 0
-                db.session.execute(text(f"SELECT setval('recipients_id_seq', {max_id})"))
-                db.session.commit()
-                print(f"  ✅ Migrated {len(recipients)} recipients (max ID: {max_id})")
-            
-            # Migrate Match History (preserve IDs and timestamps)
-            matches = sqlite_session.query(MatchHistory).all()
-            if matches:
-                print(f"  → Migrating {len(matches)} match records...")
-                for match in matches:
-                    new_match = MatchHistory(
-                        id=match.id,
-                        donor_id=match.donor_id,
-                        recipient_id=match.recipient_id,
-                        compatibility_score=match.compatibility_score,
-                        matched_at=match.matched_at
-                    )
-                    db.session.add(new_match)
-                db.session.flush()
-                db.session.commit()
-                
-                # Reset sequence for match_history table
-                max_id = db.session.query(func.max(MatchHistory.id)).scalar() or 0
-                db.session.execute(text(f"SELECT setval('match_history_id_seq', {max_id})"))
-                db.session.commit()
-                print(f"  ✅ Migrated {len(matches)} match records (max ID: {max_id})")
-            
-            # Migrate System Logs (preserve IDs and timestamps)
-            logs = sqlite_session.query(SystemLog).all()
-            if logs:
-                print(f"  → Migrating {len(logs)} system logs...")
-                for log in logs:
-                    new_log = SystemLog(
-                        id=log.id,
-                        message=log.message,
-                        level=log.level,
-                        category=log.category,
-                        timestamp=log.timestamp
-                    )
-                    db.session.add(new_log)
-                db.session.flush()
-                db.session.commit()
-                
-                # Reset sequence for system_logs table
-                max_id = db.session.query(func.max(SystemLog.id)).scalar() or 0
-                db.session.execute(text(f"SELECT setval('system_logs_id_seq', {max_id})"))
-                db.session.commit()
-                print(f"  ✅ Migrated {len(logs)} system logs (max ID: {max_id})")
-            
-            print("\n✅ Migration completed successfully!")
-            print("🗄️  Your data is now safely stored in PostgreSQL")
-            print("🚀 PostgreSQL database is ready for deployment!")
-            
-        except Exception as e:
-            db.session.rollback()
-            print(f"\n❌ Error during migration: {str(e)}")
-            sys.exit(1)
-        finally:
-            sqlite_session.close()
+
+    sqlite_path = source_uri.split('sqlite:///', 1)[-1] if source_uri.startswith('sqlite:///') else None
+    if sqlite_path and not os.path.exists(sqlite_path):
+        print("⚠️  No SQLite database found. Starting with empty PostgreSQL database.")
+        target_engine = create_engine(target_uri)
+        db.metadata.create_all(target_engine)
+        print("✅ Migration complete - PostgreSQL is ready to use!")
+        return True
+
+    source_engine = create_engine(source_uri)
+    target_engine = create_engine(target_uri, pool_size=workers + 1, max_overflow=0) \
+        if not target_uri.startswith('sqlite') else create_engine(target_uri)
+
+    print("📊 Creating PostgreSQL schema...")
+    db.metadata.create_all(target_engine)
+    checkpoint_metadata.create_all(target_engine)
+
+    tables = list(db.metadata.sorted_tables)
+    levels = table_levels(tables)
+
+    try:
+        if not verify_only:
+            if restart_run:
+                print("🧹 Emptying target tables...")
+                restart(target_engine, tables)
+            print(f"📦 Copying {len(tables)} tables in {len(levels)} stages "
+                  f"(batch {batch_size}, {workers} parallel)...")
+            started = time.perf_counter()
+            copied = _run_levels(levels, lambda table: copy_table(table, source_engine, target_engine, batch_size), workers)
+            print(f"📦 Copied {sum(copied.values())} rows in {time.perf_counter() - started:.1f}s")
+
+        print("🔍 Verifying row counts and checksums...")
+        verified = _run_levels(levels, lambda table: verify_table(table, source_engine, target_engine, batch_size), workers)
+    except Exception as e:
+        print(f"\n❌ Error during migration: {str(e)}")
+        print("   Rerun the same command to resume from the last committed batch.")
+        return False
+    finally:
+        source_engine.dispose()
+        target_engine.dispose()
+
+    if not all(verified.values()):
+        print("\n❌ Verification failed - see the tables above")
+        return False
+
+    print("\n✅ Migration completed successfully!")
+    print("🗄️  Your data is now safely stored in PostgreSQL")
+    print("🚀 PostgreSQL database is ready for deployment!")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate the SQLite database to PostgreSQL')
+    parser.add_argument('--source', help=f'Source database URI (default: sqlite:///{DEFAULT_SQLITE_PATH})')
+    parser.add_argument('--target', help='Target database URI (default: DATABASE_URL)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=4, help='Tables copied in parallel')
+    parser.add_argument('--restart', action='store_true', help='Empty target tables and ignore checkpoints')
+    parser.add_argument('--verify-only', action='store_true', help='Only compare row counts and checksums')
+    args = parser.parse_args()
+
+    ok = migrate_data(args.source, args.target, args.batch_size, args.workers, args.restart, args.verify_only)
+    sys.exit(0 if ok else 1)
+
 
 if __name__ == '__main__':
-    migrate_data()
+    main()
@@ -0,0 +1,266 @@
+"""
+Candidate pair generation with organ-type and ABO blocking
+
+Instead of taking the full donors x recipients cross product and discarding
+pairs inside the feature loop, donors and recipients are partitioned by
+organ and blood group and only blocks that can actually match are paired.
+"""
+
+from collections import Counter
+
+from startup import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Recipient blood groups each donor blood group can give to
+BLOOD_COMPATIBILITY = {
+    'O-': ['O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+'],
+    'O+': ['O+', 'A+', 'B+', 'AB+'],
+    'A-': ['A-', 'A+', 'AB-', 'AB+'],
+    'A+': ['A+', 'AB+'],
+    'B-': ['B-', 'B+', 'AB-', 'AB+'],
+    'B+': ['B+', 'AB+'],
+    'AB-': ['AB-', 'AB+'],
+    'AB+': ['AB+'],
+}
+
+UNKNOWN_BLOOD_GROUP = '?'
+
+
+def new_pruning_stats():
+    """Counters describing how much of the cross product was skipped"""
+    return {
+        'total_pairs': 0,
+        'organ_pruned': 0,
+        'blood_pruned': 0,
+        'candidate_pairs': 0,
+    }
+
+
+def normalize_blood_group(blood_group):
+    """Canonical blood group label, or UNKNOWN_BLOOD_GROUP when missing/unrecognized"""
+    if blood_group is None or pd.isna(blood_group):
+        return UNKNOWN_BLOOD_GROUP
+    blood_group = str(blood_group).strip().upper()
+    return blood_group if blood_group in BLOOD_COMPATIBILITY else UNKNOWN_BLOOD_GROUP
+
+
+def blood_groups_compatible(donor_group, recipient_group):
+    """Whether a pair of (normalized) groups may match.
+
+    Records with an unknown group are kept as candidates so that missing
+    data never silently drops a pair that could be compatible.
+    """
+    if UNKNOWN_BLOOD_GROUP in (donor_group, recipient_group):
+        return True
+    return recipient_group in BLOOD_COMPATIBILITY[donor_group]
+
+
+def compatible_group_pairs(donor_groups, recipient_groups):
+    """Yield (donor_key, recipient_key) pairs of compatible (organ, blood group) keys"""
+    for donor_organ, donor_blood in donor_groups:
+        for recipient_organ, recipient_blood in recipient_groups:
+            if donor_organ == recipient_organ and blood_groups_compatible(donor_blood, recipient_blood):
+                yield (donor_organ, donor_blood), (recipient_organ, recipient_blood)
+
+
+def _count_pruning(donor_counts, recipient_counts, stats):
+    """Update stats from per-(organ, blood group) record counts"""
+    total_donors = sum(donor_counts.values())
+    total_recipients = sum(recipient_counts.values())
+    same_organ = 0
+    candidates = 0
+    for (donor_organ, donor_blood), donor_count in donor_counts.items():
+        for (recipient_organ, recipient_blood), recipient_count in recipient_counts.items():
+            if donor_organ != recipient_organ:
+                continue
+            same_organ += donor_count * recipient_count
+            if blood_groups_compatible(donor_blood, recipient_blood):
+                candidates += donor_count * recipient_count
+
+    stats['total_pairs'] += total_donors * total_recipients
+    stats['organ_pruned'] += total_donors * total_recipients - same_organ
+    stats['blood_pruned'] += same_organ - candidates
+    stats['candidate_pairs'] += candidates
+    return stats
+
+
+def _group_frame(df, organ_column):
+    keys = list(zip(df[organ_column], df['blood_group'].map(normalize_blood_group)))
+    return df.groupby(pd.Series(keys, index=df.index), sort=False)
+
+
+def candidate_blocks(donors_df, recipients_df, stats=None):
+    """Yield (donors_block, recipients_block) DataFrames whose cross product
+    only contains organ- and ABO-compatible pairs.
+
+    Blocks are keyed by donor group, so each donor appears in exactly one
+    block and every compatible recipient group is concatenated into it.
+    """
+    if donors_df.empty or recipients_df.empty:
+        if stats is not None:
+            stats['total_pairs'] += len(donors_df) * len(recipients_df)
+            stats['organ_pruned'] += len(donors_df) * len(recipients_df)
+        return
+
+    donor_groups = dict(list(_group_frame(donors_df, 'organ_type')))
+    recipient_groups = dict(list(_group_frame(recipients_df, 'organ_needed')))
+
+    if stats is not None:
+        _count_pruning(
+            {key: len(block) for key, block in donor_groups.items()},
+            {key: len(block) for key, block in recipient_groups.items()},
+            stats
+        )
+
+    for donor_key, donors_block in donor_groups.items():
+        matching = [
+            recipient_groups[recipient_key]
+            for _, recipient_key in compatible_group_pairs([donor_key], recipient_groups)
+        ]
+        if matching:
+            yield donors_block, pd.concat(matching)
+
+
+def candidate_pair_ids(donors_df, recipients_df, stats=None):
+    """List of (donor_id, recipient_id) tuples for every candidate pair"""
+    pairs = []
+    for donors_block, recipients_block in candidate_blocks(donors_df, recipients_df, stats):
+        for donor_id in donors_block['id']:
+            pairs.extend((donor_id, recipient_id) for recipient_id in recipients_block['id'])
+    return pairs
+
+
+def count_candidate_pairs(donors_df, recipients_df, stats=None):
+    """Pruning stats computed from group sizes alone, without building blocks"""
+    stats = stats if stats is not None else new_pruning_stats()
+    return _count_pruning(
+        Counter(zip(donors_df['organ_type'], donors_df['blood_group'].map(normalize_blood_group))),
+        Counter(zip(recipients_df['organ_needed'], recipients_df['blood_group'].map(normalize_blood_group))),
+        stats
+    )
+
+
+def create_candidate_features(donors_df, recipients_df, stats=None, feature_fn=None):
+    """Run the feature pipeline block by block over candidate pairs only.
+
+    Returns the same (X_df, labels) shape as ``create_features`` with the
+    rows for pruned pairs left out.
+    """
+    if feature_fn is None:
+        from ml.feature_engineering import create_features
+        feature_fn = create_features
+
+    frames = []
+    labels = []
+    for donors_block, recipients_block in candidate_blocks(donors_df, recipients_df, stats):
+        X_block, y_block = feature_fn(donors_block, recipients_block)
+        if len(X_block):
+            frames.append(X_block)
+            labels.extend(y_block)
+
+    if not frames:
+        return pd.DataFrame(), []
+    return pd.concat(frames, ignore_index=True), labels
+
+
+def create_candidate_features_with_pairs(donors_df, recipients_df, stats=None, feature_fn=None):
+    """Like ``create_candidate_features`` but also returns the pair of each row.
+
+    Returns (X_df, labels, donor_ids, recipient_ids). Within a candidate
+    block every pair shares the organ type, so ``create_features`` emits
+    exactly one row per pair in its recipient-major loop order, which is
+    what lets rows be attributed without it carrying id columns.
+    """
+    if feature_fn is None:
+        from ml.feature_engineering import create_features
+        feature_fn = create_features
+
+    frames = []
+    labels = []
+    donor_ids = []
+    recipient_ids = []
+    for donors_block, recipients_block in candidate_blocks(donors_df, recipients_df, stats):
+        X_block, y_block = feature_fn(donors_block, recipients_block)
+        block_donors = donors_block['id'].to_numpy()
+        block_recipients = recipients_block['id'].to_numpy()
+        if len(X_block) != len(block_donors) * len(block_recipients):
+            raise ValueError(
+                f"Feature function returned {len(X_block)} rows for a block of "
+                f"{len(block_donors)}x{len(block_recipients)} candidate pairs"
+            )
+        if len(X_block):
+            frames.append(X_block)
+            labels.extend(y_block)
+            donor_ids.append(np.tile(block_donors, len(block_recipients)))
+            recipient_ids.append(np.repeat(block_recipients, len(block_donors)))
+
+    if not frames:
+        empty = np.empty(0, dtype=np.int64)
+        return pd.DataFrame(), [], empty, empty
+    return (
+        pd.concat(frames, ignore_index=True),
+        labels,
+        np.concatenate(donor_ids).astype(np.int64),
+        np.concatenate(recipient_ids).astype(np.int64)
+    )
+
+
+def db_candidate_blocks(donor_model, recipient_model, stats=None, donor_filter=None, recipient_filter=None):
+    """Like ``candidate_blocks`` but pulls each block from the database.
+
+    Group sizes come from an index-backed GROUP BY on organ and blood group,
+    so the pruning counters are known before any rows are loaded, and each
+    block only selects the records it needs. ``donor_filter`` and
+    ``recipient_filter`` are optional SQL conditions restricting either side,
+    e.g. to rows changed since the last scoring run.
+    """
+    from models import db
+
+    donor_filter = db.true() if donor_filter is None else donor_filter
+    recipient_filter = db.true() if recipient_filter is None else recipient_filter
+
+    donor_counts = {}
+    for organ, blood_group, count in db.session.query(
+        donor_model.organ_type, donor_model.blood_group, db.func.count(donor_model.id)
+    ).filter(donor_filter).group_by(donor_model.organ_type, donor_model.blood_group):
+        key = (organ, normalize_blood_group(blood_group))
+        donor_counts.setdefault(key, {'count': 0, 'raw': []})
+        donor_counts[key]['count'] += count
+        donor_counts[key]['raw'].append(blood_group)
+
+    recipient_counts = {}
+    for organ, blood_group, count in db.session.query(
+        recipient_model.organ_needed, recipient_model.blood_group, db.func.count(recipient_model.id)
+    ).filter(recipient_filter).group_by(recipient_model.organ_needed, recipient_model.blood_group):
+        key = (organ, normalize_blood_group(blood_group))
+        recipient_counts.setdefault(key, {'count': 0, 'raw': []})
+        recipient_counts[key]['count'] += count
+        recipient_counts[key]['raw'].append(blood_group)
+
+    if stats is not None:
+        _count_pruning(
+            {key: group['count'] for key, group in donor_counts.items()},
+            {key: group['count'] for key, group in recipient_counts.items()},
+            stats
+        )
+
+    def load(model, organ_column, organ, raw_groups, row_filter):
+        known = [group for group in raw_groups if group is not None]
+        condition = model.blood_group.in_(known) if known else db.false()
+        if None in raw_groups:
+            condition = db.or_(condition, model.blood_group.is_(None))
+        rows = model.query.filter(organ_column == organ, condition, row_filter).order_by(model.id).all()
+        return pd.DataFrame([row.to_dict() for row in rows])
+
+    for donor_key, donor_group in donor_counts.items():
+        recipient_raw = []
+        for _, recipient_key in compatible_group_pairs([donor_key], recipient_counts):
+            recipient_raw.extend(recipient_counts[recipient_key]['raw'])
+        if not recipient_raw:
+            continue
+        yield (
+            load(donor_model, donor_model.organ_type, donor_key[0], donor_group['raw'], donor_filter),
+            load(recipient_model, recipient_model.organ_needed, donor_key[0], recipient_raw, recipient_filter)
+        )
@@ -0,0 +1,300 @@
+"""
+Vectorized distance service for donor/recipient coordinates
+
+Coordinates are cached as radian arrays and distances computed with a
+vectorized haversine formula. A lat/lon grid acts as the spatial index for
+radius ("recipients within N km") and k-nearest queries, and exact geopy
+geodesic distances are only computed for the few results that need them.
+Indexes are kept current incrementally: whenever the shared data version
+(``models.data_version_token``) moved since an index was synced, the
+coordinates of rows updated after that sync are reloaded and deleted ids
+dropped, so writes from every worker and from bulk ingests are picked up.
+"""
+
+import math
+import threading
+from datetime import datetime, timedelta
+
+from startup import lazy_import
+
+np = lazy_import('numpy')
+
+EARTH_RADIUS_KM = 6371.0088
+# Haversine on that sphere is within 0.56% of the WGS-84 geodesic
+HAVERSINE_ERROR = 0.0056
+
+# Rows updated this long before the last sync are reloaded too, covering
+# transactions that committed after it and clock skew between workers
+SYNC_OVERLAP = timedelta(minutes=5)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between points given in radians (broadcasts)"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geodesic_km(lat1, lon1, lat2, lon2):
+    """Exact WGS-84 geodesic distance in km between points given in degrees"""
+    from geopy.distance import geodesic
+    return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+
+
+class DistanceIndex:
+    """Coordinates of one record type with a grid index for spatial queries"""
+
+    def __init__(self, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lat = np.empty(0, dtype=np.float64)
+        self.lon = np.empty(0, dtype=np.float64)
+        self._size = 0
+        self._positions = {}
+        self._position_cells = {}
+        self._cells = {}
+        self._lock = threading.RLock()
+        self.data_version = None
+        self.synced_through = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    @classmethod
+    def from_records(cls, records, cell_degrees=1.0):
+        """Build from an iterable of (id, latitude, longitude) tuples"""
+        index = cls(cell_degrees)
+        for record_id, latitude, longitude in records:
+            index.update(record_id, latitude, longitude)
+        return index
+
+    def _cell(self, lat_deg, lon_deg):
+        return (int(math.floor(lat_deg / self.cell_degrees)),
+                int(math.floor(lon_deg / self.cell_degrees)))
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self.ids))
+        for name in ('ids', 'lat', 'lon'):
+            old = getattr(self, name)
+            new = np.full(capacity, np.nan if old.dtype.kind == 'f' else -1, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def update(self, record_id, latitude, longitude):
+        """Insert or move a record; missing coordinates remove it from the index"""
+        if latitude is None or longitude is None or np.isnan(latitude) or np.isnan(longitude):
+            self.remove(record_id)
+            return
+
+        with self._lock:
+            position = self._positions.get(record_id)
+            if position is None:
+                if self._size == len(self.ids):
+                    self._grow()
+                position = self._size
+                self._size += 1
+                self._positions[record_id] = position
+                self.ids[position] = record_id
+            else:
+                self._cells[self._position_cells[position]].discard(position)
+
+            cell = self._cell(latitude, longitude)
+            self.lat[position] = math.radians(latitude)
+            self.lon[position] = math.radians(longitude)
+            self._position_cells[position] = cell
+            self._cells.setdefault(cell, set()).add(position)
+
+    def remove(self, record_id):
+        with self._lock:
+            position = self._positions.pop(record_id, None)
+            if position is None:
+                return
+            self._cells[self._position_cells.pop(position)].discard(position)
+            self.lat[position] = np.nan
+            self.lon[position] = np.nan
+
+    def _degrees(self, position):
+        return math.degrees(self.lat[position]), math.degrees(self.lon[position])
+
+    def coordinates(self):
+        """(ids, lat_radians, lon_radians) arrays of all indexed records"""
+        with self._lock:
+            live = ~np.isnan(self.lat[:self._size])
+            return self.ids[:self._size][live], self.lat[:self._size][live], self.lon[:self._size][live]
+
+    def distances_from(self, latitude, longitude):
+        """(ids, distances_km) from one point to every indexed record"""
+        ids, lat, lon = self.coordinates()
+        return ids, haversine_km(math.radians(latitude), math.radians(longitude), lat, lon)
+
+    def _candidate_positions(self, latitude, longitude, radius_km):
+        lat_span = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lat_min, lat_max = latitude - lat_span, latitude + lat_span
+        if lat_min <= -90 or lat_max >= 90:
+            lon_span = 180.0
+        else:
+            widest = max(abs(lat_min), abs(lat_max))
+            lon_span = min(180.0, lat_span / math.cos(math.radians(widest)))
+
+        if lon_span >= 180.0:
+            lon_cells = range(int(math.floor(-180 / self.cell_degrees)),
+                              int(math.floor(180 / self.cell_degrees)) + 1)
+        else:
+            lon_cells = [
+                int(math.floor(((lon + 180) % 360 - 180) / self.cell_degrees))
+                for lon in np.arange(longitude - lon_span, longitude + lon_span + self.cell_degrees,
+                                     self.cell_degrees)
+            ]
+        lat_cells = range(int(math.floor(max(lat_min, -90) / self.cell_degrees)),
+                          int(math.floor(min(lat_max, 90) / self.cell_degrees)) + 1)
+
+        positions = []
+        for lat_cell in lat_cells:
+            for lon_cell in set(lon_cells):
+                positions.extend(self._cells.get((lat_cell, lon_cell), ()))
+        return np.fromiter(positions, dtype=np.int64, count=len(positions))
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """(ids, distances_km) of records within ``radius_km``, nearest first"""
+        with self._lock:
+            positions = self._candidate_positions(latitude, longitude, radius_km)
+            distances = haversine_km(math.radians(latitude), math.radians(longitude),
+                                     self.lat[positions], self.lon[positions])
+            inside = distances <= radius_km
+            positions, distances = positions[inside], distances[inside]
+            order = np.argsort(distances, kind='stable')
+            return self.ids[positions[order]], distances[order]
+
+    def nearest(self, latitude, longitude, k=10):
+        """(ids, distances_km) of the ``k`` nearest records.
+
+        Searches growing radii over the grid, so only nearby cells are
+        scanned when the index is dense around the query point.
+        """
+        if not self._positions:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        radius_km = self.cell_degrees * 111.0
+        while radius_km < math.pi * EARTH_RADIUS_KM:
+            ids, distances = self.within_radius(latitude, longitude, radius_km)
+            if len(ids) >= k:
+                return ids[:k], distances[:k]
+            radius_km *= 2
+        ids, distances = self.distances_from(latitude, longitude)
+        order = np.argsort(distances, kind='stable')[:k]
+        return ids[order], distances[order]
+
+
+def refine_geodesic(latitude, longitude, index, ids):
+    """Exact geodesic distances (km) from a point to a handful of indexed records"""
+    refined = []
+    for record_id in ids:
+        position = index._positions.get(int(record_id))
+        if position is None:
+            refined.append(np.nan)
+            continue
+        refined.append(geodesic_km(latitude, longitude, *index._degrees(position)))
+    return np.array(refined)
+
+
+def distance_page(donor_index, recipient_index, offset=0, limit=50):
+    """One page of the donor x recipient distance table in donor-major order.
+
+    Only the donors covering the requested rows are evaluated, so paging
+    never materializes the full matrix. Returns (rows, total_pairs) where
+    rows are (donor_id, recipient_id, distance_km) tuples.
+    """
+    donor_ids, donor_lat, donor_lon = donor_index.coordinates()
+    recipient_ids, recipient_lat, recipient_lon = recipient_index.coordinates()
+    n_recipients = len(recipient_ids)
+    total = len(donor_ids) * n_recipients
+    if n_recipients == 0 or offset >= total:
+        return [], total
+
+    first = offset // n_recipients
+    last = min(len(donor_ids), (offset + limit - 1) // n_recipients + 1)
+    block = haversine_km(donor_lat[first:last, None], donor_lon[first:last, None],
+                         recipient_lat[None, :], recipient_lon[None, :])
+
+    start = offset - first * n_recipients
+    flat = block.ravel()[start:start + limit]
+    flat_positions = np.arange(start, start + len(flat))
+    rows = [
+        (int(donor_ids[first + pos // n_recipients]), int(recipient_ids[pos % n_recipients]), float(distance))
+        for pos, distance in zip(flat_positions, flat)
+    ]
+    return rows, total
+
+
+# Process-wide indexes, built lazily from the database
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _sync_index(model, index, connection):
+    """Apply coordinate writes made since the index was last synced"""
+    from models import data_version_token, record_changes
+
+    version = data_version_token(connection)
+    if version == index.data_version:
+        return
+    synced_through = datetime.utcnow()
+    since = None if index.synced_through is None else index.synced_through - SYNC_OVERLAP
+    rows, ids = record_changes(connection, model, ['id', 'latitude', 'longitude'], since)
+    for row in rows:
+        index.update(row['id'], row['latitude'], row['longitude'])
+    for record_id in set(index.coordinates()[0].tolist()) - ids:
+        index.remove(record_id)
+    index.data_version = version
+    index.synced_through = synced_through
+
+
+def get_index(model):
+    """The DistanceIndex for Donor or Recipient, built on first use and
+    brought up to date with the database on every call"""
+    from models import db
+
+    with _indexes_lock, db.engine.connect() as connection:
+        index = _indexes.get(model.__name__)
+        if index is None:
+            index = _indexes[model.__name__] = DistanceIndex()
+        _sync_index(model, index, connection)
+        return index
+
+
+def get_donor_index():
+    from models import Donor
+    return get_index(Donor)
+
+
+def get_recipient_index():
+    from models import Recipient
+    return get_index(Recipient)
+
+
+def recipients_within(donor, radius_km, exact=False):
+    """Recipients within ``radius_km`` of a donor as [(recipient_id, km)], nearest first"""
+    index = get_recipient_index()
+    ids, distances = index.within_radius(donor.latitude, donor.longitude, radius_km)
+    if exact:
+        distances = refine_geodesic(donor.latitude, donor.longitude, index, ids)
+    return list(zip(ids.tolist(), distances.tolist()))
+
+
+def nearest_recipients(donor, k=10, exact=True):
+    """The ``k`` recipients nearest a donor, refined with exact geodesics by default.
+
+    Haversine and geodesic can order close records differently, so the
+    exact ranking refines every record whose haversine distance is within
+    HAVERSINE_ERROR of the k-th, then sorts by the geodesic and keeps k.
+    """
+    index = get_recipient_index()
+    ids, distances = index.nearest(donor.latitude, donor.longitude, k)
+    if exact and len(ids):
+        margin = (1 + HAVERSINE_ERROR) / (1 - HAVERSINE_ERROR)
+        nearby, _ = index.within_radius(donor.latitude, donor.longitude, distances[-1] * margin)
+        ids = np.unique(np.concatenate([ids, nearby]))
+        distances = refine_geodesic(donor.latitude, donor.longitude, index, ids)
+        order = np.argsort(distances, kind='stable')[:k]
+        ids, distances = ids[order], distances[order]
+    return list(zip(ids.tolist(), distances.tolist()))
@@ -0,0 +1,113 @@
+"""
+Precomputed model evaluation artifacts
+
+Metrics (confusion matrix, classification report, ROC curve, feature
+importance) are computed once when a model is trained, on the split held
+out from that training run, and published as ``metrics.json`` inside the
+model's registry version directory together with the version and the data
+fingerprint they were computed on. /evaluate then reads one small JSON
+document, cached per process, instead of rebuilding features and scoring
+every pair on each request.
+
+Re-evaluating on a fresh holdout is an explicit background action (see
+``ml.retrain_worker.submit_evaluation``); it replaces the version's
+metrics.json when it finishes.
+
+Usage in /evaluate:
+    evaluation = get_evaluation()          # None if the model has no metrics yet
+    metrics = evaluation['metrics'] if evaluation else None
+"""
+
+import os
+import threading
+
+from ml.model_registry import DEFAULT_REGISTRY_DIR, METRICS_FILE, current_version, read_metrics
+from startup import lazy_import
+
+np = lazy_import('numpy')
+
+TEST_SIZE = 0.2
+# Below this many rows everything is used for training and no metrics are stored
+MIN_HOLDOUT_ROWS = 5
+# The stored ROC curve is thinned to at most this many points
+MAX_ROC_POINTS = 200
+
+
+def holdout_split(rows, y, test_size=TEST_SIZE, seed=42):
+    """(train_rows, test_rows) index arrays, stratified when both classes allow it"""
+    from sklearn.model_selection import train_test_split
+
+    rows = np.asarray(rows)
+    if len(rows) < MIN_HOLDOUT_ROWS:
+        return rows, rows[:0]
+    labels = np.asarray(y)[rows]
+    _, counts = np.unique(labels, return_counts=True)
+    stratify = labels if len(counts) > 1 and counts.min() >= 2 else None
+    return train_test_split(rows, test_size=test_size, random_state=seed, stratify=stratify)
+
+
+def _thin(values, keep):
+    return [float(value) for value in np.asarray(values)[keep]]
+
+
+def compute_metrics(model, feature_columns, X_test, y_test, holdout='training_split'):
+    """Evaluation dict in the shape evaluate.html renders"""
+    from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, roc_curve
+
+    feature_columns = list(feature_columns)
+    y_test = np.asarray(y_test)
+    proba = model.predict_proba(X_test[feature_columns])
+    classes = list(model.classes_)
+    y_pred = np.asarray(classes)[proba.argmax(axis=1)]
+
+    metrics = {
+        'holdout': holdout,
+        'n_samples': int(len(y_test)),
+        'n_features': len(feature_columns),
+        'feature_importance': dict(sorted(
+            ((name, float(score)) for name, score in zip(feature_columns, model.feature_importances_)),
+            key=lambda item: item[1], reverse=True
+        )),
+        'confusion_matrix': confusion_matrix(y_test, y_pred, labels=[0, 1]).tolist(),
+        'classification_report': classification_report(y_test, y_pred, output_dict=True, zero_division=0),
+        'roc_curve': None
+    }
+
+    if len(np.unique(y_test)) == 2 and 1 in classes:
+        scores = proba[:, classes.index(1)]
+        fpr, tpr, _ = roc_curve(y_test, scores)
+        keep = np.unique(np.linspace(0, len(fpr) - 1, min(len(fpr), MAX_ROC_POINTS)).astype(int))
+        metrics['roc_curve'] = {
+            'fpr': _thin(fpr, keep),
+            'tpr': _thin(tpr, keep),
+            'auc_score': float(roc_auc_score(y_test, scores))
+        }
+    return metrics
+
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def get_evaluation(version=None, registry_dir=DEFAULT_REGISTRY_DIR):
+    """Stored evaluation of ``version`` (default: the current one), or None.
+
+    Costs a stat() per call; the JSON is only re-read when the file
+    changes, e.g. after a background recomputation.
+    """
+    version = version or current_version(registry_dir)
+    if version is None:
+        return None
+    try:
+        mtime = os.stat(os.path.join(registry_dir, version, METRICS_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    key = (registry_dir, version)
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    document = read_metrics(version, registry_dir)
+    with _cache_lock:
+        _cache[key] = (mtime, document)
+    return document
@@ -0,0 +1,399 @@
+"""
+Per-pair TreeSHAP explanations with a bounded, version-keyed LRU cache
+
+Explanations are computed with ``shap.TreeExplainer`` on the current
+registry model, one batched ``shap_values`` call per request (or per
+background batch) rather than one per pair. Results are cached per process
+in an LRU keyed by (model_version, donor_id, recipient_id); when the
+registry pointer moves to a new version every cached entry of the old one
+is dropped. When this process publishes a model (or its retrain worker
+does, see ``model_registry.add_publish_listener``) the top-K pairs of each
+recipient (from the pair_scores table) are, if enabled, explained in a
+background thread; other pairs are explained on first request. Without
+ml.feature_engineering, pairs missing from the feature cache answer 503.
+
+Usage:
+    from ml.explanations import init_explanations
+    init_explanations(app, precompute_top_k=5)   # adds GET/POST /api/explain
+
+    GET  /api/explain?donor_id=3&recipient_id=7
+    POST /api/explain  {"pairs": [[3, 7], [4, 7]]}
+    GET  /api/explain/stats
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+
+from metrics import count_explain_cache, stage_timer
+from models import db, Donor, Recipient, PairScore
+from ml.model_registry import add_publish_listener, get_model_handle
+from startup import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('EXPLAIN_CACHE_SIZE', 20000))
+DEFAULT_TOP_K = 5
+BATCH_SIZE = 256
+MAX_PAIRS_PER_REQUEST = 100
+
+
+class ExplanationCache:
+    """Thread-safe LRU of explanations with hit/miss counters"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def drop_other_versions(self, version):
+        """Remove every entry not computed with ``version``; returns how many"""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] != version]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+def _frame(query):
+    return pd.DataFrame([row.to_dict() for row in query])
+
+
+def _positive_index(classes):
+    classes = list(classes)
+    return classes.index(1) if 1 in classes else len(classes) - 1
+
+
+def _positive_class(values, classes):
+    """Class-1 slice of TreeExplainer output across shap versions"""
+    index = _positive_index(classes)
+    if isinstance(values, list):
+        return values[index]
+    values = np.asarray(values)
+    if values.ndim == 3:
+        return values[:, :, index]
+    if values.ndim == 1 and len(values) == len(classes):
+        return values[index]
+    return values
+
+
+class ExplanationService:
+    """Explains (donor_id, recipient_id) pairs against the current model"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, feature_fn=None, registry_handle=None):
+        self.cache = ExplanationCache(max_entries)
+        self.feature_fn = feature_fn
+        # The on-disk feature cache holds create_features output, so skip it for a custom function
+        self.use_feature_cache = feature_fn is None
+        self.handle = registry_handle or get_model_handle()
+        self.app = None
+        self.precompute_top_k = 0
+        self._explainer = (None, None)
+        self._version = None
+        self._lock = threading.Lock()
+        self._precompute_thread = None
+
+    def _current(self):
+        """(version, model, feature_columns), resetting the cache on a version change"""
+        version, model, feature_columns = self.handle.get()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    dropped = self.cache.drop_other_versions(version)
+                    self._version = version
+                    if dropped:
+                        print(f"🧹 Dropped {dropped} cached explanations of the previous model")
+        return version, model, feature_columns
+
+    def _explainer_for(self, version, model):
+        if self._explainer[0] != version:
+            try:
+                import shap
+            except ImportError:
+                raise RuntimeError("Explanations need shap (pip install shap)")
+            self._explainer = (version, shap.TreeExplainer(model))
+        return self._explainer[1]
+
+    def _cached_features(self, pairs):
+        """(X, pairs) for the pairs whose rows in the on-disk feature cache are current"""
+        from ml.feature_cache import get_feature_cache
+
+        matrix = get_feature_cache().current() if self.use_feature_cache else None
+        if matrix is None or not len(matrix):
+            return None, []
+        versions = {}
+        for model, ids in ((Donor, {donor_id for donor_id, _ in pairs}),
+                           (Recipient, {recipient_id for _, recipient_id in pairs})):
+            versions[model] = pd.DataFrame(
+                db.session.execute(select(model.id, model.updated_at).where(model.id.in_(ids))).all(),
+                columns=['id', 'updated_at']
+            )
+        rows = matrix.fresh_pair_rows([donor_id for donor_id, _ in pairs], [recipient_id for _, recipient_id in pairs],
+                                      versions[Donor], versions[Recipient])
+        hits = np.flatnonzero(rows >= 0)
+        if not len(hits):
+            return None, []
+        return matrix.frame(rows[hits]), [pairs[i] for i in hits]
+
+    def _features(self, pairs):
+        """(X, kept_pairs) for the candidate pairs among ``pairs``; others are skipped.
+
+        Rows are read from the on-disk feature cache where it is current
+        and only the remaining pairs go through ``create_features``.
+        """
+        X_cached, cached = self._cached_features(pairs)
+        if cached:
+            found = set(cached)
+            pairs = [pair for pair in pairs if pair not in found]
+        X, kept = self._computed_features(pairs) if pairs else (None, [])
+        if X_cached is None:
+            return X, kept
+        if X is None:
+            return X_cached, cached
+        return pd.concat([X_cached, X[X_cached.columns]], ignore_index=True), cached + kept
+
+    def _computed_features(self, pairs):
+        if self.feature_fn is None:
+            from ml.retrain_worker import default_feature_fn
+            self.feature_fn = default_feature_fn()
+
+        donors = _frame(Donor.query.filter(Donor.id.in_({donor_id for donor_id, _ in pairs})))
+        recipients = _frame(Recipient.query.filter(Recipient.id.in_({recipient_id for _, recipient_id in pairs})))
+        if donors.empty or recipients.empty:
+            return None, []
+        donors = donors.set_index('id', drop=False)
+        recipients = recipients.set_index('id', drop=False)
+
+        by_recipient = {}
+        for donor_id, recipient_id in pairs:
+            if donor_id in donors.index and recipient_id in recipients.index:
+                by_recipient.setdefault(recipient_id, []).append(donor_id)
+
+        frames, kept = [], []
+        for recipient_id, donor_ids in by_recipient.items():
+            recipient = recipients.loc[[recipient_id]]
+            # create_features skips organ mismatches, so only pass donors it will emit rows for
+            block = donors.loc[donor_ids]
+            block = block[block['organ_type'] == recipient['organ_needed'].iloc[0]]
+            if block.empty:
+                continue
+            X_block, _ = self.feature_fn(block.reset_index(drop=True), recipient.reset_index(drop=True))
+            frames.append(X_block)
+            kept.extend((int(donor_id), int(recipient_id)) for donor_id in block['id'])
+        if not frames:
+            return None, []
+        return pd.concat(frames, ignore_index=True), kept
+
+    def _compute(self, version, model, feature_columns, pairs):
+        """Explain ``pairs`` in one batch and cache the results; returns {pair: explanation}"""
+        X, kept = self._features(pairs)
+        if not kept:
+            return {}
+        X = X[list(feature_columns)]
+        explainer = self._explainer_for(version, model)
+        with stage_timer('explain', items=len(kept)):
+            contributions = _positive_class(explainer.shap_values(X), model.classes_)
+            probabilities = model.predict_proba(X)[:, _positive_index(model.classes_)]
+        base_value = float(np.ravel(_positive_class(explainer.expected_value, model.classes_))[0])
+
+        explained = {}
+        for row, (donor_id, recipient_id) in enumerate(kept):
+            order = np.argsort(-np.abs(contributions[row]))
+            explanation = {
+                'donor_id': donor_id,
+                'recipient_id': recipient_id,
+                'model_version': version,
+                'base_value': round(base_value, 6),
+                'compatibility_percentage': round(float(probabilities[row]) * 100, 2),
+                'contributions': [
+                    {
+                        'feature': feature_columns[i],
+                        'value': None if pd.isna(X.iat[row, i]) else float(X.iat[row, i]),
+                        'shap_value': round(float(contributions[row][i]), 6)
+                    }
+                    for i in order
+                ]
+            }
+            self.cache.put((version, donor_id, recipient_id), explanation)
+            explained[(donor_id, recipient_id)] = explanation
+        return explained
+
+    def explain_pairs(self, pairs):
+        """Explanations for (donor_id, recipient_id) pairs, in order.
+
+        Pairs that are not candidates (unknown ids or organ mismatch) map
+        to None.
+        """
+        version, model, feature_columns = self._current()
+        if version is None:
+            raise RuntimeError("No trained model is published yet")
+        pairs = [(int(donor_id), int(recipient_id)) for donor_id, recipient_id in pairs]
+
+        found = {}
+        missing = []
+        for pair in pairs:
+            explanation = self.cache.get((version, *pair))
+            if explanation is None:
+                missing.append(pair)
+            else:
+                found[pair] = explanation
+        count_explain_cache(len(found), len(missing))
+
+        for start in range(0, len(missing), BATCH_SIZE):
+            found.update(self._compute(version, model, feature_columns, missing[start:start + BATCH_SIZE]))
+        return [found.get(pair) for pair in pairs]
+
+    def explain(self, donor_id, recipient_id):
+        return self.explain_pairs([(donor_id, recipient_id)])[0]
+
+    def top_pairs(self, version, top_k):
+        """(donor_id, recipient_id) of each recipient's ``top_k`` best stored scores"""
+        rank = func.row_number().over(
+            partition_by=PairScore.recipient_id,
+            order_by=(PairScore.compatibility_score.desc(), PairScore.donor_id)
+        ).label('rank')
+        ranked = select(PairScore.donor_id, PairScore.recipient_id, rank).where(
+            PairScore.model_version == version
+        ).subquery()
+        rows = db.session.execute(
+            select(ranked.c.donor_id, ranked.c.recipient_id)
+            .where(ranked.c.rank <= top_k)
+            .order_by(ranked.c.recipient_id, ranked.c.rank)
+        ).all()
+        return [(int(donor_id), int(recipient_id)) for donor_id, recipient_id in rows]
+
+    def precompute(self, top_k=DEFAULT_TOP_K):
+        """Explain every recipient's top-K pairs of the current version; returns pairs computed"""
+        version, model, feature_columns = self._current()
+        if version is None:
+            return 0
+        # Never precompute more than fits, or later batches would evict earlier ones
+        pairs = [pair for pair in self.top_pairs(version, top_k)[:self.cache.max_entries]
+                 if (version, *pair) not in self.cache]
+        computed = 0
+        for start in range(0, len(pairs), BATCH_SIZE):
+            if self.handle.get()[0] != version:
+                break
+            computed += len(self._compute(version, model, feature_columns, pairs[start:start + BATCH_SIZE]))
+        return computed
+
+    def on_publish(self, version):
+        """Publish listener: explain the new version's top-K pairs in the background"""
+        if self.app is not None and self.precompute_top_k:
+            self.schedule_precompute()
+
+    def schedule_precompute(self):
+        """Run ``precompute`` in a daemon thread unless one is already running"""
+        if self._precompute_thread is not None and self._precompute_thread.is_alive():
+            return self._precompute_thread
+        app, top_k = self.app, self.precompute_top_k
+
+        def run():
+            with app.app_context():
+                try:
+                    computed = self.precompute(top_k)
+                    print(f"✅ Precomputed {computed} explanations (top {top_k} per recipient)")
+                except Exception as e:
+                    print(f"❌ Explanation precompute failed: {e}")
+                finally:
+                    db.session.remove()
+
+        self._precompute_thread = threading.Thread(target=run, name='explain-precompute', daemon=True)
+        self._precompute_thread.start()
+        return self._precompute_thread
+
+    def stats(self):
+        return {'model_version': self._version, **self.cache.stats()}
+
+
+_service = None
+
+
+def get_explanation_service():
+    """Process-wide ExplanationService"""
+    global _service
+    if _service is None:
+        _service = ExplanationService()
+    return _service
+
+
+def _on_publish(version):
+    if _service is not None:
+        _service.on_publish(version)
+
+
+def init_explanations(app, path='/api/explain', max_entries=DEFAULT_MAX_ENTRIES, precompute_top_k=DEFAULT_TOP_K):
+    """Serve explanations at ``path`` and precompute top-K pairs after each model publish"""
+    from flask import jsonify, request
+    from flask_login import login_required
+
+    global _service
+    _service = ExplanationService(max_entries)
+    _service.app = app
+    _service.precompute_top_k = precompute_top_k
+    add_publish_listener(_on_publish)
+
+    def explain_view():
+        if request.method == 'POST':
+            pairs = (request.get_json(silent=True) or {}).get('pairs') or []
+        else:
+            pairs = [(request.args.get('donor_id', type=int), request.args.get('recipient_id', type=int))]
+        if not pairs or len(pairs) > MAX_PAIRS_PER_REQUEST or any(
+            not isinstance(pair, (list, tuple)) or len(pair) != 2 or None in pair for pair in pairs
+        ):
+            return jsonify({'error': f'Give donor_id and recipient_id, or 1-{MAX_PAIRS_PER_REQUEST} '
+                                     f'[donor_id, recipient_id] pairs'}), 400
+        try:
+            explanations = _service.explain_pairs(pairs)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Pair ids must be integers'}), 400
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 503
+        if request.method == 'GET' and explanations[0] is None:
+            return jsonify({'error': 'Not a candidate pair (unknown ids or organ mismatch)'}), 404
+        return jsonify({'explanations': explanations, 'cache': _service.stats()})
+
+    def stats_view():
+        return jsonify(_service.stats())
+
+    app.add_url_rule(path, 'api_explain', login_required(explain_view), methods=['GET', 'POST'])
+    app.add_url_rule(f'{path}/stats', 'api_explain_stats', login_required(stats_view))
+    return _service
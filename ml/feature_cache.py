@@ -0,0 +1,415 @@
+"""
+Memory-mapped, append-only feature-matrix cache on disk
+
+The candidate-pair feature matrix is stored once under
+``models/feature_cache/`` and shared by the retrain worker, evaluation,
+tuning, explanations, pair scoring and train_standalone.py:
+
+    manifest.json              columns, row count, generation, fingerprint
+    X-<epoch>.bin              float64 rows (n_rows x n_features), row-major
+    y-<epoch>.bin              int8 labels
+    donor_ids-<epoch>.bin      int64 pair index
+    recipient_ids-<epoch>.bin  int64 pair index
+    live-<generation>.npy      bool mask of rows that are still current
+    donors-<generation>.npy    (id, version) of every donor the rows were built from
+    recipients-<generation>.npy
+
+Readers map the first ``n_rows`` of the .bin files read-only, so every
+gunicorn worker shares the page cache instead of holding a copy. A sync
+with the current donors and recipients compares their row versions
+(``updated_at``) with the stored ones: pairs touching new or edited rows are
+computed and appended to the end of the files, pairs of edited or deleted
+rows are masked out in a new live mask, and the manifest is replaced
+atomically last, so readers never see a half-written state. The files are
+rewritten (a new epoch) only when most rows are dead, the feature columns
+change or FEATURE_VERSION is bumped.
+
+Usage:
+    cache = FeatureCache()
+    matrix, stats = cache.sync(donors_df, recipients_df)   # writer (retrain process)
+    X, y, new_rows = matrix.training_data()
+
+    matrix = get_feature_cache().current()                  # reader, None before the first sync
+    rows = matrix.fresh_pair_rows(donor_ids, recipient_ids, donors_df, recipients_df)   # -1: compute
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from startup import lazy_import
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR', 'models/feature_cache')
+# Bump whenever ml.feature_engineering changes what a feature means
+FEATURE_VERSION = 1
+MANIFEST = 'manifest.json'
+# Row arrays and their dtypes; X is (n_rows, n_features)
+ROW_ARRAYS = {'X': 'float64', 'y': 'int8', 'donor_ids': 'int64', 'recipient_ids': 'int64'}
+# Rewrite the files once fewer than this fraction of the rows are live
+MIN_LIVE_FRACTION = 0.5
+
+
+def row_versions(df):
+    """(n, 2) int64 array of (id, version), sorted by id.
+
+    The version is updated_at in ns (0 when NULL); frames without that
+    column (e.g. CSV input) use a hash of the row's contents instead.
+    """
+    ids = df['id'].to_numpy(dtype=np.int64)
+    if 'updated_at' in df:
+        stamps = pd.to_datetime(df['updated_at'])
+        versions = np.where(stamps.isna(), 0, stamps.to_numpy(dtype='datetime64[ns]').astype(np.int64))
+    else:
+        versions = pd.util.hash_pandas_object(df, index=False).to_numpy().view(np.int64)
+    table = np.column_stack([ids, versions])
+    return table[np.argsort(ids, kind='stable')]
+
+
+def fingerprint(donor_versions, recipient_versions, columns=()):
+    digest = hashlib.sha1(f'{FEATURE_VERSION}|{",".join(columns)}'.encode())
+    digest.update(np.ascontiguousarray(donor_versions).tobytes())
+    digest.update(b'|')
+    digest.update(np.ascontiguousarray(recipient_versions).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _changed_ids(current, cached):
+    """Ids in ``current`` that are new or carry another version than in ``cached``"""
+    if not len(cached):
+        return current[:, 0]
+    position = np.minimum(np.searchsorted(cached[:, 0], current[:, 0]), len(cached) - 1)
+    same = (cached[position, 0] == current[:, 0]) & (cached[position, 1] == current[:, 1])
+    return current[~same, 0]
+
+
+def _pair_keys(donor_ids, recipient_ids):
+    return (np.asarray(donor_ids, dtype=np.int64) << 32) | np.asarray(recipient_ids, dtype=np.int64)
+
+
+class FeatureMatrix:
+    """Read-only snapshot of one cache generation"""
+
+    def __init__(self, manifest, arrays, live, donor_versions, recipient_versions):
+        self.manifest = manifest
+        self.columns = manifest['columns']
+        self.generation = manifest['generation']
+        self.fingerprint = manifest['fingerprint']
+        self.appended_from = manifest['appended_from']
+        self.X = arrays['X']
+        self.y = arrays['y']
+        self.donor_ids = arrays['donor_ids']
+        self.recipient_ids = arrays['recipient_ids']
+        self.live = live
+        self.donor_versions = donor_versions
+        self.recipient_versions = recipient_versions
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.manifest['live_rows'])
+
+    def live_rows(self):
+        return np.flatnonzero(self.live)
+
+    def frame(self, rows):
+        """DataFrame of the given rows (a copy; the matrix itself stays mapped)"""
+        return pd.DataFrame(np.asarray(self.X[rows]), columns=self.columns)
+
+    def training_data(self):
+        """(X_df, y, new_rows) over the live rows; new_rows marks rows added by the last sync"""
+        rows = self.live_rows()
+        return self.frame(rows), np.asarray(self.y[rows]), rows >= self.appended_from
+
+    def pairs(self, rows=None):
+        """(donor_ids, recipient_ids) of ``rows`` (default: the live rows)"""
+        rows = self.live_rows() if rows is None else rows
+        return np.asarray(self.donor_ids[rows]), np.asarray(self.recipient_ids[rows])
+
+    def pair_rows(self, donor_ids, recipient_ids):
+        """Live row of each (donor_id, recipient_id) pair, -1 if not cached"""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    rows = self.live_rows()
+                    keys = _pair_keys(self.donor_ids[rows], self.recipient_ids[rows])
+                    order = np.argsort(keys, kind='stable')
+                    self._index = (keys[order], rows[order])
+        keys, rows = self._index
+        wanted = _pair_keys(donor_ids, recipient_ids)
+        if not len(keys):
+            return np.full(len(wanted), -1, dtype=np.int64)
+        position = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return np.where(keys[position] == wanted, rows[position], -1)
+
+    def fresh_pair_rows(self, donor_ids, recipient_ids, donors_df, recipients_df):
+        """Like ``pair_rows``, but also -1 where the donor or recipient is missing from
+        the frames or the cached row was built from another version of it"""
+        rows = self.pair_rows(donor_ids, recipient_ids)
+        stale = (
+            ~np.isin(donor_ids, donors_df['id']) | ~np.isin(recipient_ids, recipients_df['id'])
+            | np.isin(donor_ids, _changed_ids(row_versions(donors_df), self.donor_versions))
+            | np.isin(recipient_ids, _changed_ids(row_versions(recipients_df), self.recipient_versions))
+        )
+        return np.where(stale, -1, rows)
+
+    def matches(self, donors_df, recipients_df):
+        """True if the live rows are exactly the candidate pairs of these frames"""
+        return self.fingerprint == fingerprint(row_versions(donors_df), row_versions(recipients_df), self.columns)
+
+
+@contextmanager
+def _exclusive_lock(path):
+    """Hold an exclusive lock on ``path`` across processes (flock, or msvcrt on Windows)"""
+    with open(path, 'a+') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+            return
+        lock.seek(0)
+        while True:
+            try:
+                # LK_LOCK gives up after about ten seconds; keep waiting like flock
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FeatureCache:
+    """The cache directory: ``sync`` writes, ``current``/``open`` read"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._current = (None, None)
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _map(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode='r', shape=shape)
+
+    def open(self):
+        """FeatureMatrix of the committed generation, or None if there is none"""
+        for _ in range(3):
+            manifest = self._read_manifest()
+            if manifest is None:
+                return None
+            n_rows, epoch, generation = manifest['n_rows'], manifest['epoch'], manifest['generation']
+            try:
+                arrays = {
+                    name: self._map(f'{name}-{epoch}.bin', dtype,
+                                    (n_rows, len(manifest['columns'])) if name == 'X' else (n_rows,))
+                    for name, dtype in ROW_ARRAYS.items()
+                }
+                live = np.load(self._path(f'live-{generation}.npy'), mmap_mode='r')
+                donor_versions = np.load(self._path(f'donors-{generation}.npy'))
+                recipient_versions = np.load(self._path(f'recipients-{generation}.npy'))
+            except FileNotFoundError:
+                # A sync replaced this generation between reading the manifest and the files
+                continue
+            return FeatureMatrix(manifest, arrays, live, donor_versions, recipient_versions)
+        return None
+
+    def current(self):
+        """Per-process cached ``open()``; costs a stat() when nothing changed"""
+        try:
+            stat = os.stat(self._path(MANIFEST))
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if self._current[0] != stamp:
+            with self._lock:
+                if self._current[0] != stamp:
+                    self._current = (stamp, self.open())
+        return self._current[1]
+
+    def sync(self, donors_df, recipients_df, feature_fn=None):
+        """Bring the cache up to date with the frames; returns (FeatureMatrix, stats).
+
+        Only pairs touching donors or recipients that are new or whose
+        updated_at moved are computed; they are appended to the files.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with _exclusive_lock(self._path('.lock')):
+            return self._sync(donors_df, recipients_df, feature_fn)
+
+    def _sync(self, donors_df, recipients_df, feature_fn):
+        from ml.candidates import create_candidate_features_with_pairs
+
+        donors, recipients = row_versions(donors_df), row_versions(recipients_df)
+        matrix = self.open()
+        if matrix is not None and matrix.manifest.get('feature_version') != FEATURE_VERSION:
+            matrix = None
+        if matrix is not None and matrix.fingerprint == fingerprint(donors, recipients, matrix.columns):
+            return matrix, {'reused_pairs': len(matrix), 'computed_pairs': 0}
+
+        if matrix is None:
+            parts = [(donors_df, recipients_df)]
+            stale = None
+        else:
+            changed_donors = _changed_ids(donors, matrix.donor_versions)
+            changed_recipients = _changed_ids(recipients, matrix.recipient_versions)
+            stale = (
+                ~np.isin(matrix.donor_ids, donors[:, 0]) | ~np.isin(matrix.recipient_ids, recipients[:, 0])
+                | np.isin(matrix.donor_ids, changed_donors) | np.isin(matrix.recipient_ids, changed_recipients)
+            )
+            changed_donor_rows = donors_df['id'].isin(changed_donors)
+            parts = [
+                (donors_df[changed_donor_rows], recipients_df),
+                (donors_df[~changed_donor_rows], recipients_df[recipients_df['id'].isin(changed_recipients)]),
+            ]
+
+        frames, labels, donor_ids, recipient_ids = [], [], [], []
+        for donors_part, recipients_part in parts:
+            if len(donors_part) and len(recipients_part):
+                X, y, part_donors, part_recipients = create_candidate_features_with_pairs(
+                    donors_part, recipients_part, feature_fn=feature_fn
+                )
+                if len(X):
+                    frames.append(X)
+                    labels.append(np.asarray(y, dtype=ROW_ARRAYS['y']))
+                    donor_ids.append(part_donors)
+                    recipient_ids.append(part_recipients)
+        new = pd.concat(frames, ignore_index=True) if frames else None
+        columns = list(new.columns) if new is not None else (matrix.columns if matrix is not None else [])
+        if matrix is not None and new is not None and list(new.columns) != matrix.columns:
+            # The feature set changed under the same FEATURE_VERSION: start over
+            self._commit_manifest(None)
+            return self._sync(donors_df, recipients_df, feature_fn)
+        new_rows = {
+            'X': new[columns].to_numpy(dtype=ROW_ARRAYS['X']) if new is not None else np.empty((0, len(columns))),
+            'y': np.concatenate(labels) if labels else np.empty(0, dtype=ROW_ARRAYS['y']),
+            'donor_ids': np.concatenate(donor_ids) if donor_ids else np.empty(0, dtype=np.int64),
+            'recipient_ids': np.concatenate(recipient_ids) if recipient_ids else np.empty(0, dtype=np.int64),
+        }
+        computed = len(new_rows['y'])
+
+        if matrix is None:
+            self._rewrite(None, None, new_rows, columns, donors, recipients)
+            reused = 0
+        else:
+            live = np.asarray(matrix.live) & ~stale
+            reused = int(live.sum())
+            if reused + computed < (matrix.manifest['n_rows'] + computed) * MIN_LIVE_FRACTION:
+                self._rewrite(matrix, live, new_rows, columns, donors, recipients)
+            else:
+                self._append(matrix, live, new_rows, donors, recipients)
+        return self.open(), {'reused_pairs': reused, 'computed_pairs': computed}
+
+    def _write_generation(self, generation, live, donors, recipients):
+        for name, array in (('live', live), ('donors', donors), ('recipients', recipients)):
+            temp_path = self._path(f'.{name}-{generation}.npy')
+            np.save(temp_path, array)
+            os.replace(temp_path, self._path(f'{name}-{generation}.npy'))
+
+    def _commit_manifest(self, manifest):
+        """Replace the manifest (None removes it), then delete files no generation uses"""
+        path = self._path(MANIFEST)
+        if manifest is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            temp_path = f'{path}.tmp-{os.getpid()}'
+            with open(temp_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        keep = set()
+        if manifest is not None:
+            keep = {f"{name}-{manifest['epoch']}.bin" for name in ROW_ARRAYS}
+            keep |= {f"{name}-{manifest['generation']}.npy" for name in ('live', 'donors', 'recipients')}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(('.bin', '.npy')) and not name.startswith('.') and name not in keep:
+                os.remove(self._path(name))
+
+    def _manifest(self, previous, columns, epoch, generation, n_rows, live_rows, appended_from, donors, recipients):
+        return {
+            'feature_version': FEATURE_VERSION,
+            'columns': columns,
+            'epoch': epoch,
+            'generation': generation,
+            'n_rows': int(n_rows),
+            'live_rows': int(live_rows),
+            'appended_from': int(appended_from),
+            'fingerprint': fingerprint(donors, recipients, columns),
+            'created_at': previous['created_at'] if previous else datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'synced_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def _append(self, matrix, live, new_rows, donors, recipients):
+        previous = matrix.manifest
+        n_rows, epoch, generation = previous['n_rows'], previous['epoch'], previous['generation'] + 1
+        for name, dtype in ROW_ARRAYS.items():
+            path = self._path(f'{name}-{epoch}.bin')
+            row_bytes = np.dtype(dtype).itemsize * (len(matrix.columns) if name == 'X' else 1)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                # Drop anything a crashed sync wrote past the committed rows
+                f.truncate(n_rows * row_bytes)
+                f.seek(n_rows * row_bytes)
+                f.write(np.ascontiguousarray(new_rows[name], dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        added = len(new_rows['y'])
+        live = np.concatenate([live, np.ones(added, dtype=bool)])
+        self._write_generation(generation, live, donors, recipients)
+        self._commit_manifest(self._manifest(previous, matrix.columns, epoch, generation, n_rows + added,
+                                             live.sum(), n_rows, donors, recipients))
+
+    def _rewrite(self, matrix, live, new_rows, columns, donors, recipients):
+        """Write a new epoch holding the live rows of ``matrix`` followed by ``new_rows``"""
+        previous = matrix.manifest if matrix is not None else self._read_manifest()
+        epoch = previous['epoch'] + 1 if previous else 0
+        generation = previous['generation'] + 1 if previous else 0
+        kept = np.flatnonzero(live) if matrix is not None else np.arange(0)
+        for name, dtype in ROW_ARRAYS.items():
+            temp_path = self._path(f'.{name}-{epoch}.bin')
+            with open(temp_path, 'wb') as f:
+                if len(kept):
+                    f.write(np.ascontiguousarray(getattr(matrix, name)[kept], dtype=dtype).tobytes())
+                f.write(np.ascontiguousarray(new_rows[name], dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self._path(f'{name}-{epoch}.bin'))
+        n_rows = len(kept) + len(new_rows['y'])
+        self._write_generation(generation, np.ones(n_rows, dtype=bool), donors, recipients)
+        self._commit_manifest(self._manifest(previous, columns, epoch, generation, n_rows, n_rows, len(kept),
+                                             donors, recipients))
+
+
+_caches = {}
+
+
+def get_feature_cache(cache_dir=DEFAULT_CACHE_DIR):
+    """Process-wide FeatureCache for a directory"""
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches.setdefault(cache_dir, FeatureCache(cache_dir))
+    return cache
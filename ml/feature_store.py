@@ -0,0 +1,457 @@
+"""
+In-memory columnar store of donor and recipient attributes
+
+Each process keeps the attributes the model's features are computed from
+as NumPy columns: encoded organ, blood group and gender, age, BMI,
+coordinates, organ sizes, storage hours, risk flags, urgency, and the
+``hla_bits`` allele bitsets as a uint8 matrix. The store is built once
+(``init_feature_store`` at startup, or lazily on first use). Before each
+use it compares the shared data version (``models.data_version_token``)
+with the one it was synced at; when another worker, this one or a bulk
+ingest wrote since, rows updated after the last sync are reloaded and
+deleted ids dropped.
+
+``score_donor`` ranks every eligible recipient (same organ, ABO
+compatible) for one donor entirely on these arrays: the twelve pair
+features of ``create_features`` are computed vectorized (the block
+engine of ``ml.vectorized_features``) and the current registry model
+scores them in one batch, with no ORM query or DataFrame per record.
+Distances use the haversine formula rather than geopy's geodesic, which
+differs by well under 1%. A model trained on features
+beyond those twelve is scored through ``predict_compatibility`` on the
+eligible recipients' rows instead.
+
+Compare the vectorized features with ``create_features`` on a database:
+    python -m ml.feature_store --check --database-uri sqlite:////abs/path/organmatch.db
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from metrics import stage_timer
+from ml.candidates import normalize_blood_group
+from ml.vectorized_features import (BLOOD_GROUPS, DEFAULT_MAX_STORAGE_HOURS, FEATURE_COLUMNS, MAX_STORAGE_HOURS,
+                                    UNKNOWN_CODE, block_features, compatible_blood)
+from startup import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Rows updated this long before the last sync are reloaded too, covering
+# transactions that committed after it and clock skew between workers
+SYNC_OVERLAP = timedelta(minutes=5)
+
+# (column, dtype) per record type; floats use NaN and codes -1 for missing
+COMMON_COLUMNS = [
+    ('age', 'float64'), ('bmi', 'float64'), ('latitude', 'float64'), ('longitude', 'float64'),
+    ('diabetes', 'float64'), ('hypertension', 'float64'), ('blood_code', 'int8'),
+    ('gender_code', 'int16'), ('organ_code', 'int16'),
+]
+DONOR_COLUMNS = COMMON_COLUMNS + [
+    ('organ_storage_hours', 'float64'), ('organ_size', 'float64'),
+    ('smoking', 'float64'), ('alcohol', 'float64'),
+]
+RECIPIENT_COLUMNS = COMMON_COLUMNS + [('organ_size_needed', 'float64'), ('urgency_level', 'float64')]
+RAW_ATTRIBUTES = {
+    'donors': ['id', 'age', 'gender', 'blood_group', 'organ_type', 'bmi', 'hla_bits', 'latitude', 'longitude',
+               'organ_storage_hours', 'organ_size', 'diabetes', 'hypertension', 'smoking', 'alcohol'],
+    'recipients': ['id', 'age', 'gender', 'blood_group', 'organ_needed', 'bmi', 'hla_bits', 'latitude',
+                   'longitude', 'organ_size_needed', 'diabetes', 'hypertension', 'urgency_level'],
+}
+
+
+def _number(value):
+    try:
+        return np.nan if value is None else float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class FeatureMismatchError(RuntimeError):
+    """The published model needs features the store cannot compute"""
+
+
+class CodeBook:
+    """Stable small-integer codes for category strings (organs, genders).
+
+    With ``exact=True`` values are coded as they are, None included, so
+    equal codes mean ``==`` values like ``create_features`` compares them.
+    """
+
+    def __init__(self, exact=False):
+        self.exact = exact
+        self.codes = {}
+        self.names = []
+
+    def code(self, name):
+        if name is None and not self.exact:
+            return -1
+        if not self.exact:
+            name = str(name).strip()
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+class ColumnStore:
+    """Growable NumPy columns of one record type, one slot per record id"""
+
+    def __init__(self, columns, organ_codes, gender_codes):
+        self.columns = columns
+        self.organ_codes = organ_codes
+        self.gender_codes = gender_codes
+        self.ids = np.empty(0, dtype=np.int64)
+        self.live = np.empty(0, dtype=bool)
+        self.hla = np.zeros((0, 1), dtype=np.uint8)
+        self.data = {name: np.empty(0, dtype=dtype) for name, dtype in columns}
+        self._size = 0
+        self._positions = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _resize(self, capacity, hla_width):
+        for name, dtype in self.columns:
+            old = self.data[name]
+            new = np.full(capacity, np.nan if np.dtype(dtype).kind == 'f' else -1, dtype=dtype)
+            new[:self._size] = old[:self._size]
+            self.data[name] = new
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:self._size] = self.ids[:self._size]
+        live = np.zeros(capacity, dtype=bool)
+        live[:self._size] = self.live[:self._size]
+        hla = np.zeros((capacity, hla_width), dtype=np.uint8)
+        hla[:self._size, :self.hla.shape[1]] = self.hla[:self._size]
+        self.ids, self.live, self.hla = ids, live, hla
+
+    def _encode(self, record):
+        blood_group = normalize_blood_group(record.get('blood_group'))
+        values = {
+            'age': _number(record.get('age')),
+            'bmi': _number(record.get('bmi')),
+            'latitude': _number(record.get('latitude')),
+            'longitude': _number(record.get('longitude')),
+            'diabetes': _number(record.get('diabetes')),
+            'hypertension': _number(record.get('hypertension')),
+            'blood_code': BLOOD_GROUPS.index(blood_group) if blood_group in BLOOD_GROUPS else UNKNOWN_CODE,
+            'gender_code': self.gender_codes.code(record.get('gender')),
+            'organ_code': self.organ_codes.code(record.get('organ_type', record.get('organ_needed'))),
+        }
+        for name, _ in self.columns:
+            if name not in values:
+                values[name] = _number(record.get(name))
+        return values
+
+    def update(self, record):
+        """Insert or overwrite one record given as a dict of raw attributes"""
+        hla_bits = record.get('hla_bits') or b''
+        values = self._encode(record)
+        with self._lock:
+            position = self._positions.get(record['id'])
+            if len(hla_bits) > self.hla.shape[1]:
+                self._resize(len(self.ids), len(hla_bits))
+            if position is None:
+                if self._size == len(self.ids):
+                    self._resize(max(16, 2 * len(self.ids)), self.hla.shape[1])
+                position = self._size
+                self._size += 1
+                self._positions[record['id']] = position
+                self.ids[position] = record['id']
+            for name, value in values.items():
+                self.data[name][position] = value
+            self.hla[position] = 0
+            self.hla[position, :len(hla_bits)] = np.frombuffer(hla_bits, dtype=np.uint8)
+            self.live[position] = True
+
+    def remove(self, record_id):
+        with self._lock:
+            position = self._positions.pop(record_id, None)
+            if position is not None:
+                self.live[position] = False
+
+    def position(self, record_id):
+        return self._positions.get(record_id)
+
+    def view(self):
+        """(positions of live records, columns, hla) as consistent array views"""
+        with self._lock:
+            size = self._size
+            return (np.flatnonzero(self.live[:size]),
+                    {name: column[:size] for name, column in self.data.items()},
+                    self.hla[:size])
+
+
+def pair_features(donor, recipients, organ_name):
+    """The twelve ``create_features`` columns for one donor against many recipients.
+
+    ``donor`` maps column names to scalars (plus 'hla', a bitset row);
+    ``recipients`` maps them to arrays (plus 'hla', a bitset matrix).
+    """
+    width = max(len(donor['hla']), recipients['hla'].shape[1])
+    donor_block = {name: np.array([value]) for name, value in donor.items() if name != 'hla'}
+    donor_block['hla'] = np.zeros((1, width), dtype=np.uint8)
+    donor_block['hla'][0, :len(donor['hla'])] = donor['hla']
+    donor_block['max_storage_hours'] = np.array([MAX_STORAGE_HOURS.get(organ_name, DEFAULT_MAX_STORAGE_HOURS)],
+                                                dtype=float)
+    recipient_block = dict(recipients)
+    recipient_block['hla'] = np.zeros((len(recipients['age']), width), dtype=np.uint8)
+    recipient_block['hla'][:, :recipients['hla'].shape[1]] = recipients['hla']
+    return {name: np.ascontiguousarray(values[:, 0])
+            for name, values in block_features(donor_block, recipient_block).items()}
+
+
+class FeatureStore:
+    """Donor and recipient column stores sharing their organ and gender code books"""
+
+    def __init__(self):
+        self.organ_codes = CodeBook()
+        self.gender_codes = CodeBook(exact=True)
+        self.donors = ColumnStore(DONOR_COLUMNS, self.organ_codes, self.gender_codes)
+        self.recipients = ColumnStore(RECIPIENT_COLUMNS, self.organ_codes, self.gender_codes)
+        self.built_at = None
+        self.data_version = None
+        self.synced_through = None
+        self._sync_lock = threading.Lock()
+
+    def store_for(self, table_name):
+        return self.donors if table_name == 'donors' else self.recipients
+
+    def load(self, connection, chunk_size=5000):
+        """Fill both stores from the database"""
+        from models import Donor, Recipient, data_version_token
+
+        self.data_version = data_version_token(connection)
+        self.synced_through = datetime.utcnow()
+        for model in (Donor, Recipient):
+            table = model.__table__
+            store = self.store_for(table.name)
+            result = connection.execute(
+                select(*[table.c[name] for name in RAW_ATTRIBUTES[table.name]])
+                .execution_options(yield_per=chunk_size)
+            )
+            for partition in result.partitions():
+                for row in partition:
+                    store.update(row._asdict())
+        self.built_at = time.time()
+        return self
+
+    def refresh(self, connection):
+        """Apply writes made since the last sync; returns whether any were found"""
+        from models import Donor, Recipient, data_version_token, record_changes
+
+        with self._sync_lock:
+            version = data_version_token(connection)
+            if version == self.data_version:
+                return False
+            synced_through = datetime.utcnow()
+            for model in (Donor, Recipient):
+                store = self.store_for(model.__tablename__)
+                rows, ids = record_changes(connection, model, RAW_ATTRIBUTES[model.__tablename__],
+                                           self.synced_through - SYNC_OVERLAP)
+                for row in rows:
+                    store.update(row)
+                live, _, _ = store.view()
+                for record_id in set(store.ids[live].tolist()) - ids:
+                    store.remove(record_id)
+            self.data_version = version
+            self.synced_through = synced_through
+            return True
+
+    def eligible_recipients(self, donor_id):
+        """(donor values, recipient positions, recipient columns, recipient hla) for one donor"""
+        position = self.donors.position(donor_id)
+        if position is None:
+            raise KeyError(donor_id)
+        _, donor_columns, donor_hla = self.donors.view()
+        donor = {name: column[position] for name, column in donor_columns.items()}
+        donor['hla'] = donor_hla[position]
+
+        live, columns, hla = self.recipients.view()
+        eligible = live[columns['organ_code'][live] == donor['organ_code']]
+        eligible = eligible[compatible_blood()[donor['blood_code'], columns['blood_code'][eligible]]]
+        return donor, eligible, columns, hla
+
+    def donor_features(self, donor_id, feature_columns=None):
+        """(recipient_ids, feature DataFrame) of every eligible recipient of a donor"""
+        donor, eligible, columns, hla = self.eligible_recipients(donor_id)
+        recipients = {name: column[eligible] for name, column in columns.items()}
+        recipients['hla'] = hla[eligible]
+        features = pair_features(donor, recipients, self.organ_codes.names[donor['organ_code']]
+                                 if donor['organ_code'] >= 0 else None)
+        X = pd.DataFrame(features)
+        if feature_columns is not None:
+            X = X[list(feature_columns)]
+        return self.recipients.ids[eligible], X
+
+    def score_donor(self, donor_id, top_n=None, min_score=None):
+        """Eligible recipients of a donor ranked by compatibility, best first.
+
+        Uses the current registry model. Returns a list of
+        {'recipient_id', 'compatibility_percentage'} dicts.
+        """
+        from ml.model_registry import get_model_handle
+
+        handle = get_model_handle()
+        version, model, feature_columns = handle.get()
+        if model is None:
+            raise RuntimeError("No trained model is published yet")
+        missing = missing_features(feature_columns)
+        if missing:
+            recipient_ids, scores = self._predict_from_rows(
+                donor_id, os.path.join(handle.registry_dir, version, 'model.joblib'), missing
+            )
+        else:
+            recipient_ids, X = self.donor_features(donor_id, feature_columns)
+            if not len(recipient_ids):
+                return []
+            with stage_timer('predict', items=len(recipient_ids)):
+                classes = list(model.classes_)
+                scores = model.predict_proba(X)[:, classes.index(1) if 1 in classes else -1] * 100
+        order = np.argsort(-scores, kind='stable')
+        if min_score is not None:
+            order = order[scores[order] >= min_score]
+        if top_n is not None:
+            order = order[:top_n]
+        return [
+            {'recipient_id': int(recipient_ids[i]), 'compatibility_percentage': round(float(scores[i]), 2)}
+            for i in order
+        ]
+
+    def _predict_from_rows(self, donor_id, model_path, missing, chunk_size=5000):
+        """(recipient_ids, scores) through ``predict_compatibility`` on the
+        database rows of the donor and its eligible recipients"""
+        try:
+            from ml.predict_model import predict_compatibility
+        except ImportError:
+            raise FeatureMismatchError(
+                f"The published model expects features the feature store cannot compute: {missing}"
+            )
+        from models import db, Donor, Recipient
+
+        _, eligible, _, _ = self.eligible_recipients(donor_id)
+        eligible_ids = self.recipients.ids[eligible].tolist()
+        if not eligible_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        donors_df = pd.DataFrame([db.session.get(Donor, donor_id).to_dict()])
+        recipients_df = pd.DataFrame([
+            recipient.to_dict()
+            for start in range(0, len(eligible_ids), chunk_size)
+            for recipient in Recipient.query.filter(Recipient.id.in_(eligible_ids[start:start + chunk_size]))
+        ])
+        with stage_timer('predict', items=len(recipients_df)):
+            results = predict_compatibility(donors_df, recipients_df, model_path=model_path)
+        return (np.array([result['recipient_id'] for result in results], dtype=np.int64),
+                np.array([result['compatibility_percentage'] for result in results], dtype=float))
+
+
+# Process-wide store, built on first use or by init_feature_store()
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_feature_store():
+    """The process-wide store, brought up to date with the database"""
+    global _store
+    from models import db
+
+    with db.engine.connect() as connection:
+        if _store is None:
+            with _store_lock:
+                if _store is None:
+                    _store = FeatureStore().load(connection)
+                    return _store
+        _store.refresh(connection)
+    return _store
+
+
+def missing_features(feature_columns):
+    """Model feature columns ``pair_features`` does not compute"""
+    return [column for column in feature_columns if column not in FEATURE_COLUMNS]
+
+
+def score_donor(donor_id, top_n=None, min_score=None):
+    return get_feature_store().score_donor(donor_id, top_n, min_score)
+
+
+def init_feature_store(app, path='/api/donors/<int:donor_id>/scores'):
+    """Build the store now and serve ``score_donor`` at ``path``"""
+    from flask import jsonify, request
+    from flask_login import login_required
+
+    with app.app_context():
+        started = time.perf_counter()
+        store = get_feature_store()
+        print(f"✅ Feature store loaded {len(store.donors)} donors and {len(store.recipients)} recipients "
+              f"in {time.perf_counter() - started:.2f}s")
+
+    def scores_view(donor_id):
+        store = get_feature_store()
+        if store.donors.position(donor_id) is None:
+            return jsonify({'error': f'Donor {donor_id} not found'}), 404
+        try:
+            ranked = store.score_donor(donor_id, top_n=request.args.get('top_n', 50, type=int),
+                                       min_score=request.args.get('min_score', type=float))
+        except (RuntimeError, ValueError, KeyError) as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'donor_id': donor_id, 'matches': ranked})
+
+    app.add_url_rule(path, 'api_donor_scores', login_required(scores_view))
+    return store
+
+
+def check_parity(database_uri, sample_donors=20, feature_fn=None):
+    """Max absolute difference per feature between the store and ``create_features``"""
+    from sqlalchemy import create_engine
+
+    from ml.retrain_worker import load_frames
+
+    if feature_fn is None:
+        from ml.feature_engineering import create_features
+        feature_fn = create_features
+
+    engine = create_engine(database_uri)
+    try:
+        with engine.connect() as connection:
+            store = FeatureStore().load(connection)
+    finally:
+        engine.dispose()
+    donors_df, recipients_df = load_frames(database_uri)
+
+    differences = {}
+    for donor_id in donors_df['id'].head(sample_donors):
+        recipient_ids, X = store.donor_features(int(donor_id))
+        if not len(recipient_ids):
+            continue
+        recipients = recipients_df.set_index('id').loc[recipient_ids].reset_index()
+        expected, _ = feature_fn(donors_df[donors_df['id'] == donor_id], recipients)
+        for column in X.columns:
+            if column in expected:
+                gap = np.nanmax(np.abs(X[column].to_numpy(float) - expected[column].to_numpy(float)))
+                differences[column] = max(differences.get(column, 0.0), float(gap))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the feature store against create_features')
+    parser.add_argument('--check', action='store_true', required=True)
+    parser.add_argument('--database-uri', required=True)
+    parser.add_argument('--sample-donors', type=int, default=20)
+    args = parser.parse_args()
+
+    differences = check_parity(args.database_uri, args.sample_donors)
+    for column, gap in sorted(differences.items()):
+        print(f"  {'✅' if gap < 1e-6 else '⚠️ '} {column:<24} max difference {gap:.6g}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Vectorized HLA matching on the allele bitsets stored in Donor/Recipient.hla_bits
+"""
+
+from startup import lazy_import
+
+np = lazy_import('numpy')
+
+_popcount_table = None
+
+
+def _byte_popcounts():
+    """Number of set bits for every possible byte value (built on first use)"""
+    global _popcount_table
+    if _popcount_table is None:
+        _popcount_table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return _popcount_table
+
+
+def bits_to_matrix(bitsets, n_bytes=None):
+    """Stack stored ``hla_bits`` values into a (n_records, n_bytes) uint8 matrix.
+
+    Missing bitsets (untyped records) become all-zero rows. Pass ``n_bytes``
+    to pad two sides of a comparison to the same width.
+    """
+    bitsets = [bits or b'' for bits in bitsets]
+    if n_bytes is None:
+        n_bytes = max((len(bits) for bits in bitsets), default=0)
+    matrix = np.zeros((len(bitsets), max(n_bytes, 1)), dtype=np.uint8)
+    for i, bits in enumerate(bitsets):
+        matrix[i, :len(bits)] = np.frombuffer(bits, dtype=np.uint8)
+    return matrix
+
+
+def popcount(matrix):
+    """Number of alleles in each bitset row"""
+    return _byte_popcounts()[matrix].sum(axis=-1, dtype=np.int32)
+
+
+def hla_match_counts(donor_matrix, recipient_matrix):
+    """Shared-allele counts for every donor x recipient pair (AND + popcount).
+
+    Memory is n_donors * n_recipients * n_bytes, so callers scoring large
+    registries should pass donors in blocks.
+    """
+    return popcount(donor_matrix[:, None, :] & recipient_matrix[None, :, :])
+
+
+def hla_match_scores(donor_matrix, recipient_matrix):
+    """Fraction of each donor's alleles found in each recipient's typing.
+
+    Follows ``calculate_hla_match_score``: pairs whose donor has no typed
+    alleles score a neutral 0.5.
+    """
+    counts = hla_match_counts(donor_matrix, recipient_matrix)
+    totals = popcount(donor_matrix)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = counts / totals
+    return np.where(totals > 0, scores, 0.5)
@@ -0,0 +1,368 @@
+"""
+Versioned model registry with memory-mapped, hot-swappable loading
+
+Every trained model is published as an immutable directory
+``<registry>/<version>/`` holding ``model.joblib`` (uncompressed, so numpy
+arrays can be memory-mapped) and ``meta.json`` (feature columns, model
+params, data fingerprint), plus ``metrics.json`` with the evaluation
+computed at training time when one was supplied. A ``CURRENT`` file names
+the active version and is replaced atomically, so workers never see a
+half-written model: each worker checks the pointer cheaply on every
+request and swaps to a new version the next time it changes, without a
+restart.
+
+Measure per-worker memory of a load:
+    python -m ml.model_registry --measure
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+
+from metrics import stage_timer
+
+DEFAULT_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'models/registry')
+DEFAULT_MODEL_PATH = 'models/random_forest.joblib'
+CURRENT_POINTER = 'CURRENT'
+METRICS_FILE = 'metrics.json'
+
+
+def dataframe_fingerprint(*frames):
+    """Content hash of one or more DataFrames (order-sensitive)"""
+    import pandas as pd
+
+    digest = hashlib.sha1()
+    for frame in frames:
+        digest.update(','.join(map(str, frame.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def database_fingerprint(session=None):
+    """Cheap fingerprint of the donor/recipient tables.
+
+    Built from row counts, max ids and max updated_at, so any insert,
+    delete or edit changes it without reading the tables.
+    """
+    from models import db, Donor, Recipient
+
+    session = session or db.session
+    parts = []
+    for model in (Donor, Recipient):
+        count, max_id, max_updated = session.query(
+            db.func.count(model.id), db.func.max(model.id), db.func.max(model.updated_at)
+        ).one()
+        parts.append(f'{model.__tablename__}:{count}:{max_id}:{max_updated}')
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:16]
+
+
+def _write_atomic(path, text):
+    temp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+_publish_listeners = []
+
+
+def add_publish_listener(listener):
+    """Call ``listener(version)`` whenever a version is made current from this process.
+
+    Versions published by the retrain worker process are announced by
+    ``ml.retrain_worker`` once its job returns, in the process that
+    submitted it.
+    """
+    if listener not in _publish_listeners:
+        _publish_listeners.append(listener)
+
+
+def notify_published(version):
+    for listener in list(_publish_listeners):
+        try:
+            listener(version)
+        except Exception as e:
+            print(f"❌ Publish listener failed: {e}")
+
+
+def publish(model, feature_columns, model_params=None, data_fingerprint=None,
+            registry_dir=DEFAULT_REGISTRY_DIR, legacy_path=DEFAULT_MODEL_PATH, extra_meta=None,
+            metrics=None):
+    """Write a trained model as a new immutable version and make it current.
+
+    ``metrics`` (see ``ml.evaluation.compute_metrics``) is stored with the
+    version so /evaluate never has to recompute it. ``legacy_path`` (the
+    single-file artifact ``load_model`` reads) is also replaced atomically
+    so older code paths keep working. Returns the version string.
+    """
+    import joblib
+
+    os.makedirs(registry_dir, exist_ok=True)
+    created_at = datetime.utcnow()
+    version = f"{created_at.strftime('%Y%m%d%H%M%S%f')}-{(data_fingerprint or 'nodata')[:8]}"
+
+    staging_dir = os.path.join(registry_dir, f'.staging-{version}-{os.getpid()}')
+    os.makedirs(staging_dir)
+    artifact = {
+        'model': model,
+        'feature_columns': list(feature_columns),
+        'model_params': model_params
+    }
+    joblib.dump(artifact, os.path.join(staging_dir, 'model.joblib'))
+    if hasattr(model, 'estimators_'):
+        from ml.compiled_forest import CompiledForest
+        CompiledForest.from_model(model, feature_columns).save(staging_dir)
+    meta = {
+        'version': version,
+        'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'feature_columns': list(feature_columns),
+        'model_params': model_params,
+        'data_fingerprint': data_fingerprint,
+        **(extra_meta or {})
+    }
+    with open(os.path.join(staging_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2, default=str)
+    if metrics is not None:
+        with open(os.path.join(staging_dir, METRICS_FILE), 'w') as f:
+            json.dump(_metrics_document(version, data_fingerprint, metrics), f, default=str)
+    os.rename(staging_dir, os.path.join(registry_dir, version))
+
+    if legacy_path:
+        temp_path = f'{legacy_path}.tmp-{os.getpid()}'
+        joblib.dump(artifact, temp_path)
+        os.replace(temp_path, legacy_path)
+
+    _write_atomic(os.path.join(registry_dir, CURRENT_POINTER), version)
+    notify_published(version)
+    return version
+
+
+def current_version(registry_dir=DEFAULT_REGISTRY_DIR):
+    try:
+        with open(os.path.join(registry_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_current_version(version, registry_dir=DEFAULT_REGISTRY_DIR):
+    """Point workers at an existing version (e.g. to roll back)"""
+    if not os.path.isdir(os.path.join(registry_dir, version)):
+        raise ValueError(f"Unknown model version: {version}")
+    _write_atomic(os.path.join(registry_dir, CURRENT_POINTER), version)
+    notify_published(version)
+
+
+def load_meta(version, registry_dir=DEFAULT_REGISTRY_DIR):
+    with open(os.path.join(registry_dir, version, 'meta.json')) as f:
+        return json.load(f)
+
+
+def list_versions(registry_dir=DEFAULT_REGISTRY_DIR):
+    """Metadata of all published versions, newest first"""
+    if not os.path.isdir(registry_dir):
+        return []
+    versions = [
+        name for name in os.listdir(registry_dir)
+        if not name.startswith('.') and os.path.isdir(os.path.join(registry_dir, name))
+    ]
+    return [load_meta(version, registry_dir) for version in sorted(versions, reverse=True)]
+
+
+def prune(keep=5, registry_dir=DEFAULT_REGISTRY_DIR):
+    """Delete all but the newest ``keep`` versions (never the current one)"""
+    current = current_version(registry_dir)
+    removed = []
+    for meta in list_versions(registry_dir)[keep:]:
+        if meta['version'] != current:
+            shutil.rmtree(os.path.join(registry_dir, meta['version']), ignore_errors=True)
+            removed.append(meta['version'])
+    return removed
+
+
+def _metrics_document(version, data_fingerprint, metrics):
+    return {
+        'version': version,
+        'data_fingerprint': data_fingerprint,
+        'computed_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'metrics': metrics
+    }
+
+
+def save_metrics(version, metrics, data_fingerprint=None, registry_dir=DEFAULT_REGISTRY_DIR):
+    """Atomically replace the stored evaluation of an existing version"""
+    version_dir = os.path.join(registry_dir, version)
+    if not os.path.isdir(version_dir):
+        raise ValueError(f"Unknown model version: {version}")
+    _write_atomic(os.path.join(version_dir, METRICS_FILE),
+                  json.dumps(_metrics_document(version, data_fingerprint, metrics), default=str))
+
+
+def read_metrics(version, registry_dir=DEFAULT_REGISTRY_DIR):
+    """Stored evaluation document of ``version``, or None if it has none"""
+    try:
+        with open(os.path.join(registry_dir, version, METRICS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_version(version, registry_dir=DEFAULT_REGISTRY_DIR, mmap_mode='r'):
+    """Load a version's artifact dict, memory-mapping its numpy arrays"""
+    import joblib
+
+    with stage_timer('model_load'):
+        return joblib.load(os.path.join(registry_dir, version, 'model.joblib'), mmap_mode=mmap_mode)
+
+
+class ModelHandle:
+    """Per-process view of the current model that hot-swaps on version change.
+
+    ``get()`` costs one stat() of the pointer file when nothing changed;
+    the swap replaces a single tuple, so concurrent request threads see
+    either the old or the new model, never a mix.
+    """
+
+    def __init__(self, registry_dir=DEFAULT_REGISTRY_DIR, mmap_mode='r'):
+        self.registry_dir = registry_dir
+        self.mmap_mode = mmap_mode
+        self._loaded = (None, None, None)
+        self._compiled = (None, None)
+        self._pointer_stamp = None
+        self._lock = threading.Lock()
+
+    def _pointer_changed(self):
+        try:
+            stat = os.stat(os.path.join(self.registry_dir, CURRENT_POINTER))
+        except FileNotFoundError:
+            return False, None
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        return stamp != self._pointer_stamp, stamp
+
+    def get(self):
+        """(version, model, feature_columns) of the current version"""
+        changed, stamp = self._pointer_changed()
+        if changed:
+            with self._lock:
+                changed, stamp = self._pointer_changed()
+                if changed:
+                    version = current_version(self.registry_dir)
+                    if version and version != self._loaded[0]:
+                        artifact = load_version(version, self.registry_dir, self.mmap_mode)
+                        self._loaded = (version, artifact['model'], artifact['feature_columns'])
+                    self._pointer_stamp = stamp
+        return self._loaded
+
+    def get_compiled(self):
+        """(version, CompiledForest) of the current version.
+
+        The compiled node arrays are memory-mapped .npy files, so unlike
+        the pickled sklearn forest they stay shared in the page cache
+        across workers. Returns (version, None) for versions published
+        without compiled arrays.
+        """
+        from ml.compiled_forest import CompiledForest
+
+        version = current_version(self.registry_dir)
+        if version != self._compiled[0]:
+            with self._lock:
+                if version != self._compiled[0]:
+                    directory = os.path.join(self.registry_dir, version) if version else None
+                    compiled = None
+                    if directory and CompiledForest.exists(directory):
+                        compiled = CompiledForest.load(
+                            directory, load_meta(version, self.registry_dir)['feature_columns'], self.mmap_mode
+                        )
+                    self._compiled = (version, compiled)
+        return self._compiled
+
+    @property
+    def version(self):
+        return self.get()[0]
+
+
+_handles = {}
+
+
+def get_model_handle(registry_dir=DEFAULT_REGISTRY_DIR):
+    """Process-wide ModelHandle for a registry directory"""
+    handle = _handles.get(registry_dir)
+    if handle is None:
+        handle = _handles.setdefault(registry_dir, ModelHandle(registry_dir))
+    return handle
+
+
+def process_memory():
+    """{'rss': bytes, 'pss': bytes or None} of this process (Linux /proc)"""
+    usage = {'rss': None, 'pss': None}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['rss'] = int(line.split()[1]) * 1024
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    usage['pss'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if usage['rss'] is None:
+        import resource
+        usage['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return usage
+
+
+def _measure(registry_dir, mmap_mode):
+    """Memory delta of loading the current version in this process"""
+    import sklearn.ensemble  # noqa: F401 - keep library import cost out of the delta
+
+    version = current_version(registry_dir)
+    before = process_memory()
+    started = time.perf_counter()
+    artifact = load_version(version, registry_dir, mmap_mode)
+    elapsed = time.perf_counter() - started
+    after = process_memory()
+    return version, elapsed, before, after, artifact
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the model registry')
+    parser.add_argument('--registry-dir', default=DEFAULT_REGISTRY_DIR)
+    parser.add_argument('--measure', action='store_true', help='Report memory used by loading the current model')
+    parser.add_argument('--no-mmap', action='store_true', help='Measure a private (non-mmap) load instead')
+    parser.add_argument('--prune', type=int, metavar='KEEP', help='Delete all but the newest KEEP versions')
+    args = parser.parse_args()
+
+    if args.prune is not None:
+        for version in prune(args.prune, args.registry_dir):
+            print(f"🗑️  Removed {version}")
+
+    if args.measure:
+        if current_version(args.registry_dir) is None:
+            print("❌ No current model version in the registry")
+            return 1
+        version, elapsed, before, after, _ = _measure(args.registry_dir, None if args.no_mmap else 'r')
+        mb = 1024 * 1024
+        print(f"📦 Loaded {version} in {elapsed * 1000:.0f} ms ({'private copy' if args.no_mmap else 'mmap'})")
+        print(f"   RSS: {before['rss'] / mb:.1f} MB → {after['rss'] / mb:.1f} MB")
+        if before['pss'] is not None:
+            print(f"   PSS: {before['pss'] / mb:.1f} MB → {after['pss'] / mb:.1f} MB")
+        return 0
+
+    current = current_version(args.registry_dir)
+    for meta in list_versions(args.registry_dir):
+        marker = '*' if meta['version'] == current else ' '
+        print(f"{marker} {meta['version']}  {meta['created_at']}  data={meta.get('data_fingerprint')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Cross-worker retrain coordination through the shared database
+
+Retrain requests become rows in the retrain_jobs table instead of flags in
+each gunicorn worker's globals. Unique "slot" columns allow at most one
+pending and one running job across all workers: a request while a job is
+pending is folded into it (and pushes its debounce window), and a job is
+only started by the worker that wins the running slot. The winner holds a
+lease that it renews while training; if it dies, the lease expires and
+any worker can pick up the next job.
+
+Workers learn about new models from ``status()``, a snapshot of the job
+table cached for about a second. It replaces the per-request retrain
+polling and carries the current model version, which ModelHandle then
+loads on its next ``get()``. Only portable SQL is used (unique constraints
+and plain UPDATE ... WHERE), so it behaves the same on SQLite and PostgreSQL.
+
+Usage:
+    coordinator = RetrainCoordinator(db.engine, model_path=app.config['MODEL_PATH'])
+    coordinator.request()            # after adding or uploading records
+    coordinator.status()             # cheap, e.g. in a before_request hook
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from metrics import set_retrain_queue_depth
+from models import RetrainJob
+
+DEFAULT_MODEL_PATH = 'models/random_forest.joblib'
+DEBOUNCE_SECONDS = 3
+LEASE_SECONDS = 120
+STATUS_TTL_SECONDS = 1.0
+FINISHED_STATUSES = ('succeeded', 'failed', 'skipped')
+
+jobs = RetrainJob.__table__
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+
+class RetrainCoordinator:
+    """Database-backed retrain queue shared by all web workers"""
+
+    def __init__(self, engine, model_path=DEFAULT_MODEL_PATH, database_uri=None,
+                 debounce_seconds=DEBOUNCE_SECONDS, lease_seconds=LEASE_SECONDS,
+                 status_ttl=STATUS_TTL_SECONDS, on_done=None):
+        self.engine = engine
+        self.model_path = model_path
+        self.database_uri = database_uri or engine.url.render_as_string(hide_password=False)
+        self.debounce = timedelta(seconds=debounce_seconds)
+        self.lease = timedelta(seconds=lease_seconds)
+        self.status_ttl = status_ttl
+        self.on_done = on_done
+        self.owner = worker_id()
+        self._status = None
+        self._status_checked = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, incremental=False):
+        """Ask for a retrain; returns 'queued' or 'coalesced'.
+
+        A full retrain request turns a pending incremental job into a
+        full one. The job starts once the debounce window has passed.
+        """
+        for _ in range(3):
+            run_after = datetime.utcnow() + self.debounce
+            values = {'requests': jobs.c.requests + 1, 'run_after': run_after}
+            if not incremental:
+                values['incremental'] = False
+            with self.engine.begin() as connection:
+                coalesced = connection.execute(
+                    update(jobs).where(jobs.c.pending_slot == 1).values(**values)
+                ).rowcount
+            if coalesced:
+                outcome = 'coalesced'
+                break
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(jobs).values(
+                        status='pending', incremental=incremental, requests=1,
+                        requested_by=self.owner, requested_at=datetime.utcnow(),
+                        run_after=run_after, pending_slot=1
+                    ))
+                outcome = 'queued'
+                break
+            except IntegrityError:
+                # Another worker queued a job in between; fold into it
+                continue
+        else:
+            raise RuntimeError("Could not queue a retrain job")
+
+        self._invalidate()
+        timer = threading.Timer(self.debounce.total_seconds() + 0.1, self.try_claim)
+        timer.daemon = True
+        timer.start()
+        return outcome
+
+    def try_claim(self):
+        """Start the due pending job in this worker if no trainer holds the lease.
+
+        Returns the claimed job id, or None.
+        """
+        now = datetime.utcnow()
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(jobs)
+                .where(jobs.c.status == 'running', jobs.c.lease_expires_at < now)
+                .values(status='failed', running_slot=None, finished_at=now,
+                        message='Trainer stopped renewing its lease')
+            )
+        try:
+            with self.engine.begin() as connection:
+                job = connection.execute(
+                    select(jobs.c.id, jobs.c.incremental)
+                    .where(jobs.c.pending_slot == 1, jobs.c.run_after <= now)
+                ).first()
+                if job is None:
+                    return None
+                claimed = connection.execute(
+                    update(jobs)
+                    .where(jobs.c.id == job.id, jobs.c.status == 'pending')
+                    .values(status='running', pending_slot=None, running_slot=1,
+                            lease_owner=self.owner, lease_expires_at=now + self.lease, started_at=now)
+                ).rowcount
+        except IntegrityError:
+            # The running slot is taken: another worker is training
+            return None
+        if not claimed:
+            return None
+
+        self._invalidate()
+        self._start(job.id, bool(job.incremental))
+        return job.id
+
+    def _start(self, job_id, incremental):
+        from ml.retrain_worker import submit_retrain
+
+        stop = threading.Event()
+        try:
+            submit_retrain(self.database_uri, self.model_path, incremental=incremental,
+                           on_done=lambda result: self._finish(job_id, stop, result))
+        except Exception as e:
+            self._finish(job_id, stop, {'status': 'error', 'message': f"Could not start the retrain: {e}"})
+            return
+        # Renew only once the job is queued; a job that already finished set ``stop``
+        threading.Thread(target=self._renew_lease, args=(job_id, stop), daemon=True).start()
+
+    def _renew_lease(self, job_id, stop):
+        while not stop.wait(self.lease.total_seconds() / 3):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        update(jobs)
+                        .where(jobs.c.id == job_id, jobs.c.lease_owner == self.owner, jobs.c.status == 'running')
+                        .values(lease_expires_at=datetime.utcnow() + self.lease)
+                    )
+            except OperationalError:
+                # A busy database must not end the renewals; retry next period
+                continue
+
+    def _finish(self, job_id, stop, result):
+        from ml.model_registry import current_version
+
+        stop.set()
+        status = {'success': 'succeeded', 'warning': 'skipped'}.get(result.get('status'), 'failed')
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(jobs)
+                .where(jobs.c.id == job_id, jobs.c.lease_owner == self.owner, jobs.c.status == 'running')
+                .values(status=status, running_slot=None, finished_at=datetime.utcnow(),
+                        duration=result.get('duration'), message=result.get('message'),
+                        model_version=current_version() if status == 'succeeded' else None)
+            )
+        self._invalidate()
+        if self.on_done is not None:
+            self.on_done(result)
+        # Requests that arrived during training are waiting as the next job
+        self.try_claim()
+
+    def _invalidate(self):
+        self._status_checked = 0.0
+
+    def status(self):
+        """Snapshot of the retrain queue, refreshed at most every ``status_ttl`` seconds.
+
+        Also starts a due job nobody picked up, e.g. because the worker
+        that queued it was restarted or the previous trainer died.
+        """
+        if time.monotonic() - self._status_checked < self.status_ttl:
+            return self._status
+
+        with self._lock:
+            if time.monotonic() - self._status_checked < self.status_ttl:
+                return self._status
+            with self.engine.connect() as connection:
+                active = {
+                    row['status']: row for row in connection.execute(
+                        select(jobs).where(jobs.c.status.in_(('pending', 'running')))
+                    ).mappings()
+                }
+                last = connection.execute(
+                    select(jobs).where(jobs.c.status.in_(FINISHED_STATUSES))
+                    .order_by(jobs.c.id.desc()).limit(1)
+                ).mappings().first()
+                model_version = connection.execute(
+                    select(jobs.c.model_version).where(jobs.c.status == 'succeeded')
+                    .order_by(jobs.c.id.desc()).limit(1)
+                ).scalar()
+
+            pending, running = active.get('pending'), active.get('running')
+            self._status = {
+                'in_progress': running is not None,
+                'pending': pending is not None,
+                'pending_requests': pending['requests'] if pending else 0,
+                'last_job_id': last['id'] if last else None,
+                'last_status': last['status'] if last else None,
+                'last_message': last['message'] if last else None,
+                'last_finished_at': _format_time(last['finished_at']) if last else None,
+                'model_version': model_version,
+            }
+            self._status_checked = time.monotonic()
+            set_retrain_queue_depth(len(active))
+
+        now = datetime.utcnow()
+        if (pending is not None and pending['run_after'] <= now and running is None) \
+                or (running is not None and running['lease_expires_at'] < now):
+            self.try_claim()
+        return self._status
+
+    def model_version(self):
+        """Version of the newest successfully trained model, from the cached status"""
+        return self.status()['model_version']
+
+    def finished_since(self, last_seen_job_id):
+        """The last finished job as a dict if it is newer than ``last_seen_job_id``.
+
+        Lets each session flash a retrain result once without polling.
+        """
+        status = self.status()
+        if status['last_job_id'] is None or status['last_job_id'] <= (last_seen_job_id or 0):
+            return None
+        return status
+
+
+_coordinators = {}
+
+
+def get_coordinator(app):
+    """Process-wide coordinator for a Flask app (created inside its app context)"""
+    coordinator = _coordinators.get(id(app))
+    if coordinator is None:
+        from models import db
+
+        with app.app_context():
+            coordinator = RetrainCoordinator(
+                db.engine, model_path=app.config.get('MODEL_PATH', DEFAULT_MODEL_PATH)
+            )
+        coordinator = _coordinators.setdefault(id(app), coordinator)
+    return coordinator
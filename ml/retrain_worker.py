@@ -0,0 +1,472 @@
+"""
+Out-of-process, incremental model retraining
+
+Retraining runs in a dedicated single-process pool (spawned, so it shares
+neither the GIL nor DB connections with the web worker) and keeps the
+feature matrix in the on-disk cache of ``ml.feature_cache`` between runs.
+Only pairs touching donors or recipients added or edited since the last
+sync are recomputed. In incremental mode the
+existing forest is grown with ``warm_start`` trees fitted on the new pairs
+instead of refitting every tree. The same process re-evaluates published
+models on a fresh holdout on request (``submit_evaluation``).
+
+Measure request latency before/during a retrain against a running server:
+    python -m ml.retrain_worker --database-uri sqlite:////abs/path/organmatch.db \\
+        --probe-url http://localhost:5000/login [--incremental]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import count_items, observe_retrain, stage_timer
+from ml.evaluation import MIN_HOLDOUT_ROWS, compute_metrics, holdout_split
+from ml.feature_cache import DEFAULT_CACHE_DIR, get_feature_cache
+from ml.model_registry import (DEFAULT_REGISTRY_DIR, current_version, dataframe_fingerprint, load_meta,
+                               load_version, notify_published, publish, save_metrics)
+from startup import lazy_import
+
+joblib = lazy_import('joblib')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_MODEL_PATH = 'models/random_forest.joblib'
+DEFAULT_CACHE_PATH = DEFAULT_CACHE_DIR
+DEFAULT_CONFIG_PATH = os.environ.get('MODEL_CONFIG_PATH', 'models/model_config.json')
+DEFAULT_MODEL_CONFIG = {
+    'n_estimators': 100,
+    'max_depth': 10,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2
+}
+
+# Extra trees added per incremental run, and the forest size (as a multiple
+# of the configured n_estimators) after which a full refit is forced
+INCREMENTAL_TREES = 20
+MAX_GROWTH_FACTOR = 3
+
+
+def _default_n_jobs():
+    """Leave at least half the cores to the web workers"""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def load_model_config(config_path=DEFAULT_CONFIG_PATH):
+    """Forest settings from model_config.json, falling back to the defaults"""
+    config = dict(DEFAULT_MODEL_CONFIG)
+    try:
+        with open(config_path) as f:
+            config.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return config
+
+
+def default_feature_fn():
+    """``ml.feature_engineering.create_features``, with a clear error when it is not installed"""
+    try:
+        from ml.feature_engineering import create_features
+    except ModuleNotFoundError as e:
+        if e.name not in ('ml.feature_engineering', 'ml'):
+            raise
+        raise RuntimeError("ml.feature_engineering is not installed; training needs its "
+                           "create_features to build the feature matrix") from e
+    return create_features
+
+
+def load_frames(database_uri):
+    """Read donors and recipients into DataFrames with a private engine"""
+    from sqlalchemy import create_engine
+
+    engine = create_engine(database_uri)
+    try:
+        with engine.connect() as connection:
+            donors_df = pd.read_sql_query('SELECT * FROM donors', connection)
+            recipients_df = pd.read_sql_query('SELECT * FROM recipients', connection)
+    finally:
+        engine.dispose()
+    return donors_df.drop(columns=['hla_bits'], errors='ignore'), \
+        recipients_df.drop(columns=['hla_bits'], errors='ignore')
+
+
+def load_database_fingerprint(database_uri):
+    """``ml.model_registry.database_fingerprint`` read with a private engine"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from ml.model_registry import database_fingerprint
+
+    engine = create_engine(database_uri)
+    try:
+        with Session(engine) as session:
+            return database_fingerprint(session)
+    finally:
+        engine.dispose()
+
+
+def build_features(donors_df, recipients_df, cache_path=DEFAULT_CACHE_PATH, feature_fn=None):
+    """Sync the on-disk feature cache with the frames (see ``ml.feature_cache``).
+
+    Returns (FeatureMatrix, stats); only pairs touching donors or
+    recipients added or edited since the last sync are computed.
+    """
+    return get_feature_cache(cache_path).sync(donors_df, recipients_df, feature_fn or default_feature_fn())
+
+
+def _fill_missing(X):
+    return X.fillna(X.median(numeric_only=True)).fillna(0)
+
+
+def fit_model(X, y, new_rows, model_path=DEFAULT_MODEL_PATH, incremental=False, n_jobs=None,
+              data_fingerprint=None, database_fingerprint=None, config_path=DEFAULT_CONFIG_PATH):
+    """Fit (or grow) the forest and publish it as a new registry version.
+
+    A stratified 20% of the rows being fitted (of the new rows, when
+    growing) is held out, and the metrics on it are published with the
+    model. ``database_fingerprint`` is stored in the version's meta so a
+    restarting worker can tell whether the data changed since (see
+    ``startup.startup_training_needed``). Returns the training mode actually
+    used: 'incremental', 'full', or 'unchanged' when an incremental run finds
+    no new pairs.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    if incremental and os.path.exists(model_path) and not new_rows.any():
+        return 'unchanged'
+
+    config = load_model_config(config_path)
+    n_jobs = n_jobs or _default_n_jobs()
+    X = _fill_missing(X)
+    y = np.asarray(y)
+
+    model = None
+    mode = 'full'
+    if incremental and os.path.exists(model_path):
+        artifact = joblib.load(model_path)
+        model = artifact['model']
+        train_rows, test_rows = holdout_split(np.flatnonzero(new_rows), y)
+        y_new = y[train_rows]
+        can_grow = (
+            list(artifact['feature_columns']) == list(X.columns)
+            and set(np.unique(y_new)) == set(model.classes_)
+            and model.n_estimators + INCREMENTAL_TREES <= config['n_estimators'] * MAX_GROWTH_FACTOR
+        )
+        if can_grow:
+            model.set_params(warm_start=True, n_jobs=n_jobs,
+                             n_estimators=model.n_estimators + INCREMENTAL_TREES)
+            model.fit(X.iloc[train_rows], y_new)
+            model.set_params(warm_start=False)
+            mode = 'incremental'
+        else:
+            model = None
+
+    if model is None:
+        train_rows, test_rows = holdout_split(np.arange(len(X)), y)
+        if len(np.unique(y[train_rows])) < 2:
+            train_rows, test_rows = np.arange(len(X)), np.arange(0)
+        model = RandomForestClassifier(
+            n_estimators=config['n_estimators'],
+            max_depth=config['max_depth'],
+            min_samples_split=config['min_samples_split'],
+            min_samples_leaf=config['min_samples_leaf'],
+            random_state=42,
+            n_jobs=n_jobs
+        )
+        model.fit(X.iloc[train_rows], y[train_rows])
+
+    metrics = None
+    if len(test_rows):
+        with stage_timer('metrics', items=len(test_rows)):
+            metrics = compute_metrics(model, X.columns, X.iloc[test_rows], y[test_rows],
+                                      holdout='new_pairs_split' if mode == 'incremental' else 'training_split')
+
+    publish(model, list(X.columns), config, data_fingerprint=data_fingerprint, legacy_path=model_path,
+            extra_meta={'training_mode': mode, 'samples': len(X), 'database_fingerprint': database_fingerprint},
+            metrics=metrics)
+    return mode
+
+
+def run_retrain(database_uri, model_path=DEFAULT_MODEL_PATH, cache_path=DEFAULT_CACHE_PATH,
+                incremental=False, n_jobs=None, feature_fn=None):
+    """Retrain job executed inside the worker process; returns a status dict.
+
+    ``feature_fn`` defaults to ``ml.feature_engineering.create_features``.
+    """
+    started = time.perf_counter()
+    try:
+        with stage_timer('data_load'):
+            # Read before the rows, so a concurrent edit makes it stale rather than missed
+            database_fp = load_database_fingerprint(database_uri)
+            donors_df, recipients_df = load_frames(database_uri)
+        with stage_timer('feature_build'):
+            matrix, stats = build_features(donors_df, recipients_df, cache_path, feature_fn)
+        count_items('feature_build', stats['computed_pairs'])
+        X, y, new_rows = matrix.training_data()
+
+        if len(X) < 2 or len(np.unique(y)) < 2:
+            return {
+                'status': 'warning',
+                'message': f"Not enough labelled pairs to train ({len(X)})",
+                'duration': time.perf_counter() - started
+            }
+
+        with stage_timer('fit', items=len(X)):
+            mode = fit_model(X, y, new_rows, model_path, incremental, n_jobs,
+                             data_fingerprint=dataframe_fingerprint(donors_df, recipients_df),
+                             database_fingerprint=database_fp)
+
+        return {
+            'status': 'success',
+            'message': f"Model retrained ({mode}) on {len(X)} pairs "
+                       f"({stats['computed_pairs']} new, {stats['reused_pairs']} cached)",
+            'mode': mode,
+            'samples': len(X),
+            'duration': time.perf_counter() - started,
+            **stats
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'message': f"Retraining failed: {e}",
+            'duration': time.perf_counter() - started
+        }
+
+
+def _unseen_rows(donor_ids, recipient_ids, donors_df, recipients_df, trained_at):
+    """Pairs touching a donor or recipient added or edited after ``trained_at``"""
+    fresh = []
+    for frame, ids in ((donors_df, donor_ids), (recipients_df, recipient_ids)):
+        if 'updated_at' in frame:
+            changed = frame.loc[pd.to_datetime(frame['updated_at']) > trained_at, 'id'].to_numpy()
+            fresh.append(np.isin(ids, changed))
+    return np.flatnonzero(np.logical_or.reduce(fresh)) if fresh else np.arange(0)
+
+
+def run_evaluation(database_uri, version=None, registry_dir=DEFAULT_REGISTRY_DIR,
+                   cache_path=DEFAULT_CACHE_PATH, seed=None, feature_fn=None):
+    """Re-evaluate a published version on a fresh holdout; returns a status dict.
+
+    Pairs involving donors or recipients added or edited since the version
+    was trained were never seen by it, so they are used when there are
+    enough of them with both labels; otherwise a new random 20% split is
+    drawn, which may overlap the rows the model was fitted on.
+    """
+    started = time.perf_counter()
+    try:
+        version = version or current_version(registry_dir)
+        if version is None:
+            return {'status': 'warning', 'message': "No published model to evaluate"}
+        meta = load_meta(version, registry_dir)
+        artifact = load_version(version, registry_dir)
+
+        with stage_timer('data_load'):
+            donors_df, recipients_df = load_frames(database_uri)
+        with stage_timer('feature_build'):
+            matrix, _ = build_features(donors_df, recipients_df, cache_path, feature_fn)
+        X, y, _ = matrix.training_data()
+        X = _fill_missing(X)
+
+        rows = _unseen_rows(*matrix.pairs(), donors_df, recipients_df, pd.to_datetime(meta['created_at']))
+        holdout = 'unseen_pairs'
+        if len(rows) < MIN_HOLDOUT_ROWS or len(np.unique(y[rows])) < 2:
+            seed = seed if seed is not None else int(time.time())
+            _, rows = holdout_split(np.arange(len(X)), y, seed=seed)
+            holdout = f'resampled_split(seed={seed})'
+        if len(rows) == 0:
+            return {'status': 'warning', 'message': f"Not enough labelled pairs to evaluate ({len(X)})",
+                    'duration': time.perf_counter() - started}
+
+        with stage_timer('metrics', items=len(rows)):
+            metrics = compute_metrics(artifact['model'], artifact['feature_columns'],
+                                      X.iloc[rows], y[rows], holdout=holdout)
+        save_metrics(version, metrics, dataframe_fingerprint(donors_df, recipients_df), registry_dir)
+        return {
+            'status': 'success',
+            'message': f"Model {version} re-evaluated on {len(rows)} pairs ({holdout})",
+            'version': version,
+            'duration': time.perf_counter() - started
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'message': f"Evaluation failed: {e}",
+            'duration': time.perf_counter() - started
+        }
+
+
+# One retrain process per web worker, created on first use
+_executor = None
+_state_lock = threading.RLock()
+_running = None
+_pending = None
+_evaluating = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def submit_retrain(database_uri, model_path=DEFAULT_MODEL_PATH, cache_path=DEFAULT_CACHE_PATH,
+                   incremental=False, on_done=None):
+    """Queue a retrain in the worker process.
+
+    Requests arriving while one is running are coalesced into a single
+    follow-up run, which is incremental only if every coalesced request
+    asked for that. ``on_done(result)`` is called from a pool callback
+    thread with the status dict, once for every request, coalesced ones
+    included. Pass an absolute database URI (e.g.
+    ``db.engine.url.render_as_string(hide_password=False)``) since the
+    worker has no Flask app to resolve relative SQLite paths.
+    """
+    global _pending
+    job = (database_uri, model_path, cache_path, incremental)
+    callbacks = [on_done] if on_done is not None else []
+    with _state_lock:
+        if _running is not None:
+            if _pending is not None:
+                queued_job, queued_callbacks = _pending
+                job = job[:3] + (incremental and queued_job[3],)
+                callbacks = queued_callbacks + callbacks
+            _pending = (job, callbacks)
+            return 'pending'
+        _start(job, callbacks)
+        return 'started'
+
+
+def _start(job, callbacks):
+    global _running
+    _running = _get_executor().submit(run_retrain, *job)
+    _running.add_done_callback(lambda future: _finished(future, callbacks))
+
+
+def _finished(future, callbacks):
+    global _executor, _running, _pending
+    try:
+        result = future.result()
+    except Exception as e:
+        # A crashed worker breaks the pool; start a fresh one next time
+        _executor = None
+        result = {'status': 'error', 'message': f"Retrain worker crashed: {e}"}
+    try:
+        if result.get('status') == 'success':
+            # The worker process published it; listeners live in this one
+            notify_published(current_version())
+        # A failing callback must not leave this worker marked as retraining
+        for notify in (observe_retrain, *callbacks):
+            try:
+                notify(result)
+            except Exception as e:
+                print(f"❌ Retrain callback failed: {e}")
+    finally:
+        with _state_lock:
+            _running = None
+            follow_up, _pending = _pending, None
+            if follow_up is not None:
+                _start(*follow_up)
+
+
+def is_retraining():
+    return _running is not None
+
+
+def submit_evaluation(database_uri, version=None, registry_dir=DEFAULT_REGISTRY_DIR,
+                      cache_path=DEFAULT_CACHE_PATH, on_done=None):
+    """Queue ``run_evaluation`` in the worker process.
+
+    Runs after any retrain already queued there. Returns 'started', or
+    'running' if an evaluation from this web worker has not finished yet.
+    """
+    global _evaluating
+    with _state_lock:
+        if _evaluating is not None:
+            return 'running'
+        _evaluating = _get_executor().submit(run_evaluation, database_uri, version, registry_dir, cache_path)
+        _evaluating.add_done_callback(lambda future: _evaluation_finished(future, on_done))
+        return 'started'
+
+
+def _evaluation_finished(future, on_done):
+    global _executor, _evaluating
+    try:
+        result = future.result()
+    except Exception as e:
+        _executor = None
+        result = {'status': 'error', 'message': f"Evaluation worker crashed: {e}"}
+    with _state_lock:
+        _evaluating = None
+    if on_done is not None:
+        on_done(result)
+
+
+def is_evaluating():
+    return _evaluating is not None
+
+
+def _probe_latency(url, duration, results):
+    import urllib.request
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            urllib.request.urlopen(url, timeout=30).read()
+        except Exception:
+            continue
+        results.append((time.perf_counter() - started) * 1000)
+
+
+def _summarize(label, latencies):
+    if not latencies:
+        print(f"  {label}: no successful requests")
+        return
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"  {label}: {len(latencies)} requests, p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an out-of-process retrain, optionally probing request latency')
+    parser.add_argument('--database-uri', required=True)
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--probe-url', help='URL to request repeatedly before and during the retrain')
+    parser.add_argument('--probe-seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    baseline = []
+    if args.probe_url:
+        print(f"📏 Probing {args.probe_url} for {args.probe_seconds:.0f}s before retraining...")
+        _probe_latency(args.probe_url, args.probe_seconds, baseline)
+
+    done = threading.Event()
+    outcome = {}
+
+    def on_done(result):
+        outcome.update(result)
+        done.set()
+
+    submit_retrain(args.database_uri, args.model_path, args.cache_path, args.incremental, on_done)
+
+    during = []
+    if args.probe_url:
+        while not done.is_set():
+            _probe_latency(args.probe_url, 1.0, during)
+    done.wait()
+
+    print(f"🤖 {outcome.get('message')} in {outcome.get('duration', 0):.1f}s")
+    if args.probe_url:
+        print("📊 Request latency:")
+        _summarize('before retrain', baseline)
+        _summarize('during retrain', during)
+    return 0 if outcome.get('status') == 'success' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
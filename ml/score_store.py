@@ -0,0 +1,300 @@
+"""
+Persistent pair-score store behind the matches pages
+
+Scores are kept in the pair_scores table keyed by (donor_id, recipient_id,
+model_version). After a retrain the new version is scored once in the
+background; afterwards only pairs touching donors or recipients whose
+updated_at moved past the last run's watermark are rescored. Pages then
+read an indexed ORDER BY compatibility_score LIMIT/OFFSET query. A full
+scoring pass reuses the feature matrix the retrain just synced to the
+on-disk feature cache instead of rebuilding every pair's features.
+
+Only one pass runs at a time across all workers: it holds the
+``pair_scores`` row of the leases table, renewed while it runs. A pass
+writes in one transaction so pages never see it half done; on SQLite that
+transaction locks out the renewals, so there the lease is taken for
+SQLITE_LEASE_SECONDS, long enough to cover a whole pass.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import joinedload
+
+from metrics import stage_timer
+from models import db, Donor, Recipient, Lease, PairScore, PairScoreRun
+from ml.candidates import db_candidate_blocks, new_pruning_stats
+from startup import lazy_import
+
+pd = lazy_import('pandas')
+
+DEFAULT_MODEL_PATH = 'models/random_forest.joblib'
+RESCORE_LEASE = 'pair_scores'
+LEASE_SECONDS = 120
+SQLITE_LEASE_SECONDS = int(os.environ.get('RESCORE_SQLITE_LEASE_SECONDS', 3600))
+LEASE_POLL_SECONDS = 1.0
+
+leases = Lease.__table__
+
+
+def model_version_for(model_path=DEFAULT_MODEL_PATH):
+    """Version tag for the active model.
+
+    The registry version when one is published, otherwise a stamp of the
+    artifact file that changes whenever it is rewritten.
+    """
+    from ml.model_registry import current_version
+
+    version = current_version()
+    if version:
+        return version
+    stat = os.stat(model_path)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def take_lease(engine, name, owner, lease_seconds=LEASE_SECONDS):
+    """Take or renew the lease ``name`` for ``owner``; False while someone else holds it"""
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        taken = connection.execute(
+            update(leases)
+            .where(leases.c.name == name,
+                   or_(leases.c.owner.is_(None), leases.c.owner == owner, leases.c.expires_at < now))
+            .values(owner=owner, expires_at=now + timedelta(seconds=lease_seconds))
+        ).rowcount
+    if taken:
+        return True
+    try:
+        with engine.begin() as connection:
+            connection.execute(insert(leases).values(
+                name=name, owner=owner, expires_at=now + timedelta(seconds=lease_seconds)
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+
+def release_lease(engine, name, owner):
+    with engine.begin() as connection:
+        connection.execute(
+            update(leases).where(leases.c.name == name, leases.c.owner == owner)
+            .values(owner=None, expires_at=None)
+        )
+
+
+@contextmanager
+def hold_lease(engine, name, lease_seconds=LEASE_SECONDS, poll_seconds=LEASE_POLL_SECONDS):
+    """Wait for the lease ``name``, then hold it (renewing it) for the block"""
+    from ml.retrain_coordinator import worker_id
+
+    owner = f'{worker_id()}:{threading.get_ident()}'
+    while True:
+        try:
+            if take_lease(engine, name, owner, lease_seconds):
+                break
+        except OperationalError:
+            # Another worker's pass has SQLite locked; keep waiting
+            pass
+        time.sleep(poll_seconds)
+
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(lease_seconds / 3):
+            try:
+                take_lease(engine, name, owner, lease_seconds)
+            except OperationalError:
+                # SQLite is locked by the pass's own write transaction; retry next round
+                continue
+
+    threading.Thread(target=renew, name=f'lease-{name}', daemon=True).start()
+    try:
+        yield
+    finally:
+        stop.set()
+        release_lease(engine, name, owner)
+
+
+def _score_blocks(blocks, model_version, model_path, predict_fn, batch_size):
+    """Score candidate blocks and bulk-insert the results, returns rows written"""
+    written = 0
+    buffer = []
+    scored_at = datetime.utcnow()
+
+    def flush():
+        nonlocal written
+        if buffer:
+            db.session.execute(insert(PairScore), buffer)
+            written += len(buffer)
+            buffer.clear()
+
+    for donors_block, recipients_block in blocks:
+        with stage_timer('predict', items=len(donors_block) * len(recipients_block)):
+            results = predict_fn(donors_block, recipients_block, model_path=model_path)
+        for result in results:
+            buffer.append({
+                'donor_id': int(result['donor_id']),
+                'recipient_id': int(result['recipient_id']),
+                'model_version': model_version,
+                'compatibility_score': float(result['compatibility_percentage']),
+                'scored_at': scored_at
+            })
+            if len(buffer) >= batch_size:
+                flush()
+    flush()
+    return written
+
+
+def _versions(model):
+    return pd.DataFrame(db.session.execute(select(model.id, model.updated_at)).all(), columns=['id', 'updated_at'])
+
+
+def _score_cached(model_version, batch_size):
+    """Score every candidate pair from the on-disk feature cache.
+
+    Only used when the cache was synced from exactly the current donors and
+    recipients (as after a retrain) and ``model_version`` is the current
+    registry model. Returns the rows written, or None to fall back to
+    computing the features.
+    """
+    from ml.feature_cache import get_feature_cache
+    from ml.model_registry import get_model_handle
+
+    matrix = get_feature_cache().current()
+    version, model, feature_columns = get_model_handle().get()
+    if matrix is None or model is None or version != model_version:
+        return None
+    if not set(feature_columns) <= set(matrix.columns) or not matrix.matches(_versions(Donor), _versions(Recipient)):
+        return None
+
+    classes = list(model.classes_)
+    positive = classes.index(1) if 1 in classes else -1
+    scored_at = datetime.utcnow()
+    rows = matrix.live_rows()
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        with stage_timer('predict', items=len(chunk)):
+            scores = model.predict_proba(matrix.frame(chunk)[list(feature_columns)])[:, positive] * 100
+        donor_ids, recipient_ids = matrix.pairs(chunk)
+        db.session.execute(insert(PairScore), [
+            {
+                'donor_id': int(donor_id),
+                'recipient_id': int(recipient_id),
+                'model_version': model_version,
+                'compatibility_score': round(float(score), 2),
+                'scored_at': scored_at
+            }
+            for donor_id, recipient_id, score in zip(donor_ids, recipient_ids, scores)
+        ])
+    return len(rows)
+
+
+def rescore_pairs(model_version=None, model_path=DEFAULT_MODEL_PATH, full=False,
+                  predict_fn=None, batch_size=5000):
+    """Bring the stored scores for ``model_version`` up to date.
+
+    The first run for a version (or ``full=True``) scores every candidate
+    pair; later runs only rescore pairs whose donor or recipient changed
+    since the previous run and drop scores of deleted records. A full run
+    with the default predictor reads the features from the on-disk feature
+    cache when it is current. Returns a stats dict with the pruning
+    counters and rows written.
+    """
+    use_feature_cache = predict_fn is None
+    if predict_fn is None:
+        from ml.predict_model import predict_compatibility
+        predict_fn = predict_compatibility
+    if model_version is None:
+        model_version = model_version_for(model_path)
+
+    lease_seconds = SQLITE_LEASE_SECONDS if db.engine.dialect.name == 'sqlite' else LEASE_SECONDS
+    with hold_lease(db.engine, RESCORE_LEASE, lease_seconds):
+        try:
+            return _rescore(model_version, model_path, full, predict_fn, use_feature_cache, batch_size)
+        except Exception:
+            # Roll back before the lease is released so the next pass starts clean
+            db.session.rollback()
+            raise
+
+
+def _rescore(model_version, model_path, full, predict_fn, use_feature_cache, batch_size):
+    started = datetime.utcnow()
+    stats = new_pruning_stats()
+    run = db.session.get(PairScoreRun, model_version)
+    version_scores = PairScore.model_version == model_version
+
+    cached = None
+    if full or run is None:
+        db.session.execute(delete(PairScore).where(version_scores))
+        cached = _score_cached(model_version, batch_size) if use_feature_cache else None
+        blocks = db_candidate_blocks(Donor, Recipient, stats) if cached is None else []
+    else:
+        since = run.scored_through
+        stale_donor_ids = select(Donor.id).where(Donor.updated_at > since)
+        stale_recipient_ids = select(Recipient.id).where(Recipient.updated_at > since)
+        db.session.execute(delete(PairScore).where(version_scores, or_(
+            PairScore.donor_id.in_(stale_donor_ids),
+            PairScore.recipient_id.in_(stale_recipient_ids),
+            PairScore.donor_id.not_in(select(Donor.id)),
+            PairScore.recipient_id.not_in(select(Recipient.id))
+        )))
+
+        # Only the organ/ABO groups the changed rows can pair with are loaded
+        blocks = chain(
+            db_candidate_blocks(Donor, Recipient, stats, donor_filter=Donor.updated_at > since),
+            db_candidate_blocks(
+                Donor, Recipient, stats,
+                donor_filter=or_(Donor.updated_at <= since, Donor.updated_at.is_(None)),
+                recipient_filter=Recipient.updated_at > since
+            )
+        )
+
+    stats['pairs_scored'] = _score_blocks(blocks, model_version, model_path, predict_fn, batch_size)
+    if cached is not None:
+        stats['pairs_scored'] = stats['cached_pairs'] = cached
+
+    db.session.merge(PairScoreRun(
+        model_version=model_version,
+        scored_through=started,
+        pairs_scored=stats['pairs_scored'],
+        completed_at=datetime.utcnow()
+    ))
+    db.session.commit()
+
+    return stats
+
+
+def schedule_rescore(app, model_version=None, model_path=DEFAULT_MODEL_PATH, full=False):
+    """Run ``rescore_pairs`` in a daemon thread, e.g. right after a retrain"""
+    def run():
+        with app.app_context():
+            try:
+                stats = rescore_pairs(model_version, model_path, full=full)
+                print(f"✅ Rescored {stats['pairs_scored']} pairs "
+                      f"({stats['organ_pruned'] + stats['blood_pruned']} pruned)")
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Pair rescoring failed: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def top_scores(model_version, page=1, per_page=20, recipient_id=None, min_score=None):
+    """One page of stored scores, best first, as a Flask-SQLAlchemy Pagination"""
+    query = PairScore.query.options(
+        joinedload(PairScore.donor), joinedload(PairScore.recipient)
+    ).filter(PairScore.model_version == model_version)
+    if recipient_id is not None:
+        query = query.filter(PairScore.recipient_id == recipient_id)
+    if min_score is not None:
+        query = query.filter(PairScore.compatibility_score >= min_score)
+    query = query.order_by(PairScore.compatibility_score.desc(), PairScore.id)
+    return query.paginate(page=page, per_page=per_page, error_out=False)
@@ -0,0 +1,639 @@
+"""
+Parallel cross-validated hyperparameter search
+
+Random forest settings are tuned by successive halving over randomly
+sampled configurations (the current model_config.json is always one of
+them): every candidate is cross-validated on a small stratified-by-chance
+sample of the pairs, the best third goes on to three times as many rows,
+and so on until the survivors are scored on the full matrix.
+
+The feature matrix comes from the shared on-disk feature cache
+(``ml.feature_cache``, synced the same way as a retrain); it is written
+once per run, with missing values filled, as .npy files that the pool
+workers memory-map, so each worker costs one process and one fit at a
+time (``n_jobs=1``), never a copy of the data. The pool has ``cores``
+processes (default: half the cores, like the retrain worker) running at a
+lower priority, and is terminated when the wall-clock budget runs out; the
+best configuration found so far is kept.
+
+Every result is appended to ``models/tuning/<run_id>/events.jsonl`` as it
+arrives and ``status.json`` holds the run summary, so any web worker can
+report progress. Promoting a run writes its best configuration to
+model_config.json and asks for a full retrain, which publishes the new
+model to the registry.
+
+Usage:
+    TUNING_DATABASE_URI=sqlite:////abs/path/organmatch.db python -m ml.tuning \\
+        --candidates 24 --time-budget 600 --cores 4 [--promote]
+
+    from ml.tuning import init_tuning
+    init_tuning(app)    # POST /api/tuning, GET /api/tuning/<run_id>[?format=ndjson],
+                        # POST /api/tuning/<run_id>/promote, POST /api/tuning/<run_id>/cancel
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from ml.retrain_worker import DEFAULT_CACHE_PATH, DEFAULT_CONFIG_PATH, DEFAULT_MODEL_PATH, _default_n_jobs
+from startup import lazy_import
+
+np = lazy_import('numpy')
+
+DEFAULT_TUNING_DIR = 'models/tuning'
+# How start_tuning hands the database URI to the search process, which
+# keeps credentials out of its command line
+DATABASE_URI_ENV = 'TUNING_DATABASE_URI'
+DEFAULT_CANDIDATES = 24
+DEFAULT_FOLDS = 3
+DEFAULT_TIME_BUDGET = 600
+HALVING_FACTOR = 3
+# The first rung never cross-validates on fewer rows than this
+MIN_RUNG_ROWS = 1000
+# Pool workers run at this niceness so the web workers keep priority
+WORKER_NICENESS = 10
+POLL_SECONDS = 0.5
+LOCK_FILE = 'tuning.lock'
+EVENTS_FILE = 'events.jsonl'
+STATUS_FILE = 'status.json'
+CANCEL_FILE = 'cancel'
+FINISHED_STATUSES = ('finished', 'cancelled', 'failed')
+
+PARAM_SPACE = {
+    'n_estimators': [50, 100, 200, 300, 500],
+    'max_depth': [None, 5, 8, 10, 15, 20, 30],
+    'min_samples_split': [2, 5, 10, 20],
+    'min_samples_leaf': [1, 2, 4, 8],
+}
+
+
+class TuningBusy(RuntimeError):
+    """A search is already running; ``run_id`` is the running one"""
+
+    def __init__(self, run_id):
+        super().__init__(f"Tuning run {run_id} is still running")
+        self.run_id = run_id
+
+
+def _utcnow():
+    return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _write_json(path, document):
+    temp_path = f'{path}.tmp-{os.getpid()}'
+    with open(temp_path, 'w') as f:
+        json.dump(document, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def _config_key(config):
+    return tuple(config[name] for name in PARAM_SPACE)
+
+
+def current_config(config_path=DEFAULT_CONFIG_PATH):
+    """The configured forest settings, restricted to the tuned parameters"""
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not all(name in config for name in PARAM_SPACE):
+        return None
+    return {name: config[name] for name in PARAM_SPACE}
+
+
+def sample_configs(n_candidates, seed=None, include=None, space=PARAM_SPACE):
+    """``n_candidates`` distinct random configurations, ``include`` first"""
+    rng = random.Random(seed)
+    n_candidates = min(n_candidates, math.prod(len(values) for values in space.values()))
+    configs = [dict(include)] if include else []
+    seen = {_config_key(config) for config in configs}
+    while len(configs) < n_candidates:
+        config = {name: rng.choice(values) for name, values in space.items()}
+        if _config_key(config) not in seen:
+            seen.add(_config_key(config))
+            configs.append(config)
+    return configs
+
+
+def halving_schedule(n_candidates, n_rows, factor=HALVING_FACTOR, min_rows=MIN_RUNG_ROWS):
+    """[(candidates, rows)] per rung; the last rung always uses every row"""
+    n_rungs = 1
+    while n_candidates // factor ** n_rungs >= 1 and n_rows // factor ** n_rungs >= min_rows:
+        n_rungs += 1
+    return [
+        (max(1, math.ceil(n_candidates / factor ** rung)), n_rows // factor ** (n_rungs - 1 - rung))
+        for rung in range(n_rungs)
+    ]
+
+
+# Memory-mapped (X, y, row order) of the current run, loaded once per pool worker
+_matrix = None
+
+
+def _init_worker(matrix_dir, niceness=WORKER_NICENESS):
+    global _matrix
+    if niceness:
+        try:
+            os.nice(niceness)
+        except (AttributeError, OSError):
+            pass
+    _matrix = tuple(np.load(os.path.join(matrix_dir, f'{name}.npy'), mmap_mode='r')
+                    for name in ('X', 'y', 'order'))
+
+
+def _evaluate(task):
+    """Cross-validated ROC AUC of one configuration on the first ``rows`` of the row order"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import roc_auc_score
+    from sklearn.model_selection import StratifiedKFold
+
+    index, rung, rows, params, folds, seed = task
+    started = time.perf_counter()
+    X, y, order = _matrix
+    sample = np.sort(order[:rows])
+    X_sample, y_sample = np.asarray(X[sample]), np.asarray(y[sample])
+    result = {'candidate': index, 'rung': rung, 'rows': int(rows), 'params': params,
+              'score': None, 'std': None, 'folds': 0}
+
+    _, counts = np.unique(y_sample, return_counts=True)
+    n_splits = int(min(folds, counts.min())) if len(counts) == 2 else 0
+    if n_splits < 2:
+        result['error'] = 'Not enough pairs of each label to cross-validate'
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        return result
+
+    scores = []
+    for train, test in StratifiedKFold(n_splits, shuffle=True, random_state=seed).split(X_sample, y_sample):
+        model = RandomForestClassifier(**params, random_state=42, n_jobs=1)
+        model.fit(X_sample[train], y_sample[train])
+        classes = list(model.classes_)
+        proba = model.predict_proba(X_sample[test])[:, classes.index(1) if 1 in classes else -1]
+        scores.append(roc_auc_score(y_sample[test], proba))
+    result.update(score=round(float(np.mean(scores)), 6), std=round(float(np.std(scores)), 6),
+                  folds=n_splits, seconds=round(time.perf_counter() - started, 3))
+    return result
+
+
+class TuningLog:
+    """Append-only event stream and status document of one run"""
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.events_path = os.path.join(run_dir, EVENTS_FILE)
+        self.status_path = os.path.join(run_dir, STATUS_FILE)
+        self.status = read_json(self.status_path) or {}
+
+    def emit(self, event):
+        event = {'at': _utcnow(), **event}
+        with open(self.events_path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+        return event
+
+    def update(self, **fields):
+        self.status.update(fields, updated_at=_utcnow())
+        _write_json(self.status_path, self.status)
+
+    def cancelled(self):
+        return os.path.exists(os.path.join(self.run_dir, CANCEL_FILE))
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run_search(matrix_dir, n_rows, configs, log, folds=DEFAULT_FOLDS, time_budget=DEFAULT_TIME_BUDGET,
+               cores=None, seed=42):
+    """Successive halving over ``configs``; returns (best_result, baseline_result, reason).
+
+    ``reason`` is 'completed', 'time_budget', 'cancelled' or 'no_scores'.
+    The best result comes from the highest rung that finished, or from the
+    partial first rung when the budget ran out before it did.
+    """
+    deadline = time.monotonic() + time_budget
+    schedule = halving_schedule(len(configs), n_rows)
+    survivors = list(range(len(configs)))
+    best = baseline = None
+    reason = 'completed'
+    scored = []
+
+    pool = multiprocessing.get_context('spawn').Pool(
+        cores or _default_n_jobs(), initializer=_init_worker, initargs=(matrix_dir,)
+    )
+    try:
+        for rung, (keep, rows) in enumerate(schedule):
+            survivors = survivors[:keep]
+            log.emit({'event': 'rung', 'rung': rung, 'candidates': len(survivors), 'rows': int(rows)})
+            log.update(rung=rung, rungs=len(schedule))
+            results = pool.imap_unordered(_evaluate, [(index, rung, rows, configs[index], folds, seed)
+                                                      for index in survivors])
+            scored = []
+            for _ in survivors:
+                while True:
+                    if log.cancelled():
+                        reason = 'cancelled'
+                    elif time.monotonic() >= deadline:
+                        reason = 'time_budget'
+                    if reason != 'completed':
+                        break
+                    try:
+                        result = results.next(timeout=min(POLL_SECONDS, max(deadline - time.monotonic(), 0.01)))
+                        break
+                    except multiprocessing.TimeoutError:
+                        continue
+                if reason != 'completed':
+                    break
+                log.emit({'event': 'result', **result})
+                if result['score'] is not None:
+                    scored.append(result)
+                    if result['candidate'] == 0 and rung == len(schedule) - 1:
+                        baseline = result
+            if reason != 'completed':
+                break
+            if not scored:
+                reason = 'no_scores'
+                break
+            scored.sort(key=lambda result: -result['score'])
+            best = scored[0]
+            survivors = [result['candidate'] for result in scored]
+            log.emit({'event': 'rung_done', 'rung': rung, 'best': best})
+            log.update(best=best)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if best is None and scored:
+        best = max(scored, key=lambda result: result['score'])
+    return best, baseline, reason
+
+
+def write_config(params, config_path=DEFAULT_CONFIG_PATH):
+    """Merge ``params`` into model_config.json (atomically); returns the new config"""
+    config = read_json(config_path) or {}
+    config.update(params)
+    _write_json(config_path, config)
+    return config
+
+
+def tune(database_uri, run_id=None, candidates=DEFAULT_CANDIDATES, folds=DEFAULT_FOLDS,
+         time_budget=DEFAULT_TIME_BUDGET, cores=None, seed=None, tuning_dir=DEFAULT_TUNING_DIR,
+         cache_path=DEFAULT_CACHE_PATH, config_path=DEFAULT_CONFIG_PATH):
+    """Run one search end to end; returns the final status dict"""
+    from ml.retrain_worker import _fill_missing, build_features, load_frames
+
+    started = time.perf_counter()
+    run_id = run_id or new_run_id()
+    run_dir = os.path.join(tuning_dir, run_id)
+    matrix_dir = os.path.join(run_dir, 'matrix')
+    os.makedirs(matrix_dir, exist_ok=True)
+    seed = seed if seed is not None else int(time.time()) % 100000
+    cores = cores or _default_n_jobs()
+    log = TuningLog(run_dir)
+    log.update(run_id=run_id, status='running', pid=os.getpid(), started_at=_utcnow(),
+               settings={'candidates': candidates, 'folds': folds, 'time_budget': time_budget,
+                         'cores': cores, 'seed': seed})
+    try:
+        donors_df, recipients_df = load_frames(database_uri)
+        matrix, stats = build_features(donors_df, recipients_df, cache_path)
+        X, y, _ = matrix.training_data()
+        X = _fill_missing(X)
+        np.save(os.path.join(matrix_dir, 'X.npy'), X.to_numpy(dtype=np.float32))
+        np.save(os.path.join(matrix_dir, 'y.npy'), y)
+        np.save(os.path.join(matrix_dir, 'order.npy'), np.random.default_rng(seed).permutation(len(X)))
+
+        configs = sample_configs(candidates, seed, include=current_config(config_path))
+        schedule = halving_schedule(len(configs), len(X))
+        log.emit({'event': 'started', 'samples': len(X), 'features': list(X.columns),
+                  'candidates': len(configs), 'schedule': schedule, **stats})
+        best, baseline, reason = run_search(matrix_dir, len(X), configs, log, folds, time_budget, cores, seed)
+
+        status = 'cancelled' if reason == 'cancelled' else 'finished'
+        log.update(status=status, reason=reason, best=best, baseline=baseline,
+                   samples=len(X), finished_at=_utcnow(), duration=round(time.perf_counter() - started, 1))
+        log.emit({'event': status, 'reason': reason, 'best': best, 'baseline': baseline})
+    except Exception as e:
+        log.update(status='failed', error=str(e), finished_at=_utcnow(),
+                   duration=round(time.perf_counter() - started, 1))
+        log.emit({'event': 'failed', 'error': str(e)})
+    finally:
+        shutil.rmtree(matrix_dir, ignore_errors=True)
+        _release(tuning_dir, run_id)
+    return log.status
+
+
+def new_run_id():
+    return f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{os.urandom(3).hex()}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError):
+        return pid is not None
+    return True
+
+
+def active_run(tuning_dir=DEFAULT_TUNING_DIR):
+    """Id of the running search, or None (stale locks of dead processes are ignored)"""
+    try:
+        with open(os.path.join(tuning_dir, LOCK_FILE)) as f:
+            run_id = f.read().strip()
+    except OSError:
+        return None
+    status = read_status(run_id, tuning_dir) or {}
+    if status.get('status') in FINISHED_STATUSES or not _pid_alive(status.get('pid')):
+        return None
+    return run_id
+
+
+def _claim(tuning_dir, run_id):
+    """Take the single-search lock for ``run_id``; TuningBusy if a live run holds it"""
+    os.makedirs(tuning_dir, exist_ok=True)
+    path = os.path.join(tuning_dir, LOCK_FILE)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            running = active_run(tuning_dir)
+            if running is not None:
+                raise TuningBusy(running)
+            os.remove(path)
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(run_id)
+        return
+    raise TuningBusy('unknown')
+
+
+def _release(tuning_dir, run_id):
+    path = os.path.join(tuning_dir, LOCK_FILE)
+    try:
+        with open(path) as f:
+            if f.read().strip() == run_id:
+                os.remove(path)
+    except OSError:
+        pass
+
+
+def read_status(run_id, tuning_dir=DEFAULT_TUNING_DIR):
+    return read_json(os.path.join(tuning_dir, run_id, STATUS_FILE))
+
+
+def read_events(run_id, offset=0, tuning_dir=DEFAULT_TUNING_DIR):
+    """(events, next_offset) appended after byte ``offset``; partial lines are left for later"""
+    try:
+        with open(os.path.join(tuning_dir, run_id, EVENTS_FILE), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    complete = data[:data.rfind(b'\n') + 1]
+    return [json.loads(line) for line in complete.splitlines() if line.strip()], offset + len(complete)
+
+
+def list_runs(tuning_dir=DEFAULT_TUNING_DIR, limit=20):
+    """Status documents of the most recent runs, newest first"""
+    try:
+        run_ids = sorted((name for name in os.listdir(tuning_dir)
+                          if os.path.isdir(os.path.join(tuning_dir, name))), reverse=True)
+    except FileNotFoundError:
+        return []
+    return [status for status in (read_status(run_id, tuning_dir) for run_id in run_ids[:limit]) if status]
+
+
+def cancel(run_id, tuning_dir=DEFAULT_TUNING_DIR):
+    """Ask a running search to stop; it keeps the best result found so far"""
+    run_dir = os.path.join(tuning_dir, run_id)
+    if not os.path.isdir(run_dir):
+        return False
+    open(os.path.join(run_dir, CANCEL_FILE), 'w').close()
+    return True
+
+
+def best_config(run_id, tuning_dir=DEFAULT_TUNING_DIR):
+    status = read_status(run_id, tuning_dir) or {}
+    best = status.get('best')
+    return best['params'] if best else None
+
+
+def start_tuning(database_uri, tuning_dir=DEFAULT_TUNING_DIR, cache_path=DEFAULT_CACHE_PATH,
+                 config_path=DEFAULT_CONFIG_PATH, on_done=None, **settings):
+    """Start a search in a separate ``python -m ml.tuning`` process; returns the run id.
+
+    Raises TuningBusy if one is already running on this host.
+    ``on_done(status)`` is called from a watcher thread when it exits.
+    """
+    run_id = new_run_id()
+    tuning_dir, cache_path, config_path = (os.path.abspath(path) for path in (tuning_dir, cache_path, config_path))
+    _claim(tuning_dir, run_id)
+    command = [sys.executable, '-m', 'ml.tuning', '--run-id', run_id, '--tuning-dir', tuning_dir,
+               '--cache-path', cache_path, '--config-path', config_path]
+    for name, value in settings.items():
+        if value is not None:
+            command += [f"--{name.replace('_', '-')}", str(value)]
+    try:
+        log = TuningLog(os.path.join(tuning_dir, run_id))
+        os.makedirs(log.run_dir, exist_ok=True)
+        process = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   env={**os.environ, DATABASE_URI_ENV: database_uri})
+        log.update(run_id=run_id, status='starting', pid=process.pid, started_at=_utcnow())
+    except Exception:
+        _release(tuning_dir, run_id)
+        raise
+
+    def watch():
+        process.wait()
+        _release(tuning_dir, run_id)
+        status = read_status(run_id, tuning_dir) or {}
+        if status.get('status') not in FINISHED_STATUSES:
+            TuningLog(os.path.join(tuning_dir, run_id)).update(
+                status='failed', error=f'Search process exited with code {process.returncode}'
+            )
+        if on_done is not None:
+            on_done(read_status(run_id, tuning_dir))
+
+    threading.Thread(target=watch, name=f'tuning-{run_id}', daemon=True).start()
+    return run_id
+
+
+def promote(run_id, app=None, tuning_dir=DEFAULT_TUNING_DIR, config_path=DEFAULT_CONFIG_PATH,
+            database_uri=None, model_path=DEFAULT_MODEL_PATH):
+    """Write the run's best configuration and retrain on it.
+
+    With ``app`` the full retrain goes through the cross-worker retrain
+    queue; otherwise it runs here (CLI use). Returns the new config.
+    """
+    params = best_config(run_id, tuning_dir)
+    if params is None:
+        raise ValueError(f"Tuning run {run_id} has no scored configuration")
+    config = write_config(params, config_path)
+    TuningLog(os.path.join(tuning_dir, run_id)).update(promoted_at=_utcnow())
+    if app is not None:
+        from ml.retrain_coordinator import get_coordinator
+        get_coordinator(app).request(incremental=False)
+    elif database_uri:
+        from ml.retrain_worker import run_retrain
+        result = run_retrain(database_uri, model_path)
+        print(f"🤖 {result['message']}")
+    return config
+
+
+def init_tuning(app, path='/api/tuning', tuning_dir=DEFAULT_TUNING_DIR, config_path=None):
+    """Register the tuning endpoints used by the settings page"""
+    from flask import Response, jsonify, request
+    from flask_login import login_required
+
+    from models import db
+
+    config_path = config_path or app.config.get('MODEL_CONFIG_PATH', DEFAULT_CONFIG_PATH)
+
+    def _setting(body, name, cast, low, high):
+        value = body.get(name)
+        if value is None:
+            return None
+        value = cast(value)
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}")
+        return value
+
+    def runs_view():
+        if request.method == 'GET':
+            return jsonify({'active': active_run(tuning_dir), 'runs': list_runs(tuning_dir)})
+        body = request.get_json(silent=True) or request.form
+        try:
+            settings = {
+                'candidates': _setting(body, 'candidates', int, 2, 500),
+                'folds': _setting(body, 'folds', int, 2, 10),
+                'time_budget': _setting(body, 'time_budget', float, 10, 24 * 3600),
+                'cores': _setting(body, 'cores', int, 1, os.cpu_count() or 1),
+            }
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        auto_promote = str(body.get('promote', '')).lower() in ('1', 'true', 'on', 'yes')
+
+        def on_done(status):
+            if auto_promote and status and status.get('status') == 'finished' and status.get('best'):
+                try:
+                    promote(status['run_id'], app, tuning_dir, config_path)
+                    print(f"✅ Promoted tuned config {status['best']['params']}")
+                except Exception as e:
+                    print(f"❌ Promoting tuning run {status['run_id']} failed: {e}")
+
+        try:
+            # The engine's URL, not the config string: Flask-SQLAlchemy resolves
+            # relative sqlite paths against the instance folder
+            run_id = start_tuning(db.engine.url.render_as_string(hide_password=False), tuning_dir,
+                                  config_path=config_path, on_done=on_done, **settings)
+        except TuningBusy as e:
+            return jsonify({'error': str(e), 'run_id': e.run_id}), 409
+        return jsonify({'run_id': run_id, 'status': 'starting'}), 202
+
+    def run_view(run_id):
+        status = read_status(run_id, tuning_dir)
+        if status is None:
+            return jsonify({'error': 'Unknown tuning run'}), 404
+        if request.args.get('format') != 'ndjson':
+            events, _ = read_events(run_id, 0, tuning_dir)
+            return jsonify({**status, 'results': [event for event in events if event['event'] == 'result']})
+
+        def follow():
+            offset = 0
+            while True:
+                events, offset = read_events(run_id, offset, tuning_dir)
+                for event in events:
+                    yield json.dumps(event) + '\n'
+                if (read_status(run_id, tuning_dir) or {}).get('status') in FINISHED_STATUSES:
+                    events, offset = read_events(run_id, offset, tuning_dir)
+                    yield ''.join(json.dumps(event) + '\n' for event in events)
+                    return
+                time.sleep(POLL_SECONDS)
+
+        return Response(follow(), mimetype='application/x-ndjson')
+
+    def promote_view(run_id):
+        try:
+            config = promote(run_id, app, tuning_dir, config_path)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify({'run_id': run_id, 'config': config, 'retrain': 'queued'})
+
+    def cancel_view(run_id):
+        if not cancel(run_id, tuning_dir):
+            return jsonify({'error': 'Unknown tuning run'}), 404
+        return jsonify({'run_id': run_id, 'status': 'cancelling'})
+
+    app.add_url_rule(path, 'api_tuning', login_required(runs_view), methods=['GET', 'POST'])
+    app.add_url_rule(f'{path}/<run_id>', 'api_tuning_run', login_required(run_view))
+    app.add_url_rule(f'{path}/<run_id>/promote', 'api_tuning_promote', login_required(promote_view),
+                     methods=['POST'])
+    app.add_url_rule(f'{path}/<run_id>/cancel', 'api_tuning_cancel', login_required(cancel_view),
+                     methods=['POST'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-validated hyperparameter search for the match model')
+    parser.add_argument('--database-uri', default=os.environ.get(DATABASE_URI_ENV),
+                        help=f'Default: ${DATABASE_URI_ENV}')
+    parser.add_argument('--candidates', type=int, default=DEFAULT_CANDIDATES)
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS)
+    parser.add_argument('--time-budget', type=float, default=DEFAULT_TIME_BUDGET, help='Seconds of wall clock')
+    parser.add_argument('--cores', type=int, help='Worker processes (default: half the cores)')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--run-id')
+    parser.add_argument('--tuning-dir', default=DEFAULT_TUNING_DIR)
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH)
+    parser.add_argument('--config-path', default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--promote', action='store_true', help='Write the best config and retrain on it')
+    args = parser.parse_args()
+    if not args.database_uri:
+        parser.error(f'--database-uri or ${DATABASE_URI_ENV} is required')
+
+    run_id = args.run_id
+    if run_id is None:
+        run_id = new_run_id()
+        try:
+            _claim(args.tuning_dir, run_id)
+        except TuningBusy as e:
+            print(f"❌ {e}")
+            return 1
+
+    print(f"🔎 Tuning run {run_id}: {args.candidates} candidates, {args.folds}-fold CV, "
+          f"{args.time_budget:.0f}s budget")
+    status = tune(args.database_uri, run_id, args.candidates, args.folds, args.time_budget, args.cores,
+                  args.seed, args.tuning_dir, args.cache_path, args.config_path)
+    best, baseline = status.get('best'), status.get('baseline')
+    if status['status'] == 'failed':
+        print(f"❌ Tuning failed: {status.get('error')}")
+        return 1
+    if best is None:
+        print(f"⚠️ No configuration could be scored ({status.get('reason')})")
+        return 1
+    print(f"🏆 Best ROC AUC {best['score']:.4f} on {best['rows']} pairs ({status['reason']}, "
+          f"{status['duration']:.0f}s): {best['params']}")
+    if baseline is not None:
+        print(f"   current config: {baseline['score']:.4f}")
+    if args.promote:
+        config = promote(run_id, tuning_dir=args.tuning_dir, config_path=args.config_path,
+                         database_uri=args.database_uri, model_path=args.model_path)
+        print(f"✅ Wrote {config} to {args.config_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
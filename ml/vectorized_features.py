@@ -0,0 +1,242 @@
+"""
+Block-wise vectorized pair features, a NumPy counterpart of ``create_features``
+
+``create_features(donors_df, recipients_df)`` walks every donor x recipient
+pair in Python and calls the per-pair helpers of ml.feature_engineering.
+``create_features`` here takes the same frames and returns the same twelve
+documented columns, row order and labels, computed for whole blocks of
+pairs at once: records are encoded to NumPy columns once, HLA typings
+become allele bitsets (AND + popcount, see ``ml.hla_bitsets``), blood
+groups index an ABO lookup matrix, distances use a broadcast haversine,
+and risk, age and size differences are broadcast arithmetic. At most
+``block_size`` pairs are materialized at a time.
+
+Distances are haversine rather than geopy's geodesic (well under 1% apart).
+Models trained on features beyond these twelve (e.g. the *_factor columns
+of the shipped forest) still need ml.feature_engineering; callers check
+with ``ml.feature_store.missing_features`` and fall back to it.
+
+Usage:
+    from ml.vectorized_features import create_features
+    X, labels = create_features(donors_df, recipients_df, block_size=250_000)
+"""
+
+from ml.candidates import BLOOD_COMPATIBILITY, normalize_blood_group
+from ml.distance_service import haversine_km
+from ml.hla_bitsets import hla_match_scores
+from startup import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_BLOCK_SIZE = 250_000
+
+BLOOD_GROUPS = list(BLOOD_COMPATIBILITY)
+UNKNOWN_CODE = len(BLOOD_GROUPS)
+
+# Viability window per organ used by the freshness feature
+MAX_STORAGE_HOURS = {'Kidney': 36, 'Liver': 12, 'Heart': 6, 'Lung': 8, 'Intestine': 6}
+DEFAULT_MAX_STORAGE_HOURS = 24
+
+# The columns ``create_features`` emits, in its order
+FEATURE_COLUMNS = [
+    'hla_match_score', 'blood_group_compatible', 'organ_freshness_score', 'gps_distance_km', 'age_difference',
+    'organ_size_difference', 'donor_bmi', 'recipient_bmi', 'donor_medical_risk', 'recipient_medical_risk',
+    'urgency_level', 'gender_compatible',
+]
+
+# Ground-truth label: weighted score above LABEL_THRESHOLD (PROJECT_DOCUMENTATION.md)
+LABEL_WEIGHTS = {'hla_match_score': 0.3, 'blood_group_compatible': 0.3, 'organ_freshness_score': 0.2}
+RISK_WEIGHT = 0.1
+LABEL_THRESHOLD = 0.6
+
+_compatible_blood = {}
+
+
+def compatible_blood(unknown_compatible=True):
+    """Boolean matrix [donor_code, recipient_code]; the last code is "unknown".
+
+    Candidate generation keeps unknown groups (``unknown_compatible``, like
+    ml.candidates); the blood_group_compatible feature counts them as 0.
+    """
+    matrix = _compatible_blood.get(unknown_compatible)
+    if matrix is None:
+        matrix = np.full((len(BLOOD_GROUPS) + 1, len(BLOOD_GROUPS) + 1), unknown_compatible, dtype=bool)
+        for donor_code, donor_group in enumerate(BLOOD_GROUPS):
+            for recipient_code, recipient_group in enumerate(BLOOD_GROUPS):
+                matrix[donor_code, recipient_code] = recipient_group in BLOOD_COMPATIBILITY[donor_group]
+        matrix = _compatible_blood.setdefault(unknown_compatible, matrix)
+    return matrix
+
+
+def blood_code(blood_group):
+    group = normalize_blood_group(blood_group)
+    return BLOOD_GROUPS.index(group) if group in BLOOD_GROUPS else UNKNOWN_CODE
+
+
+def _risk(columns, flags):
+    return 0.25 * sum((np.asarray(columns[flag]) == 1).astype(float) for flag in flags)
+
+
+def block_features(donors, recipients):
+    """The twelve feature columns for every recipient x donor pair of a block.
+
+    ``donors`` and ``recipients`` map column names to arrays (NaN for
+    missing values) plus 'hla', a bitset matrix of equal width on both
+    sides. Donors also carry 'max_storage_hours'. Returns arrays of shape
+    (n_recipients, n_donors), i.e. in ``create_features``' recipient-major
+    order when flattened.
+    """
+    n_recipients, n_donors = len(recipients['age']), len(donors['age'])
+    shape = (n_recipients, n_donors)
+
+    def per_donor(values):
+        return np.broadcast_to(values[None, :], shape)
+
+    def per_recipient(values):
+        return np.broadcast_to(values[:, None], shape)
+
+    storage = donors['organ_storage_hours']
+    freshness = np.where(np.isnan(storage), 0.0,
+                         np.clip((1 - storage / donors['max_storage_hours']) * 100, 0.0, 100.0))
+    distance = haversine_km(np.radians(donors['latitude'])[None, :], np.radians(donors['longitude'])[None, :],
+                            np.radians(recipients['latitude'])[:, None], np.radians(recipients['longitude'])[:, None])
+
+    return {
+        'hla_match_score': hla_match_scores(donors['hla'], recipients['hla']).T,
+        'blood_group_compatible': compatible_blood(unknown_compatible=False)[
+            donors['blood_code'][None, :], recipients['blood_code'][:, None]
+        ].astype(float),
+        'organ_freshness_score': per_donor(freshness),
+        'gps_distance_km': np.nan_to_num(distance, nan=0.0),
+        'age_difference': np.nan_to_num(np.abs(donors['age'][None, :] - recipients['age'][:, None]), nan=0.0),
+        'organ_size_difference': np.nan_to_num(
+            np.abs(donors['organ_size'][None, :] - recipients['organ_size_needed'][:, None]), nan=0.0
+        ),
+        'donor_bmi': per_donor(np.nan_to_num(donors['bmi'], nan=0.0)),
+        'recipient_bmi': per_recipient(np.nan_to_num(recipients['bmi'], nan=0.0)),
+        'donor_medical_risk': per_donor(_risk(donors, ('diabetes', 'hypertension', 'smoking', 'alcohol'))),
+        'recipient_medical_risk': per_recipient(_risk(recipients, ('diabetes', 'hypertension'))),
+        'urgency_level': per_recipient(np.nan_to_num(recipients['urgency_level'], nan=0.0)),
+        'gender_compatible': np.where(donors['gender_code'][None, :] == recipients['gender_code'][:, None],
+                                      0.8, 0.6),
+    }
+
+
+def compatibility_labels(features):
+    """1 where the documented weighted compatibility score exceeds LABEL_THRESHOLD"""
+    score = sum(np.asarray(features[name]) * weight for name, weight in LABEL_WEIGHTS.items())
+    score = score + (1 - np.minimum(features['donor_medical_risk'], 1)) * RISK_WEIGHT
+    score = score + (1 - np.minimum(features['recipient_medical_risk'], 1)) * RISK_WEIGHT
+    return (score > LABEL_THRESHOLD).astype(int)
+
+
+def _numbers(df, column):
+    if column not in df:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+
+
+def _category_codes(values, codes, missing_code):
+    """Codes that are equal exactly when the values compare ``==``.
+
+    None equals None, as in ``create_features``' row Series; a float NaN
+    equals nothing, so it gets ``missing_code``, unique to its side.
+    """
+    return np.array([
+        missing_code if isinstance(value, float) and np.isnan(value) else codes.setdefault(value, len(codes))
+        for value in values
+    ], dtype=np.int64)
+
+
+def _hla_matrices(donor_typings, recipient_typings):
+    """Allele bitset matrices of equal width for two lists of HLA typing strings"""
+    from models import parse_hla_typing
+
+    allele_bits = {}
+    encoded = {}
+    for typing in (*donor_typings, *recipient_typings):
+        if typing not in encoded:
+            mask = 0
+            for allele in parse_hla_typing(typing):
+                mask |= 1 << allele_bits.setdefault(allele, len(allele_bits))
+            encoded[typing] = mask
+    width = max(1, (len(allele_bits) + 7) // 8)
+
+    def matrix(typings):
+        rows = np.zeros((len(typings), width), dtype=np.uint8)
+        for i, typing in enumerate(typings):
+            rows[i] = np.frombuffer(encoded[typing].to_bytes(width, 'little'), dtype=np.uint8)
+        return rows
+
+    return matrix(donor_typings), matrix(recipient_typings)
+
+
+def encode_frames(donors_df, recipients_df):
+    """(donor columns, recipient columns, donor organ codes, recipient organ codes)
+    of two record frames, ready for ``block_features``"""
+    def typings(df):
+        return df['hla_typing'].tolist() if 'hla_typing' in df else [None] * len(df)
+
+    def strings(df, column):
+        return df[column].tolist() if column in df else [None] * len(df)
+
+    donor_hla, recipient_hla = _hla_matrices(typings(donors_df), typings(recipients_df))
+    gender_codes = {}
+    organ_codes = {}
+    donors = {name: _numbers(donors_df, name) for name in (
+        'age', 'bmi', 'latitude', 'longitude', 'organ_storage_hours', 'organ_size',
+        'diabetes', 'hypertension', 'smoking', 'alcohol',
+    )}
+    recipients = {name: _numbers(recipients_df, name) for name in (
+        'age', 'bmi', 'latitude', 'longitude', 'organ_size_needed', 'diabetes', 'hypertension', 'urgency_level',
+    )}
+    donor_organs = strings(donors_df, 'organ_type')
+    donors['max_storage_hours'] = np.array(
+        [MAX_STORAGE_HOURS.get(organ, DEFAULT_MAX_STORAGE_HOURS) for organ in donor_organs], dtype=float
+    )
+    for columns, df, hla, missing_code in ((donors, donors_df, donor_hla, -1),
+                                           (recipients, recipients_df, recipient_hla, -2)):
+        columns['hla'] = hla
+        columns['blood_code'] = np.array([blood_code(value) for value in strings(df, 'blood_group')], dtype=np.int64)
+        columns['gender_code'] = _category_codes(strings(df, 'gender'), gender_codes, missing_code)
+    return (donors, recipients, _category_codes(donor_organs, organ_codes, -1),
+            _category_codes(strings(recipients_df, 'organ_needed'), organ_codes, -2))
+
+
+def _take(columns, rows):
+    return {name: values[rows] for name, values in columns.items()}
+
+
+def create_features(donors_df, recipients_df, block_size=DEFAULT_BLOCK_SIZE):
+    """(X_df, labels) like ``ml.feature_engineering.create_features``, block by block.
+
+    Pairs with different organs are skipped; rows come recipient by
+    recipient, donors in frame order. ``block_size`` bounds the pairs held
+    in memory while computing (the result itself is one row per pair).
+    """
+    donors, recipients, donor_organs, recipient_organs = encode_frames(donors_df, recipients_df)
+    n_donors, n_recipients = len(donor_organs), len(recipient_organs)
+    frames = {name: [] for name in FEATURE_COLUMNS}
+    labels = []
+    if n_donors and n_recipients:
+        block_size = max(1, int(block_size))
+        # Several recipients against every donor, or one recipient against a run of donors
+        recipient_step = max(1, block_size // n_donors)
+        donor_step = n_donors if recipient_step > 1 else min(n_donors, block_size)
+        for recipient_start in range(0, n_recipients, recipient_step):
+            recipient_rows = np.arange(recipient_start, min(recipient_start + recipient_step, n_recipients))
+            for donor_start in range(0, n_donors, donor_step):
+                donor_rows = np.arange(donor_start, min(donor_start + donor_step, n_donors))
+                same_organ = recipient_organs[recipient_rows][:, None] == donor_organs[donor_rows][None, :]
+                if not same_organ.any():
+                    continue
+                features = block_features(_take(donors, donor_rows), _take(recipients, recipient_rows))
+                for name in FEATURE_COLUMNS:
+                    frames[name].append(np.asarray(features[name], dtype=float)[same_organ])
+                labels.append(compatibility_labels(features)[same_organ])
+
+    X = pd.DataFrame({
+        name: np.concatenate(parts) if parts else np.empty(0) for name, parts in frames.items()
+    }, columns=FEATURE_COLUMNS)
+    return X, (np.concatenate(labels).tolist() if labels else [])
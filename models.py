@@ -1,10 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, func, inspect, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 db = SQLAlchemy()
 
+# Process-wide cache of the global HLA allele dictionary (allele name -> id).
+# Bit ``id - 1`` of a record's ``hla_bits`` is set when it carries that allele.
+# Only ids seen in a committed transaction are cached; ids learned inside a
+# transaction are staged on the connection until it commits (see below).
+_hla_allele_ids = {}
+_STAGED_HLA_IDS = 'staged_hla_allele_ids'
+_STAGED_HLA_SAVEPOINTS = 'staged_hla_allele_savepoints'
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -27,10 +40,11 @@ class Donor(db.Model):
     name = db.Column(db.String(100), nullable=False)
     age = db.Column(db.Integer, nullable=True)
     gender = db.Column(db.String(10), nullable=True)
-    blood_group = db.Column(db.String(5), nullable=True)
-    organ_type = db.Column(db.String(50), nullable=False)
+    blood_group = db.Column(db.String(5), nullable=True, index=True)
+    organ_type = db.Column(db.String(50), nullable=False, index=True)
     bmi = db.Column(db.Float, nullable=True)
     hla_typing = db.Column(db.String(200), nullable=True)
+    hla_bits = db.Column(db.LargeBinary, nullable=True)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
     organ_storage_hours = db.Column(db.Float, nullable=True)
@@ -39,7 +53,8 @@ class Donor(db.Model):
     hypertension = db.Column(db.Integer, default=0)
     smoking = db.Column(db.Integer, default=0)
     alcohol = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def to_dict(self):
         return {
@@ -69,17 +84,19 @@ class Recipient(db.Model):
     name = db.Column(db.String(100), nullable=False)
     age = db.Column(db.Integer, nullable=True)
     gender = db.Column(db.String(10), nullable=True)
-    blood_group = db.Column(db.String(5), nullable=True)
-    organ_needed = db.Column(db.String(50), nullable=False)
+    blood_group = db.Column(db.String(5), nullable=True, index=True)
+    organ_needed = db.Column(db.String(50), nullable=False, index=True)
     bmi = db.Column(db.Float, nullable=True)
     hla_typing = db.Column(db.String(200), nullable=True)
+    hla_bits = db.Column(db.LargeBinary, nullable=True)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
     organ_size_needed = db.Column(db.Float, nullable=True)
     diabetes = db.Column(db.Integer, default=0)
     hypertension = db.Column(db.Integer, default=0)
-    urgency_level = db.Column(db.Integer, default=1)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    urgency_level = db.Column(db.Integer, default=1, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def to_dict(self):
         return {
@@ -121,11 +138,114 @@ class MatchHistory(db.Model):
             'matched_at': self.matched_at.strftime('%Y-%m-%d %H:%M:%S')
         }
 
+class PairScore(db.Model):
+    __tablename__ = 'pair_scores'
+    __table_args__ = (
+        db.UniqueConstraint('donor_id', 'recipient_id', 'model_version', name='uq_pair_scores_pair_version'),
+        db.Index('ix_pair_scores_version_score', 'model_version', 'compatibility_score'),
+        db.Index('ix_pair_scores_version_recipient_score', 'model_version', 'recipient_id', 'compatibility_score'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    donor_id = db.Column(db.Integer, db.ForeignKey('donors.id', ondelete='CASCADE'), nullable=False, index=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('recipients.id', ondelete='CASCADE'), nullable=False)
+    model_version = db.Column(db.String(64), nullable=False)
+    compatibility_score = db.Column(db.Float, nullable=False)
+    scored_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    donor = db.relationship('Donor', backref=db.backref('pair_scores', passive_deletes=True))
+    recipient = db.relationship('Recipient', backref=db.backref('pair_scores', passive_deletes=True))
+    
+    def to_dict(self):
+        return {
+            'donor_id': self.donor_id,
+            'recipient_id': self.recipient_id,
+            'model_version': self.model_version,
+            'compatibility_score': self.compatibility_score,
+            'scored_at': self.scored_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+class PairScoreRun(db.Model):
+    __tablename__ = 'pair_score_runs'
+    
+    model_version = db.Column(db.String(64), primary_key=True)
+    scored_through = db.Column(db.DateTime, nullable=False)
+    pairs_scored = db.Column(db.Integer, default=0)
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'model_version': self.model_version,
+            'scored_through': self.scored_through.strftime('%Y-%m-%d %H:%M:%S'),
+            'pairs_scored': self.pairs_scored,
+            'completed_at': self.completed_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+class Lease(db.Model):
+    __tablename__ = 'leases'
+    
+    # A named lock shared by all workers: held by ``owner`` until
+    # ``expires_at`` and renewed while the work runs, so a crashed holder
+    # only blocks the others until its lease runs out
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100))
+    expires_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'owner': self.owner,
+            'expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S') if self.expires_at else None
+        }
+
+class RetrainJob(db.Model):
+    __tablename__ = 'retrain_jobs'
+    
+    # pending_slot / running_slot are 1 for the pending and the running job
+    # and NULL otherwise; their unique constraints allow at most one of each
+    # across all workers (NULLs never collide on SQLite or PostgreSQL)
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    incremental = db.Column(db.Boolean, default=False)
+    requests = db.Column(db.Integer, default=1)
+    requested_by = db.Column(db.String(100))
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    pending_slot = db.Column(db.Integer, unique=True)
+    running_slot = db.Column(db.Integer, unique=True)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    model_version = db.Column(db.String(64))
+    message = db.Column(db.Text)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'incremental': self.incremental,
+            'requests': self.requests,
+            'requested_at': self.requested_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None,
+            'duration': self.duration,
+            'model_version': self.model_version,
+            'message': self.message
+        }
+
 class SystemLog(db.Model):
     __tablename__ = 'system_logs'
+    __table_args__ = (
+        db.Index('ix_system_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_system_logs_level_timestamp', 'level', 'timestamp'),
+        db.Index('ix_system_logs_category_timestamp', 'category', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Not nullable: logs_page orders and pages by (timestamp, id)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     level = db.Column(db.String(20), nullable=False)
     message = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(50), default='general')
@@ -138,3 +258,218 @@ class SystemLog(db.Model):
             'message': self.message,
             'category': self.category
         }
+
+class HLAAllele(db.Model):
+    __tablename__ = 'hla_alleles'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), unique=True, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'bit': self.id - 1
+        }
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    
+    # Bumped in the same transaction as any write to the tracked tables, so
+    # clients can cheaply tell whether match results may have changed
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+def parse_hla_typing(hla_typing):
+    """Split a free-text HLA typing such as "A1, B8, DR3" into normalized alleles"""
+    if hla_typing is None:
+        return []
+    alleles = str(hla_typing).upper().replace(' ', '').split(',')
+    return [allele for allele in dict.fromkeys(alleles) if allele and allele != 'NAN']
+
+def get_hla_allele_ids(connection, alleles):
+    """Look up (registering when missing) the dictionary ids of the given alleles.
+
+    Ids read or inserted in the open transaction may vanish if it rolls
+    back, so they are staged on the connection and only enter the shared
+    cache once it commits.
+    """
+    table = HLAAllele.__table__
+    staged = connection.info.setdefault(_STAGED_HLA_IDS, {})
+    known = {**_hla_allele_ids, **staged}
+    missing = [allele for allele in alleles if allele not in known]
+    if missing:
+        rows = connection.execute(
+            select(table.c.name, table.c.id).where(table.c.name.in_(missing))
+        )
+        staged.update(rows.all())
+    
+    for allele in missing:
+        if allele in staged:
+            continue
+        try:
+            # Savepoint so a concurrent registration by another worker only
+            # rolls back this insert, not the caller's transaction
+            with connection.begin_nested():
+                result = connection.execute(insert(table).values(name=allele))
+            staged[allele] = result.inserted_primary_key[0]
+        except IntegrityError:
+            staged[allele] = connection.execute(
+                select(table.c.id).where(table.c.name == allele)
+            ).scalar_one()
+    
+    return [staged[allele] if allele in staged else _hla_allele_ids[allele] for allele in alleles]
+
+def _publish_staged_hla_ids(connection):
+    _hla_allele_ids.update(connection.info.pop(_STAGED_HLA_IDS, {}))
+    connection.info.pop(_STAGED_HLA_SAVEPOINTS, None)
+
+def _discard_staged_hla_ids(connection):
+    connection.info.pop(_STAGED_HLA_IDS, None)
+    connection.info.pop(_STAGED_HLA_SAVEPOINTS, None)
+
+def _snapshot_staged_hla_ids(connection, name):
+    # Savepoints nest, so snapshots form a stack (``name`` may still be None here)
+    snapshots = connection.info.setdefault(_STAGED_HLA_SAVEPOINTS, [])
+    snapshots.append(dict(connection.info.get(_STAGED_HLA_IDS, {})))
+
+def _restore_staged_hla_ids(connection, name, context):
+    snapshots = connection.info.get(_STAGED_HLA_SAVEPOINTS)
+    snapshot = snapshots.pop() if snapshots else {}
+    staged = connection.info.get(_STAGED_HLA_IDS)
+    if staged is not None:
+        # In place: get_hla_allele_ids holds a reference while it inserts
+        staged.clear()
+        staged.update(snapshot)
+
+def _release_staged_hla_snapshot(connection, name, context):
+    snapshots = connection.info.get(_STAGED_HLA_SAVEPOINTS)
+    if snapshots:
+        snapshots.pop()
+
+def _discard_staged_hla_ids_on_checkin(dbapi_connection, connection_record):
+    connection_record.info.pop(_STAGED_HLA_IDS, None)
+    connection_record.info.pop(_STAGED_HLA_SAVEPOINTS, None)
+
+event.listen(Engine, 'commit', _publish_staged_hla_ids)
+event.listen(Engine, 'rollback', _discard_staged_hla_ids)
+event.listen(Engine, 'savepoint', _snapshot_staged_hla_ids)
+event.listen(Engine, 'rollback_savepoint', _restore_staged_hla_ids)
+event.listen(Engine, 'release_savepoint', _release_staged_hla_snapshot)
+event.listen(Pool, 'checkin', _discard_staged_hla_ids_on_checkin)
+
+def encode_hla_typing(connection, hla_typing):
+    """Encode an HLA typing string as a little-endian allele bitset (None if empty)"""
+    alleles = parse_hla_typing(hla_typing)
+    if not alleles:
+        return None
+    mask = 0
+    for allele_id in get_hla_allele_ids(connection, alleles):
+        mask |= 1 << (allele_id - 1)
+    return mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+
+def _encode_hla_on_insert(mapper, connection, target):
+    target.hla_bits = encode_hla_typing(connection, target.hla_typing)
+
+def _encode_hla_on_update(mapper, connection, target):
+    if db.inspect(target).attrs.hla_typing.history.has_changes():
+        target.hla_bits = encode_hla_typing(connection, target.hla_typing)
+
+for _model in (Donor, Recipient):
+    event.listen(_model, 'before_insert', _encode_hla_on_insert)
+    event.listen(_model, 'before_update', _encode_hla_on_update)
+
+# Tables whose writes change match results, and the DataVersion row they bump
+DATA_VERSION_NAME = 'matches'
+DATA_VERSION_TABLES = {'donors', 'recipients', 'pair_scores', 'pair_score_runs'}
+_data_version_tables = {}
+
+def _mark_data_changed(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if getattr(obj, '__tablename__', None) in DATA_VERSION_TABLES:
+            session.info['data_changed'] = True
+            return
+
+def _mark_bulk_data_changed(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if getattr(table, 'name', None) in DATA_VERSION_TABLES:
+            orm_execute_state.session.info['data_changed'] = True
+
+def _has_data_version_table(connection):
+    # Only a table that exists is remembered: workers started before
+    # `init_db.py --upgrade` pick it up as soon as it is created
+    key = str(connection.engine.url)
+    if key not in _data_version_tables:
+        if not inspect(connection).has_table(DataVersion.__tablename__):
+            return False
+        _data_version_tables[key] = True
+    return True
+
+def bump_data_version(connection):
+    """Increment the match data version (inserting its row the first time)"""
+    table = DataVersion.__table__
+    result = connection.execute(
+        update(table).where(table.c.name == DATA_VERSION_NAME)
+        .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(name=DATA_VERSION_NAME, version=1, updated_at=datetime.utcnow()))
+
+def data_version_token(connection):
+    """A value that changes whenever donors or recipients are written.
+
+    The data_versions counter, or before ``init_db.py --upgrade`` has
+    created it, the row counts, max ids and max updated_at of both tables.
+    Lets per-process caches notice writes made by other workers or by
+    bulk loads that bypass the ORM.
+    """
+    if _has_data_version_table(connection):
+        table = DataVersion.__table__
+        return connection.execute(
+            select(table.c.version).where(table.c.name == DATA_VERSION_NAME)
+        ).scalar() or 0
+    return tuple(
+        tuple(connection.execute(select(func.count(), func.max(table.c.id), func.max(table.c.updated_at))).one())
+        for table in (Donor.__table__, Recipient.__table__)
+    )
+
+def record_changes(connection, model, columns, since=None):
+    """(rows of ``columns`` updated at or after ``since``, set of all ids) of a table.
+
+    Every row is returned when ``since`` is None; comparing the id set
+    with a cache's ids finds deleted records.
+    """
+    table = model.__table__
+    query = select(*[table.c[name] for name in columns])
+    if since is not None:
+        query = query.where(table.c.updated_at >= since)
+    rows = [row._asdict() for row in connection.execute(query)]
+    ids = set(connection.execute(select(table.c.id)).scalars())
+    return rows, ids
+
+def _bump_data_version_on_commit(session):
+    # before_commit runs ahead of the final flush, so check pending objects too
+    _mark_data_changed(session, None, None)
+    if not session.info.pop('data_changed', False):
+        return
+    connection = session.connection()
+    # Skip quietly until `init_db.py --upgrade` has created the table
+    if _has_data_version_table(connection):
+        bump_data_version(connection)
+
+def _reset_data_changed(session, previous_transaction):
+    session.info.pop('data_changed', None)
+
+event.listen(Session, 'before_flush', _mark_data_changed)
+event.listen(Session, 'do_orm_execute', _mark_bulk_data_changed)
+event.listen(Session, 'before_commit', _bump_data_version_on_commit)
+event.listen(Session, 'after_soft_rollback', _reset_data_changed)
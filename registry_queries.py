@@ -0,0 +1,240 @@
+"""
+Database-side queries behind the dashboard, listings and exports
+
+Dashboard statistics are computed with GROUP BY in the database instead of
+loading whole tables into pandas, listings page by id (keyset) instead of
+OFFSET, and exports stream rows with ``yield_per`` so memory stays flat
+regardless of table size. CSV is always available; Parquet needs pyarrow.
+
+Usage in a route:
+    stats = dashboard_stats()
+    donors, next_cursor = keyset_listing(Donor, after_id=request.args.get('after', type=int))
+    return export_response(Donor, request.args.get('format', 'csv'))
+"""
+
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from models import db, Donor, Recipient, MatchHistory
+
+EXPORT_CHUNK_SIZE = 2000
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+# Columns never exported (internal encodings)
+EXPORT_EXCLUDE = {'hla_bits'}
+
+ORGAN_COLUMN = {Donor: Donor.organ_type, Recipient: Recipient.organ_needed}
+
+
+def _grouped_counts(column):
+    rows = db.session.execute(
+        select(column, func.count()).group_by(column).order_by(func.count().desc())
+    ).all()
+    return {key if key is not None else 'Unknown': count for key, count in rows}
+
+
+def organ_distribution():
+    """{'donors': {organ: count}, 'recipients': {organ: count}}"""
+    return {
+        'donors': _grouped_counts(Donor.organ_type),
+        'recipients': _grouped_counts(Recipient.organ_needed),
+    }
+
+
+def blood_group_distribution():
+    return {
+        'donors': _grouped_counts(Donor.blood_group),
+        'recipients': _grouped_counts(Recipient.blood_group),
+    }
+
+
+def urgency_distribution():
+    return _grouped_counts(Recipient.urgency_level)
+
+
+def _month(column):
+    """'YYYY-MM' of a timestamp column in the current dialect"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+def monthly_trends(months=12):
+    """New donors and recipients per month for the last ``months`` months, oldest first"""
+    now = datetime.utcnow()
+    year, month = now.year, now.month - (months - 1)
+    while month <= 0:
+        year, month = year - 1, month + 12
+    since = datetime(year, month, 1)
+
+    labels = []
+    while (year, month) <= (now.year, now.month):
+        labels.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    trends = {label: {'month': label, 'donors': 0, 'recipients': 0} for label in labels}
+    for model, key in ((Donor, 'donors'), (Recipient, 'recipients')):
+        bucket = _month(model.created_at).label('month')
+        rows = db.session.execute(
+            select(bucket, func.count()).where(model.created_at >= since).group_by(bucket)
+        ).all()
+        for label, count in rows:
+            if label in trends:
+                trends[label][key] = count
+    return list(trends.values())
+
+
+def dashboard_stats():
+    """Headline numbers for the dashboard in a handful of aggregate queries"""
+    match_count, average_score = db.session.execute(
+        select(func.count(MatchHistory.id), func.avg(MatchHistory.compatibility_score))
+    ).one()
+    return {
+        'total_donors': db.session.scalar(select(func.count(Donor.id))),
+        'total_recipients': db.session.scalar(select(func.count(Recipient.id))),
+        'total_matches': match_count,
+        'average_compatibility': round(average_score, 2) if average_score is not None else None,
+        'organ_distribution': organ_distribution(),
+        'blood_group_distribution': blood_group_distribution(),
+    }
+
+
+def keyset_listing(model, after_id=None, limit=DEFAULT_PAGE_SIZE, organ=None, blood_group=None,
+                   urgency_level=None):
+    """Newest-first page of ``model`` rows with id below ``after_id``.
+
+    Returns (rows, next_after_id); next_after_id is None on the last page.
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    query = model.query
+    if organ:
+        query = query.filter(ORGAN_COLUMN[model] == organ)
+    if blood_group:
+        query = query.filter(model.blood_group == blood_group)
+    if urgency_level is not None and model is Recipient:
+        query = query.filter(Recipient.urgency_level == urgency_level)
+    if after_id is not None:
+        query = query.filter(model.id < after_id)
+    rows = query.order_by(model.id.desc()).limit(limit + 1).all()
+    next_after_id = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_after_id
+
+
+def export_columns(model):
+    return [column for column in model.__table__.columns if column.name not in EXPORT_EXCLUDE]
+
+
+def _stream_rows(model, chunk_size):
+    """Yield lists of row tuples, ``chunk_size`` at a time, from a server-side cursor"""
+    result = db.session.execute(
+        select(*export_columns(model)).order_by(model.id).execution_options(yield_per=chunk_size)
+    )
+    for partition in result.partitions():
+        yield partition
+
+
+def stream_csv(model, chunk_size=EXPORT_CHUNK_SIZE):
+    """Generator of CSV text, one chunk of rows per yielded string"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in export_columns(model)])
+    for partition in _stream_rows(model, chunk_size):
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are handed out and cleared per row group"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _arrow_schema(model):
+    import pyarrow as pa
+
+    def arrow_type(column):
+        python_type = column.type.python_type
+        if python_type is bool:
+            return pa.bool_()
+        if python_type is int:
+            return pa.int64()
+        if python_type is float:
+            return pa.float64()
+        if python_type is datetime:
+            return pa.timestamp('us')
+        return pa.string()
+
+    return pa.schema([(column.name, arrow_type(column)) for column in export_columns(model)])
+
+
+def stream_parquet(model, chunk_size=EXPORT_CHUNK_SIZE):
+    """Generator of Parquet bytes, one row group per chunk of rows"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = _arrow_schema(model)
+    names = schema.names
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    for partition in _stream_rows(model, chunk_size):
+        columns = list(zip(*partition))
+        writer.write_table(pa.table(
+            {name: pa.array(values, type=schema.field(name).type) for name, values in zip(names, columns)},
+            schema=schema
+        ))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv'),
+    'parquet': (stream_parquet, 'application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def export_response(model, export_format='csv', chunk_size=EXPORT_CHUNK_SIZE):
+    """Streaming Flask response exporting every row of ``model``"""
+    from flask import Response, stream_with_context
+
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    generate, mimetype, extension = EXPORT_FORMATS[export_format]
+    if export_format == 'parquet':
+        import importlib.util
+        if importlib.util.find_spec('pyarrow') is None:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    filename = f"{model.__tablename__}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(
+        stream_with_context(generate(model, chunk_size)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
@@ -0,0 +1,241 @@
+"""
+Worker cold start: lazy ML imports, fingerprint-gated startup training,
+optional background warm-up and time-to-first-request measurement
+
+Importing the web modules must stay cheap because every gunicorn worker
+(``preload_app = False``) and every ``max_requests`` recycle imports them
+again. ML modules therefore bind numpy/pandas with ``lazy_import`` and
+import scikit-learn, joblib, shap and geopy inside the functions that use
+them; the first ML request (or the warm-up thread) pays for the import.
+
+Startup training is only needed when the current registry model was not
+trained on the data now in the database: ``startup_training_needed``
+compares the cheap ``database_fingerprint`` (row counts, max ids, max
+updated_at) with the one stored in the model's meta.json, and
+``train_on_startup`` queues at most one retrain across all workers.
+
+Usage:
+    from startup import init_startup, train_on_startup
+    init_startup(app)              # WARMUP_ON_START=1 warms the ML stack in the background
+    train_on_startup(app)          # instead of loading the sample data and training unconditionally
+
+    python startup.py --measure-import app
+    python startup.py --url http://localhost:5000/login -- gunicorn --config gunicorn.conf.py app:app
+"""
+
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+def _process_started():
+    """Wall-clock start time of this process (Linux /proc), else now"""
+    try:
+        with open('/proc/self/stat') as f:
+            ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+PROCESS_STARTED = _process_started()
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '0').lower() in ('1', 'true', 'yes')
+
+
+class LazyModule:
+    """Module proxy that imports ``name`` on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """The module if it is already imported, else a proxy that imports it on first use"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+
+def startup_training_needed(registry_dir=None, session=None):
+    """(needed, reason): False only if the current model was trained on the current data"""
+    from ml.model_registry import DEFAULT_REGISTRY_DIR, current_version, database_fingerprint, load_meta
+
+    registry_dir = registry_dir or DEFAULT_REGISTRY_DIR
+    version = current_version(registry_dir)
+    if version is None:
+        return True, 'no published model'
+    stored = load_meta(version, registry_dir).get('database_fingerprint')
+    if stored is None:
+        return True, f'model {version} has no stored database fingerprint'
+    current = database_fingerprint(session)
+    if stored != current:
+        return True, f'data changed since model {version} was trained'
+    return False, f'model {version} matches the current data'
+
+
+def train_on_startup(app, registry_dir=None):
+    """Queue a full retrain only if ``startup_training_needed``; returns (queued, reason).
+
+    Every worker runs this, but the retrain coordinator folds their
+    requests into one job, which runs outside the request path.
+    """
+    with app.app_context():
+        needed, reason = startup_training_needed(registry_dir)
+    if not needed:
+        print(f"✅ Skipping startup training: {reason}")
+        return False, reason
+    from ml.retrain_coordinator import get_coordinator
+
+    outcome = get_coordinator(app).request(incremental=False)
+    print(f"🤖 Startup retrain {outcome}: {reason}")
+    return True, reason
+
+
+def warm_up(app):
+    """Import the ML stack and load the current model; returns seconds per step"""
+    timings = {}
+    started = time.perf_counter()
+    for name in ('numpy', 'pandas', 'sklearn.ensemble', 'joblib'):
+        importlib.import_module(name)
+    timings['imports'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from ml.model_registry import get_model_handle
+    with app.app_context():
+        get_model_handle().get()
+    timings['model'] = time.perf_counter() - started
+    return timings
+
+
+def schedule_warmup(app):
+    """Run ``warm_up`` in a daemon thread; requests are served meanwhile"""
+    from metrics import observe_startup
+
+    def run():
+        started = time.perf_counter()
+        try:
+            timings = warm_up(app)
+        except Exception as e:
+            print(f"❌ Warm-up failed: {e}")
+            return
+        observe_startup('warmup', time.perf_counter() - started)
+        print(f"🔥 Worker {os.getpid()} warmed up in {time.perf_counter() - started:.2f}s "
+              f"({', '.join(f'{step} {seconds:.2f}s' for step, seconds in timings.items())})")
+
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_startup(app, warmup=None):
+    """Record app-ready and first-request times, and optionally start the warm-up.
+
+    Call at the end of app setup. ``warmup`` defaults to WARMUP_ON_START.
+    """
+    from flask import request
+    from metrics import observe_startup
+
+    ready = time.time() - PROCESS_STARTED
+    observe_startup('app_ready', ready)
+    app.config['STARTUP_SECONDS'] = {'app_ready': round(ready, 3)}
+    first_request = threading.Event()
+
+    def record_first_request():
+        if first_request.is_set():
+            return
+        first_request.set()
+        seconds = time.time() - PROCESS_STARTED
+        observe_startup('first_request', seconds)
+        app.config['STARTUP_SECONDS']['first_request'] = round(seconds, 3)
+        print(f"⏱️  Worker {os.getpid()} ready in {ready:.2f}s, first request ({request.path}) "
+              f"at {seconds:.2f}s after process start")
+
+    app.before_request(record_first_request)
+    if WARMUP_ON_START if warmup is None else warmup:
+        schedule_warmup(app)
+
+
+def measure_import(module, runs=3):
+    """Seconds to import ``module`` in a fresh interpreter, and the heavy libraries it pulled in"""
+    heavy = ('numpy', 'pandas', 'sklearn', 'scipy', 'joblib', 'shap', 'geopy')
+    code = (f"import sys, time; started = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - started); print(','.join(n for n in {heavy!r} if n in sys.modules))")
+    timings, loaded = [], ''
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split('\n')
+        timings.append(float(output[0]))
+        loaded = output[1]
+    return min(timings), [name for name in loaded.split(',') if name]
+
+
+def measure_first_response(command, url, timeout=120):
+    """Start ``command`` and poll ``url``; seconds until the first HTTP response"""
+    import urllib.error
+    import urllib.request
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                urllib.request.urlopen(url, timeout=5).read()
+                return time.perf_counter() - started
+            except urllib.error.HTTPError:
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"No response from {url} within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import cost and time to first request')
+    parser.add_argument('--measure-import', nargs='*', metavar='MODULE',
+                        help='Modules to time in a fresh interpreter (default: app)')
+    parser.add_argument('--url', help='URL to poll after starting the server command given after --')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    if args.measure_import is not None:
+        for module in args.measure_import or ['app']:
+            seconds, heavy = measure_import(module)
+            print(f"📦 import {module}: {seconds * 1000:.0f} ms"
+                  f"{' (loads ' + ', '.join(heavy) + ')' if heavy else ''}")
+
+    if args.url:
+        command = args.command[1:] if args.command[:1] == ['--'] else args.command
+        if not command:
+            parser.error('give the server command after --')
+        seconds = measure_first_response(command, args.url, args.timeout)
+        print(f"⏱️  First response from {args.url} after {seconds:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
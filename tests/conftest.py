@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import models  # noqa: E402
+from models import db, Donor, Recipient  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    from flask import Flask
+    from flask_login import LoginManager
+
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SECRET_KEY='test',
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'organmatch.db'}",
+        LOGIN_DISABLED=True,
+    )
+    db.init_app(app)
+    LoginManager(app)
+    models._hla_allele_ids.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    models._hla_allele_ids.clear()
+
+
+def make_donor(**values):
+    record = dict(name='Donor', age=40, gender='Male', blood_group='O+', organ_type='Kidney', bmi=24.0,
+                  hla_typing='A1, B8, DR3', latitude=40.7, longitude=-74.0, organ_storage_hours=6.0,
+                  organ_size=11.0, diabetes=0, hypertension=0, smoking=0, alcohol=0)
+    record.update(values)
+    return Donor(**record)
+
+
+def make_recipient(**values):
+    record = dict(name='Recipient', age=50, gender='Female', blood_group='A+', organ_needed='Kidney', bmi=26.0,
+                  hla_typing='A1, B7, DR4', latitude=41.9, longitude=-87.6, organ_size_needed=10.5,
+                  diabetes=0, hypertension=1, urgency_level=3)
+    record.update(values)
+    return Recipient(**record)
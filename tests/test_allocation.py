@@ -0,0 +1,108 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from ml import allocation
+from ml.allocation import edge_weights, greedy_matching, optimal_matching, solve_allocation, sparsify
+
+
+def _random_graph(rng, n_rows, n_cols, density):
+    mask = rng.random((n_rows, n_cols)) < density
+    rows, cols = np.nonzero(mask)
+    return rows, cols, np.round(rng.random(len(rows)) * 2, 3)
+
+
+def _brute_force(rows, cols, weights, n_rows, n_cols):
+    """Best total weight over every assignment of rows to distinct columns or nothing"""
+    dense = {(row, col): weight for row, col, weight in zip(rows.tolist(), cols.tolist(), weights.tolist())}
+    best = 0.0
+    for assignment in itertools.permutations(list(range(n_cols)) + [None] * n_rows, n_rows):
+        best = max(best, sum(dense.get((row, col), 0.0) for row, col in enumerate(assignment) if col is not None))
+    return best
+
+
+def _assert_matching(rows, cols, chosen):
+    assert len(set(rows[chosen].tolist())) == len(chosen)
+    assert len(set(cols[chosen].tolist())) == len(chosen)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_optimal_matching_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n_rows, n_cols = int(rng.integers(1, 5)), int(rng.integers(1, 6))
+    rows, cols, weights = _random_graph(rng, n_rows, n_cols, 0.6)
+    if not len(rows):
+        pytest.skip('empty graph')
+    chosen = optimal_matching(rows, cols, weights)
+    _assert_matching(rows, cols, chosen)
+    assert weights[chosen].sum() == pytest.approx(_brute_force(rows, cols, weights, n_rows, n_cols))
+    assert weights[greedy_matching(rows.tolist(), cols.tolist(), weights)].sum() <= weights[chosen].sum() + 1e-9
+
+
+def test_optimal_matching_matches_dense_assignment():
+    from scipy.optimize import linear_sum_assignment
+
+    rng = np.random.default_rng(0)
+    rows, cols, weights = _random_graph(rng, 40, 120, 0.1)
+    chosen = optimal_matching(rows, cols, weights)
+    _assert_matching(rows, cols, chosen)
+
+    dense = np.zeros((40, 120))
+    dense[rows, cols] = weights
+    best_rows, best_cols = linear_sum_assignment(dense, maximize=True)
+    assert weights[chosen].sum() == pytest.approx(dense[best_rows, best_cols].sum())
+
+
+def test_greedy_is_beaten_where_it_should_be():
+    # Greedy takes the 1.0 edge and blocks both 0.9 edges
+    rows, cols, weights = np.array([0, 0, 1]), np.array([0, 1, 0]), np.array([1.0, 0.9, 0.9])
+    assert weights[greedy_matching(rows.tolist(), cols.tolist(), weights)].sum() == pytest.approx(1.0)
+    assert weights[optimal_matching(rows, cols, weights)].sum() == pytest.approx(1.8)
+
+
+def test_edge_weights_and_sparsify():
+    weights = edge_weights([80, 80, 80], [1, 10, np.nan], urgency_weight=0.5)
+    assert weights.tolist() == pytest.approx([0.8, 1.2, 0.8])
+
+    recipients = np.array([1, 1, 1, 2, 2])
+    keep = sparsify(recipients, np.array([0.1, 0.9, 0.5, 0.3, 0.2]), max_per_recipient=2)
+    assert keep.tolist() == [False, True, True, True, True]
+
+
+def test_solve_allocation_per_organ():
+    donor_ids = [1, 1, 2, 2, 3, 3]
+    recipient_ids = [10, 11, 10, 11, 20, 21]
+    scores = [90, 85, 88, 40, 70, 95]
+    urgency = [1, 10, 1, 10, 5, 5]
+    groups = ['Kidney'] * 4 + ['Liver'] * 2
+    plan = solve_allocation(donor_ids, recipient_ids, scores, urgency, groups, min_score=50)
+
+    assert plan['optimal'] and plan['edges'] == 5
+    pairs = {(a['donor_id'], a['recipient_id']) for a in plan['assignments']}
+    # Donor 1 goes to the urgent recipient 11 so donor 2 can take recipient 10
+    assert pairs == {(1, 11), (2, 10), (3, 21)}
+    weights = [a['weight'] for a in plan['assignments']]
+    assert weights == sorted(weights, reverse=True)
+    assert plan['total_weight'] == pytest.approx(sum(weights), abs=1e-3)
+    assert {group['group']: group['assigned'] for group in plan['groups']} == {'Kidney': 2, 'Liver': 1}
+
+
+def test_solve_allocation_falls_back_to_greedy_without_budget():
+    graph = allocation.synthetic_graph(30, 60, edges_per_recipient=5, seed=1)
+    exact = solve_allocation(*graph)
+    greedy = solve_allocation(*graph, time_budget=0)
+
+    assert exact['optimal'] and not greedy['optimal']
+    assert {group['method'] for group in greedy['groups']} == {'greedy'}
+    assert greedy['total_weight'] <= exact['total_weight'] + 1e-6
+    for plan in (exact, greedy):
+        assert len({a['donor_id'] for a in plan['assignments']}) == len(plan['assignments'])
+        assert len({a['recipient_id'] for a in plan['assignments']}) == len(plan['assignments'])
+
+
+def test_allocation_endpoint_rejects_malformed_settings(app):
+    allocation.init_allocation(app)
+    response = app.test_client().get('/api/allocation?min_score=high')
+    assert response.status_code == 400
+    assert 'min_score' in response.get_json()['error']
@@ -0,0 +1,93 @@
+import glob
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_score
+from conftest import ROOT
+from ml.feature_store import FEATURE_COLUMNS
+
+SHIPPED_MODEL = os.path.join(ROOT, 'models', 'random_forest.joblib')
+
+
+@pytest.fixture
+def record_files(tmp_path):
+    paths = []
+    for kind in ('donors', 'recipients'):
+        frame = pd.read_csv(os.path.join(ROOT, 'data', f'{kind}_sample.csv'))
+        frame['gender'] = np.where(frame['id'] % 2, 'Male', 'Female')
+        path = tmp_path / f'{kind}.csv'
+        frame.to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['batch_score.py', *args])
+    return batch_score.main()
+
+
+def read_scores(output_dir):
+    frame = pd.concat(pd.read_csv(path) for path in glob.glob(os.path.join(output_dir, 'part-*.csv')))
+    return {(int(row.donor_id), int(row.recipient_id)): row.compatibility_score for row in frame.itertuples()}
+
+
+def test_vectorized_model_end_to_end(tmp_path, record_files, monkeypatch, capsys):
+    from sklearn.ensemble import RandomForestClassifier
+
+    store = batch_score.load_files(*record_files)
+    frames = [store.donor_features(int(donor_id))
+              for donor_id in store.donors.ids[store.donors.view()[0]]]
+    X = pd.concat([features for _, features in frames], ignore_index=True)
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, X['hla_match_score'] > 0.3)
+    model_path = str(tmp_path / 'model.joblib')
+    joblib.dump({'model': model, 'feature_columns': FEATURE_COLUMNS, 'model_params': {}}, model_path)
+
+    output = str(tmp_path / 'scores')
+    args = ['--donors', record_files[0], '--recipients', record_files[1], '--model', model_path,
+            '--format', 'csv', '--output', output, '--processes', '1', '--chunk-pairs', '4']
+    assert run_main(monkeypatch, *args) == 0
+
+    expected = {}
+    for donor_id in store.donors.ids[store.donors.view()[0]]:
+        recipient_ids, features = store.donor_features(int(donor_id), FEATURE_COLUMNS)
+        if len(recipient_ids):
+            scores = np.round(model.predict_proba(features)[:, 1] * 100, 2)
+            expected.update(((int(donor_id), int(r)), s) for r, s in zip(recipient_ids, scores))
+    assert read_scores(output) == pytest.approx(expected)
+
+    assert run_main(monkeypatch, *args) == 0
+    assert 'Already scored' in capsys.readouterr().out
+
+
+def test_shipped_model_needs_the_feature_pipeline(tmp_path, record_files, monkeypatch, capsys):
+    try:
+        import ml.feature_engineering  # noqa: F401
+        pytest.skip('ml.feature_engineering is installed')
+    except ImportError:
+        pass
+    output = str(tmp_path / 'scores')
+    assert run_main(monkeypatch, '--donors', record_files[0], '--recipients', record_files[1],
+                    '--model', SHIPPED_MODEL, '--format', 'csv', '--output', output) == 1
+    out = capsys.readouterr().out
+    assert 'combined_factor_score' in out and 'ml.feature_engineering is not installed' in out
+
+
+def test_shipped_model_end_to_end(tmp_path, record_files, monkeypatch):
+    create_features = pytest.importorskip('ml.feature_engineering').create_features
+    from ml.candidates import create_candidate_features_with_pairs
+
+    output = str(tmp_path / 'scores')
+    assert run_main(monkeypatch, '--donors', record_files[0], '--recipients', record_files[1],
+                    '--model', SHIPPED_MODEL, '--format', 'csv', '--output', output, '--processes', '1') == 0
+
+    artifact = joblib.load(SHIPPED_MODEL)
+    X, _, donor_ids, recipient_ids = create_candidate_features_with_pairs(
+        pd.read_csv(record_files[0]), pd.read_csv(record_files[1]), feature_fn=create_features
+    )
+    scores = np.round(artifact['model'].predict_proba(X[artifact['feature_columns']])[:, 1] * 100, 2)
+    assert read_scores(output) == pytest.approx(dict(zip(zip(donor_ids.tolist(), recipient_ids.tolist()), scores)))
@@ -0,0 +1,19 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from ml.compiled_forest import CompiledForest
+
+
+def test_predict_one_matches_sklearn(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 100, size=(500, 4))
+    y = (X[:, 0] + rng.normal(0, 10, 500) > X[:, 1]).astype(int)
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0).fit(X, y)
+
+    CompiledForest.from_model(model, ['a', 'b', 'c', 'd']).save(str(tmp_path))
+    compiled = CompiledForest.load(str(tmp_path), ['a', 'b', 'c', 'd'])
+
+    rows = rng.uniform(0, 100, size=(50, 4))
+    expected = model.predict_proba(rows)[:, 1]
+    assert [compiled.predict_one(row) for row in rows.tolist()] == list(expected)
+    assert compiled.predict_one(dict(zip('abcd', rows[0]))) == expected[0]
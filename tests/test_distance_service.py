@@ -0,0 +1,68 @@
+import io
+
+import pytest
+from sqlalchemy.orm import Session
+
+from conftest import make_donor, make_recipient
+from models import db, Donor, Recipient
+from ml import distance_service
+from ml.distance_service import geodesic_km, nearest_recipients, recipients_within
+
+
+@pytest.fixture
+def donor(app, monkeypatch):
+    monkeypatch.setattr(distance_service, '_indexes', {})
+    db.session.add_all([
+        make_donor(id=1, latitude=40.7, longitude=-74.0),
+        make_recipient(id=10, latitude=40.8, longitude=-74.1),
+        make_recipient(id=11, latitude=42.4, longitude=-71.1),
+        make_recipient(id=12, latitude=34.1, longitude=-118.2),
+        make_recipient(id=13, latitude=None, longitude=None),
+    ])
+    db.session.commit()
+    return db.session.get(Donor, 1)
+
+
+def test_radius_and_nearest_queries(donor):
+    assert [record_id for record_id, _ in recipients_within(donor, 400)] == [10, 11]
+    nearest = nearest_recipients(donor, k=2)
+    assert [record_id for record_id, _ in nearest] == [10, 11]
+    assert nearest[1][1] == pytest.approx(geodesic_km(40.7, -74.0, 42.4, -71.1))
+
+
+def test_index_follows_writes_from_other_sessions(donor):
+    assert [record_id for record_id, _ in recipients_within(donor, 400)] == [10, 11]
+
+    with Session(db.engine) as session:
+        session.get(Recipient, 12).latitude, session.get(Recipient, 12).longitude = 40.6, -73.9
+        session.get(Recipient, 13).latitude, session.get(Recipient, 13).longitude = 41.0, -74.0
+        session.delete(session.get(Recipient, 10))
+        session.commit()
+
+    assert sorted(record_id for record_id, _ in recipients_within(donor, 400)) == [11, 12, 13]
+
+
+def test_index_follows_bulk_ingestion(donor):
+    from ingestion import ingest_csv
+
+    recipients_within(donor, 400)
+    summary = ingest_csv(io.StringIO("name,organ_needed,latitude,longitude\nBulk,Kidney,40.71,-74.01\n"), Recipient)
+    assert recipients_within(donor, 5)[0][0] == summary['last_id']
+
+
+def test_exact_nearest_reranks_by_geodesic(app, monkeypatch):
+    monkeypatch.setattr(distance_service, '_indexes', {})
+    # On the sphere the northern recipient is slightly farther; on the ellipsoid it is nearer
+    db.session.add_all([
+        make_donor(id=1, latitude=0.0, longitude=0.0),
+        make_recipient(id=10, latitude=0.0, longitude=1.0),
+        make_recipient(id=11, latitude=1.003, longitude=0.0),
+        make_recipient(id=12, latitude=0.0, longitude=3.0),
+    ])
+    db.session.commit()
+    donor = db.session.get(Donor, 1)
+
+    assert [record_id for record_id, _ in nearest_recipients(donor, k=1, exact=False)] == [10]
+    [(record_id, distance)] = nearest_recipients(donor, k=1)
+    assert record_id == 11 and distance == pytest.approx(geodesic_km(0.0, 0.0, 1.003, 0.0))
+    assert [record_id for record_id, _ in nearest_recipients(donor, k=3)] == [11, 10, 12]
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import select
+
+from conftest import make_donor, make_recipient
+from models import db, Donor, Recipient
+from ml import feature_cache, model_registry, retrain_worker
+from ml.explanations import ExplanationService, init_explanations
+from ml.feature_cache import FeatureCache
+
+COLUMNS = ['age_difference', 'recipient_age']
+
+
+def age_features(donors_df, recipients_df):
+    """Stand-in for create_features: one recipient-major row per same-organ pair"""
+    rows = [(abs(donor.age - recipient.age), recipient.age)
+            for recipient in recipients_df.itertuples() for donor in donors_df.itertuples()
+            if donor.organ_type == recipient.organ_needed]
+    X = pd.DataFrame(rows, columns=COLUMNS, dtype=float)
+    return X, list((X['age_difference'] < 10).astype(int))
+
+
+class FakeModel:
+    classes_ = np.array([0, 1])
+
+    def predict_proba(self, X):
+        positive = 1 / (1 + np.asarray(X['age_difference'], dtype=float))
+        return np.column_stack([1 - positive, positive])
+
+
+class FakeExplainer:
+    expected_value = np.array([0.5, 0.5])
+
+    def __init__(self):
+        self.rows = []
+
+    def shap_values(self, X):
+        self.rows.append(X.values.tolist())
+        return np.stack([-X.values, X.values], axis=2)
+
+
+class FakeHandle:
+    def __init__(self, version='v1'):
+        self.version = version
+
+    def get(self):
+        return self.version, FakeModel(), COLUMNS
+
+
+@pytest.fixture
+def pairs(app):
+    donors = [make_donor(age=40), make_donor(age=60), make_donor(age=45, organ_type='Liver')]
+    recipients = [make_recipient(age=42), make_recipient(age=70)]
+    db.session.add_all(donors + recipients)
+    db.session.commit()
+    return [donor.id for donor in donors], [recipient.id for recipient in recipients]
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    """A service with a fake model and explainer, and an empty on-disk feature cache"""
+    monkeypatch.setattr(feature_cache, 'get_feature_cache', lambda: FeatureCache(str(tmp_path / 'features')))
+    service = ExplanationService(registry_handle=FakeHandle())
+    service.feature_fn = age_features
+    explainer = FakeExplainer()
+    monkeypatch.setattr(service, '_explainer_for', lambda version, model: explainer)
+    return service, explainer
+
+
+def test_on_demand_then_lru(pairs, service):
+    (d1, d2, liver), (r1, r2) = pairs
+    service, explainer = service
+    first = service.explain_pairs([(d1, r1), (d2, r2), (liver, r1)])
+    assert first[2] is None
+    assert [(e['donor_id'], e['recipient_id'], e['model_version']) for e in first[:2]] == [(d1, r1, 'v1'),
+                                                                                        (d2, r2, 'v1')]
+    assert first[0]['contributions'][0] == {'feature': 'recipient_age', 'value': 42.0, 'shap_value': 42.0}
+    assert first[0]['compatibility_percentage'] == round(100 / 3, 2)
+    assert explainer.rows == [[[2.0, 42.0], [10.0, 70.0]]]
+
+    assert service.explain(d1, r1) == first[0]
+    assert len(explainer.rows) == 1
+    assert (service.cache.hits, len(service.cache)) == (1, 2)
+
+
+def test_new_version_drops_old_explanations(pairs, service):
+    (d1, _, _), (r1, _) = pairs
+    service, explainer = service
+    service.explain(d1, r1)
+    service.handle.version = 'v2'
+    assert service.explain(d1, r1)['model_version'] == 'v2'
+    assert len(explainer.rows) == 2
+    assert len(service.cache) == 1
+
+
+def test_reads_current_rows_from_the_feature_cache(app, pairs, service, tmp_path):
+    (d1, d2, _), (r1, r2) = pairs
+    service, explainer = service
+    service.use_feature_cache = True
+    donors = pd.read_sql(select(Donor.id, Donor.organ_type, Donor.blood_group, Donor.age, Donor.updated_at),
+                         db.engine)
+    recipients = pd.read_sql(select(Recipient.id, Recipient.organ_needed, Recipient.blood_group, Recipient.age,
+                                    Recipient.updated_at), db.engine)
+    # Cached rows that differ from age_features, to tell where each row came from
+    FeatureCache(str(tmp_path / 'features')).sync(
+        donors, recipients, lambda d, r: (age_features(d, r)[0] + 1000, age_features(d, r)[1])
+    )
+    db.session.get(Recipient, r2).age = 71
+    db.session.commit()
+
+    explained = service.explain_pairs([(d1, r1), (d2, r2)])
+    assert [row for batch in explainer.rows for row in batch] == [[1002.0, 1042.0], [11.0, 71.0]]
+    assert [e['compatibility_percentage'] for e in explained] == [round(100 / 1003, 2), round(100 / 12, 2)]
+
+
+def test_missing_pipeline_is_503(app, pairs, monkeypatch, tmp_path):
+    (d1, _, _), (r1, _) = pairs
+    monkeypatch.setattr(feature_cache, 'get_feature_cache', lambda: FeatureCache(str(tmp_path / 'features')))
+
+    def missing():
+        raise RuntimeError("ml.feature_engineering is not installed")
+
+    monkeypatch.setattr(retrain_worker, 'default_feature_fn', missing)
+    monkeypatch.setattr(model_registry, '_publish_listeners', [])
+    service = init_explanations(app, precompute_top_k=0)
+    service.handle = FakeHandle()
+    monkeypatch.setattr(service, '_explainer_for', lambda version, model: FakeExplainer())
+
+    response = app.test_client().get(f'/api/explain?donor_id={d1}&recipient_id={r1}')
+    assert response.status_code == 503
+    assert response.get_json() == {'error': 'ml.feature_engineering is not installed'}
+
+
+def test_precompute_runs_on_publish_not_on_request(app, pairs, monkeypatch):
+    (d1, _, _), (r1, _) = pairs
+    monkeypatch.setattr(model_registry, '_publish_listeners', [])
+    service = init_explanations(app, precompute_top_k=3)
+    service.handle = FakeHandle()
+    scheduled = []
+    monkeypatch.setattr(service, 'schedule_precompute', lambda: scheduled.append(service.handle.version))
+    monkeypatch.setattr(service, '_compute', lambda version, model, columns, pairs: {})
+
+    service.explain(d1, r1)
+    assert scheduled == []
+    service.handle.version = 'v2'
+    model_registry.notify_published('v2')
+    assert scheduled == ['v2']
@@ -0,0 +1,180 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ml import feature_cache
+from ml.feature_cache import FeatureCache
+
+
+def age_features(donors_df, recipients_df):
+    """Stand-in for create_features: one recipient-major row per pair"""
+    rows = [(donor.age - recipient.age, recipient.age)
+            for recipient in recipients_df.itertuples() for donor in donors_df.itertuples()]
+    X = pd.DataFrame(rows, columns=['age_difference', 'recipient_age'], dtype=float)
+    return X, list((X['age_difference'].abs() < 10).astype(int))
+
+
+def _frames(n_donors=4, n_recipients=5):
+    stamp = pd.Timestamp('2026-01-01')
+    donors = pd.DataFrame({
+        'id': np.arange(1, n_donors + 1), 'organ_type': 'Kidney', 'blood_group': 'O-',
+        'age': 30 + 5 * np.arange(n_donors), 'updated_at': stamp,
+    })
+    recipients = pd.DataFrame({
+        'id': np.arange(101, 101 + n_recipients), 'organ_needed': 'Kidney', 'blood_group': 'A+',
+        'age': 28 + 7 * np.arange(n_recipients), 'updated_at': stamp,
+    })
+    return donors, recipients
+
+
+def _edit(frame, ids, **values):
+    frame = frame.copy()
+    rows = frame['id'].isin(ids)
+    for column, value in values.items():
+        frame.loc[rows, column] = value
+    frame.loc[rows, 'updated_at'] = frame.loc[rows, 'updated_at'] + pd.Timedelta(minutes=1)
+    return frame
+
+
+def _assert_features_match(matrix, donors, recipients):
+    """Every live row holds the features of its pair, and every pair has one live row"""
+    donor_ids, recipient_ids = matrix.pairs()
+    assert len(set(zip(donor_ids.tolist(), recipient_ids.tolist()))) == len(donor_ids) == len(donors) * len(recipients)
+    ages = {**dict(zip(donors['id'], donors['age'])), **dict(zip(recipients['id'], recipients['age']))}
+    X, y, _ = matrix.training_data()
+    expected = [ages[d] - ages[r] for d, r in zip(donor_ids.tolist(), recipient_ids.tolist())]
+    assert X['age_difference'].tolist() == expected
+    assert y.tolist() == [int(abs(value) < 10) for value in expected]
+
+
+def test_first_sync_then_unchanged(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    matrix, stats = cache.sync(donors, recipients, age_features)
+    assert stats == {'reused_pairs': 0, 'computed_pairs': 20}
+    assert (matrix.manifest['epoch'], matrix.generation, len(matrix)) == (0, 0, 20)
+    assert matrix.columns == ['age_difference', 'recipient_age']
+    _assert_features_match(matrix, donors, recipients)
+    assert matrix.matches(donors, recipients)
+
+    calls = []
+    matrix, stats = cache.sync(donors, recipients, lambda *frames: calls.append(frames))
+    assert stats == {'reused_pairs': 20, 'computed_pairs': 0}
+    assert matrix.generation == 0 and not calls
+
+
+def test_edits_and_additions_are_appended(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    before, _ = cache.sync(donors, recipients, age_features)
+
+    donors = _edit(donors, [2], age=70)
+    recipients = pd.concat([recipients, _frames(n_recipients=6)[1].tail(1)], ignore_index=True)
+    matrix, stats = cache.sync(donors, recipients, age_features)
+
+    # Donor 2 against all 6 recipients, plus the new recipient against the other 3 donors
+    assert stats == {'reused_pairs': 15, 'computed_pairs': 9}
+    assert (matrix.manifest['epoch'], matrix.generation) == (0, 1)
+    assert (matrix.manifest['n_rows'], len(matrix), matrix.appended_from) == (29, 24, 20)
+    _assert_features_match(matrix, donors, recipients)
+    _, _, new_rows = matrix.training_data()
+    assert new_rows.sum() == 9
+
+    # A reader still holding the previous generation keeps its snapshot
+    assert len(before) == 20 and before.frame(before.live_rows())['age_difference'].notna().all()
+    rows = before.fresh_pair_rows(np.array([1, 2]), np.array([101, 101]), donors, recipients)
+    assert rows[0] >= 0 and rows[1] == -1
+
+
+def test_deleted_records_are_masked(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    cache.sync(donors, recipients, age_features)
+
+    donors = donors[donors['id'] != 3]
+    matrix, stats = cache.sync(donors, recipients, age_features)
+    assert stats == {'reused_pairs': 15, 'computed_pairs': 0}
+    assert (matrix.manifest['epoch'], matrix.manifest['n_rows'], len(matrix)) == (0, 20, 15)
+    _assert_features_match(matrix, donors, recipients)
+    assert (matrix.pair_rows(np.array([3, 1]), np.array([101, 101])) >= 0).tolist() == [False, True]
+
+
+def test_mostly_dead_rows_start_a_new_epoch(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    cache.sync(donors, recipients, age_features)
+
+    donors = _edit(donors, [1, 2, 3, 4], age=60)
+    matrix, stats = cache.sync(donors, recipients, age_features)
+    # Exactly half the rows are live: still appended
+    assert (matrix.manifest['epoch'], matrix.manifest['n_rows'], len(matrix)) == (0, 40, 20)
+
+    donors = _edit(donors[donors['id'] != 4], [1], age=45)
+    matrix, stats = cache.sync(donors, recipients, age_features)
+    assert stats == {'reused_pairs': 10, 'computed_pairs': 5}
+    assert (matrix.manifest['epoch'], matrix.manifest['n_rows'], len(matrix), matrix.appended_from) == (1, 15, 15, 10)
+    _assert_features_match(matrix, donors, recipients)
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.bin')) == \
+        ['X-1.bin', 'donor_ids-1.bin', 'recipient_ids-1.bin', 'y-1.bin']
+
+
+def test_feature_version_bump_recomputes_everything(tmp_path, monkeypatch):
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    cache.sync(donors, recipients, age_features)
+
+    monkeypatch.setattr(feature_cache, 'FEATURE_VERSION', feature_cache.FEATURE_VERSION + 1)
+    matrix, stats = cache.sync(donors, recipients, age_features)
+    assert stats == {'reused_pairs': 0, 'computed_pairs': 20}
+    assert matrix.manifest['epoch'] == 1
+    _assert_features_match(matrix, donors, recipients)
+
+
+def test_interrupted_append_is_discarded(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    cache.sync(donors, recipients, age_features)
+
+    # A sync that crashed after writing rows but before committing the manifest
+    with open(tmp_path / 'X-0.bin', 'ab') as f:
+        f.write(np.ones((3, 2)).tobytes())
+    donors = _edit(donors, [4], age=41)
+    matrix, stats = cache.sync(donors, recipients, age_features)
+    assert stats['computed_pairs'] == 5 and matrix.manifest['n_rows'] == 25
+    assert os.path.getsize(tmp_path / 'X-0.bin') == 25 * 2 * 8
+    _assert_features_match(matrix, donors, recipients)
+
+
+def test_current_follows_syncs_from_another_cache(tmp_path):
+    reader, writer = FeatureCache(str(tmp_path)), FeatureCache(str(tmp_path))
+    assert reader.current() is None
+    donors, recipients = _frames()
+    writer.sync(donors, recipients, age_features)
+    first = reader.current()
+    assert first is reader.current() and first.generation == 0
+
+    writer.sync(_edit(donors, [1], age=33), recipients, age_features)
+    assert reader.current().generation == 1
+
+
+@pytest.mark.skipif(feature_cache.fcntl is None, reason='flock only')
+def test_sync_holds_the_cache_lock(tmp_path, monkeypatch):
+    import fcntl
+
+    cache = FeatureCache(str(tmp_path))
+    donors, recipients = _frames()
+    held = []
+
+    def checking_features(donors_df, recipients_df):
+        with open(tmp_path / '.lock', 'a+') as other:
+            try:
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                held.append(False)
+            except BlockingIOError:
+                held.append(True)
+        return age_features(donors_df, recipients_df)
+
+    cache.sync(donors, recipients, checking_features)
+    assert held and all(held)
@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import ROOT, make_donor, make_recipient
+from models import db, Donor, Recipient
+from ml import feature_store
+from ml.feature_store import FEATURE_COLUMNS, FeatureMismatchError, FeatureStore, missing_features
+
+SHIPPED_MODEL = os.path.join(ROOT, 'models', 'random_forest.joblib')
+
+
+def _load_store():
+    with db.engine.connect() as connection:
+        return FeatureStore().load(connection)
+
+
+def _features_by_recipient(store, donor_id):
+    recipient_ids, X = store.donor_features(donor_id)
+    return {int(recipient_id): row for recipient_id, (_, row) in zip(recipient_ids, X.iterrows())}
+
+
+@pytest.fixture
+def store(app):
+    db.session.add_all([
+        make_donor(id=1, gender=None),
+        make_donor(id=2, gender='Other', organ_type='Liver', blood_group='AB+', organ_storage_hours=3.0,
+                   diabetes=1, smoking=1, hla_typing=None),
+        make_recipient(id=10, gender=None),
+        make_recipient(id=11, gender='Other'),
+        make_recipient(id=12, gender='Male', blood_group='O+', hla_typing='a1,b8'),
+        make_recipient(id=13, gender='Female', blood_group='B-'),
+        make_recipient(id=14, gender='Other', organ_needed='Liver', blood_group='AB+', diabetes=1),
+        make_recipient(id=15, organ_needed='Liver', blood_group='A+'),
+    ])
+    db.session.commit()
+    return _load_store()
+
+
+def test_gender_compatibility_is_plain_equality(store):
+    features = _features_by_recipient(store, 1)
+    assert features[10]['gender_compatible'] == 0.8  # None == None
+    assert features[11]['gender_compatible'] == 0.6
+    assert features[12]['gender_compatible'] == 0.6
+    assert _features_by_recipient(store, 2)[14]['gender_compatible'] == 0.8  # 'Other' == 'Other'
+
+
+def test_eligible_recipients_follow_organ_and_abo_rules(store):
+    assert set(_features_by_recipient(store, 1)) == {10, 11, 12}  # O+ cannot donate to B-
+    assert set(_features_by_recipient(store, 2)) == {14}
+
+
+def test_pair_features_match_documented_formulas(store):
+    features = _features_by_recipient(store, 1)
+    assert features[12]['hla_match_score'] == pytest.approx(2 / 3)
+    assert features[10]['organ_freshness_score'] == pytest.approx((1 - 6 / 36) * 100)
+    assert features[10]['age_difference'] == 10
+    assert features[10]['organ_size_difference'] == pytest.approx(0.5)
+    assert features[10]['recipient_medical_risk'] == 0.25
+    assert features[12]['blood_group_compatible'] == 1.0
+    assert features[10]['gps_distance_km'] == pytest.approx(1145, rel=0.01)
+
+    liver = _features_by_recipient(store, 2)[14]
+    assert liver['organ_freshness_score'] == pytest.approx(75.0)
+    assert liver['donor_medical_risk'] == 0.5
+    assert list(store.donor_features(2)[1].columns) == FEATURE_COLUMNS
+
+
+def test_store_matches_create_features(store):
+    create_features = pytest.importorskip('ml.feature_engineering').create_features
+    # pandas turns None into NaN in a column that also holds strings, which
+    # create_features then compares unequal; keep genders set for parity
+    for record in (*Donor.query, *Recipient.query):
+        record.gender = record.gender or 'Female'
+    db.session.commit()
+    differences = feature_store.check_parity(db.engine.url.render_as_string(hide_password=False),
+                                             feature_fn=create_features)
+    distance = differences.pop('gps_distance_km', 0.0)
+    assert distance < 0.01 * 1200
+    assert differences and max(differences.values()) < 1e-9
+
+
+@pytest.fixture
+def shipped_registry(tmp_path, monkeypatch):
+    """The shipped model artifact published to a temporary registry"""
+    import joblib
+    from ml import model_registry
+
+    artifact = joblib.load(SHIPPED_MODEL)
+    registry_dir = str(tmp_path / 'registry')
+    model_registry.publish(artifact['model'], artifact['feature_columns'], artifact['model_params'],
+                           registry_dir=registry_dir, legacy_path=None)
+    monkeypatch.setitem(model_registry._handles, model_registry.DEFAULT_REGISTRY_DIR,
+                        model_registry.ModelHandle(registry_dir))
+    return artifact
+
+
+def test_shipped_model_needs_features_beyond_the_store(shipped_registry):
+    missing = missing_features(shipped_registry['feature_columns'])
+    assert missing and 'combined_factor_score' in missing
+
+
+def test_score_donor_with_shipped_model(app, store, shipped_registry, monkeypatch):
+    monkeypatch.setattr(feature_store, '_store', store)
+    try:
+        import ml.predict_model  # noqa: F401
+    except ImportError:
+        with pytest.raises(FeatureMismatchError, match='combined_factor_score'):
+            store.score_donor(1)
+
+        feature_store.init_feature_store(app)
+        response = app.test_client().get('/api/donors/1/scores')
+        assert response.status_code == 503
+        assert 'cannot compute' in response.get_json()['error']
+        return
+
+    ranked = store.score_donor(1)
+    assert {match['recipient_id'] for match in ranked} == {10, 11, 12}
+    scores = [match['compatibility_percentage'] for match in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_score_donor_with_store_features(app, store, tmp_path, monkeypatch):
+    from sklearn.ensemble import RandomForestClassifier
+    from ml import model_registry
+
+    recipient_ids, X = store.donor_features(1)
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, [1, 0, 1])
+    registry_dir = str(tmp_path / 'registry')
+    model_registry.publish(model, FEATURE_COLUMNS, registry_dir=registry_dir, legacy_path=None)
+    monkeypatch.setitem(model_registry._handles, model_registry.DEFAULT_REGISTRY_DIR,
+                        model_registry.ModelHandle(registry_dir))
+
+    ranked = store.score_donor(1, top_n=2)
+    expected = model.predict_proba(X)[:, 1] * 100
+    best = np.argsort(-expected, kind='stable')[:2]
+    assert [match['recipient_id'] for match in ranked] == [int(recipient_ids[i]) for i in best]
+    assert [match['compatibility_percentage'] for match in ranked] == [round(float(expected[i]), 2) for i in best]
+
+
+def test_store_follows_writes_from_other_sessions(store, monkeypatch):
+    from sqlalchemy.orm import Session
+
+    monkeypatch.setattr(feature_store, '_store', None)
+    assert set(_features_by_recipient(feature_store.get_feature_store(), 1)) == {10, 11, 12}
+
+    # Another worker: its own session, none of this process's caches involved
+    with Session(db.engine) as session:
+        session.add(make_recipient(id=20, gender=None, blood_group='O+'))
+        session.get(Recipient, 11).gender = None
+        session.delete(session.get(Recipient, 12))
+        session.commit()
+
+    features = _features_by_recipient(feature_store.get_feature_store(), 1)
+    assert set(features) == {10, 11, 20}
+    assert features[11]['gender_compatible'] == 0.8
+    with db.engine.connect() as connection:
+        assert feature_store.get_feature_store().refresh(connection) is False
+
+
+def test_store_follows_bulk_ingestion(store, monkeypatch):
+    import io
+    from ingestion import ingest_csv
+
+    monkeypatch.setattr(feature_store, '_store', None)
+    feature_store.get_feature_store()
+    summary = ingest_csv(io.StringIO("name,organ_needed,blood_group,age,latitude,longitude\n"
+                                     "Bulk,Kidney,O+,30,40.7,-74.0\n"), Recipient)
+    features = _features_by_recipient(feature_store.get_feature_store(), 1)
+    assert summary['last_id'] in features
+    assert features[summary['last_id']]['gps_distance_km'] == pytest.approx(0.0, abs=1e-6)
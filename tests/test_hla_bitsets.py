@@ -0,0 +1,30 @@
+import numpy as np
+
+from conftest import make_donor, make_recipient
+from models import db, Donor, Recipient
+from ml.hla_bitsets import bits_to_matrix, hla_match_counts, hla_match_scores, popcount
+
+
+def _typing_score(donor_typing, recipient_typing):
+    donor = {allele.strip() for allele in donor_typing.split(',')} if donor_typing else set()
+    recipient = {allele.strip() for allele in recipient_typing.split(',')} if recipient_typing else set()
+    return len(donor & recipient) / len(donor) if donor else 0.5
+
+
+def test_match_scores_from_stored_bitsets(app):
+    donor_typings = ['A1, B8, DR3', 'A2, B7, DR4, DR52', None]
+    recipient_typings = ['A1, B7, DR4', 'a2,b7 , dr52', 'A1, B8, DR3', None]
+    db.session.add_all(make_donor(hla_typing=typing) for typing in donor_typings)
+    db.session.add_all(make_recipient(hla_typing=typing) for typing in recipient_typings)
+    db.session.commit()
+
+    donors = bits_to_matrix([donor.hla_bits for donor in Donor.query.order_by(Donor.id)])
+    recipients = bits_to_matrix([recipient.hla_bits for recipient in Recipient.query.order_by(Recipient.id)],
+                                n_bytes=donors.shape[1])
+    assert donors.shape[1] == recipients.shape[1]
+    assert popcount(donors).tolist() == [3, 4, 0]
+
+    expected = [[_typing_score(d, r.upper().replace(' ', '') if r else r) for r in recipient_typings]
+                for d in donor_typings]
+    assert np.allclose(hla_match_scores(donors, recipients), expected)
+    assert hla_match_counts(donors, recipients)[1].tolist() == [2, 3, 0, 0]
@@ -0,0 +1,119 @@
+import io
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from ingestion import PartialIngestError, ingest_csv, validate_chunk
+from models import db, Donor, Recipient
+
+
+def _chunk(csv):
+    return pd.read_csv(io.StringIO(csv), dtype=str, keep_default_na=False)
+
+
+def test_validate_chunk_rejects_bad_rows():
+    records, rejected = validate_chunk(_chunk(
+        "name,organ_needed,age,urgency_level,latitude,blood_group,diabetes\n"
+        "Ok,Kidney,30,3.0,40.7,a+,1\n"
+        "Half,Kidney,30.5,3,40.7,A+,0\n"
+        "Fraction,Kidney,30,2.7,40.7,A+,0\n"
+        "North,Kidney,30,3,95,A+,0\n"
+        "Rare,Kidney,30,3,40.7,C+,0\n"
+        ",Kidney,30,3,40.7,A+,0\n"
+        "Flag,Kidney,30,3,40.7,A+,2\n"
+        "Text,Kidney,thirty,3,40.7,A+,0\n"
+    ), Recipient)
+
+    assert records['name'].tolist() == ['Ok']
+    assert records.iloc[0][['age', 'urgency_level', 'blood_group']].tolist() == [30, 3, 'A+']
+    assert rejected.set_index('name')['error'].to_dict() == {
+        'Half': 'age must be a whole number',
+        'Fraction': 'urgency_level must be a whole number',
+        'North': 'latitude out of range',
+        'Rare': 'unknown blood_group',
+        '': 'missing name',
+        'Flag': 'diabetes must be 0 or 1',
+        'Text': 'invalid age',
+    }
+
+
+def test_ingest_csv_inserts_valid_rows_and_reports_rejects(app, tmp_path):
+    completed = []
+    summary = ingest_csv(io.StringIO(
+        "name,organ_type,age,blood_group,hla_typing\n"
+        "Alpha,Kidney,40,O+,\"A1, B8\"\n"
+        "Beta,Liver,41.5,A+,\n"
+        "Gamma,Heart,42,B-,A2\n"
+    ), Donor, chunk_size=2, error_path=str(tmp_path / 'rejected.csv'), on_complete=completed.append)
+
+    assert (summary['inserted'], summary['rejected'], summary['chunks']) == (2, 1, 2)
+    assert [donor.name for donor in Donor.query.order_by(Donor.id)] == ['Alpha', 'Gamma']
+    assert Donor.query.filter_by(name='Alpha').one().hla_bits is not None
+    assert pd.read_csv(summary['error_file'])['error'].tolist() == ['age must be a whole number']
+    assert completed == [summary]
+
+
+def test_failed_chunk_keeps_committed_rows_and_still_completes(app):
+    completed = []
+    with pytest.raises(PartialIngestError) as excinfo:
+        ingest_csv(io.StringIO(
+            "id,name,organ_needed\n"
+            "1,First,Kidney\n"
+            "1,Duplicate,Kidney\n"
+        ), Recipient, chunk_size=1, preserve_ids=True, on_complete=completed.append)
+
+    summary = excinfo.value.summary
+    assert summary['inserted'] == 1 and 'error' in summary
+    assert completed == [summary]
+    assert [recipient.name for recipient in Recipient.query] == ['First']
+
+
+def test_failure_before_any_commit_raises_the_original_error(app):
+    completed = []
+    db.session.add(Recipient(id=1, name='Existing', organ_needed='Kidney'))
+    db.session.commit()
+    with pytest.raises(Exception) as excinfo:
+        ingest_csv(io.StringIO("id,name,organ_needed\n1,Clash,Kidney\n"), Recipient, preserve_ids=True,
+                   on_complete=completed.append)
+    assert not isinstance(excinfo.value, PartialIngestError)
+    assert completed == []
+
+
+def test_id_range_spans_every_chunk_with_preserved_ids(app):
+    summary = ingest_csv(io.StringIO(
+        "id,name,organ_needed\n"
+        "50,Middle,Kidney\n"
+        "90,High,Kidney\n"
+        "7,Low,Liver\n"
+    ), Recipient, chunk_size=1, preserve_ids=True)
+    assert (summary['first_id'], summary['last_id']) == (7, 90)
+
+
+def test_copy_path_reports_the_ids_it_inserted(app, monkeypatch):
+    executed = []
+
+    class Cursor:
+        def execute(self, sql):
+            executed.append(sql)
+
+        def copy_expert(self, sql, buffer):
+            executed.append(sql)
+            self.copied = buffer.read()
+
+        def fetchall(self):
+            return [(12,), (4,)]
+
+    cursor = Cursor()
+    # Stands in for the session's connection down to the psycopg2 cursor
+    connection = SimpleNamespace(connection=SimpleNamespace(dbapi_connection=SimpleNamespace(cursor=lambda: cursor)))
+    monkeypatch.setattr('ingestion._use_copy', lambda connection: True)
+    monkeypatch.setattr(db.session, 'connection', lambda: connection)
+    monkeypatch.setattr('ingestion.encode_hla_typing', lambda connection, typing: None)
+    summary = ingest_csv(io.StringIO("name,organ_needed\nA,Kidney\nB,Liver\n"), Recipient)
+
+    assert (summary['inserted'], summary['first_id'], summary['last_id']) == (2, 4, 12)
+    create, copy, move = executed
+    assert create.startswith('CREATE TEMP TABLE recipients_staging ON COMMIT DROP AS SELECT')
+    assert copy.startswith('COPY recipients_staging (')
+    assert move.startswith('INSERT INTO recipients (') and move.endswith('FROM recipients_staging RETURNING id')
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db, SystemLog
+from log_sink import LogSink, decode_cursor, encode_cursor, logs, logs_page
+
+
+def _add(*timestamps, level='info'):
+    with db.engine.begin() as connection:
+        connection.execute(insert(logs), [
+            {'timestamp': timestamp, 'level': level, 'message': f'entry {i}', 'category': 'general'}
+            for i, timestamp in enumerate(timestamps)
+        ])
+
+
+def test_cursor_round_trip(app):
+    stamp = datetime(2026, 3, 4, 5, 6, 7, 89)
+    entry = SystemLog(id=42, timestamp=stamp, level='info', message='x')
+    assert encode_cursor(entry) == '20260304050607000089-42'
+    assert decode_cursor(encode_cursor(entry)) == (stamp, 42)
+
+
+@pytest.mark.parametrize('cursor', ['', 'garbage', '20260304050607000089', '20260304-42', '20260304050607000089-x'])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_cover_every_entry_once(app):
+    start = datetime(2026, 1, 1)
+    # Shared timestamps straddle page boundaries, so the id tie-break matters
+    _add(*(start + timedelta(seconds=i // 3) for i in range(10)))
+
+    seen, cursor = [], None
+    while True:
+        entries, cursor = logs_page(cursor=cursor, limit=4)
+        seen.extend((entry.timestamp, entry.id) for entry in entries)
+        if cursor is None:
+            break
+        assert decode_cursor(cursor) == seen[-1]
+    assert seen == sorted(seen, reverse=True) and len(set(seen)) == 10
+
+
+def test_level_filter_pages(app):
+    start = datetime(2026, 1, 1)
+    _add(*(start + timedelta(seconds=i) for i in range(3)), level='error')
+    _add(*(start + timedelta(seconds=i) for i in range(3)), level='info')
+    entries, cursor = logs_page(limit=2, level='error')
+    more, last = logs_page(cursor=cursor, limit=2, level='error')
+    assert [entry.level for entry in entries + more] == ['error'] * 3 and last is None
+
+
+def test_sink_writes_timestamps_and_rejects_missing_ones(app):
+    sink = LogSink(db.engine, flush_interval=60, retention_days=0)
+    sink.log('queued', level='success', category='ml')
+    sink.flush()
+    [entry], _ = logs_page()
+    assert (entry.message, entry.level, entry.category) == ('queued', 'success', 'ml')
+    assert entry.timestamp is not None
+
+    with pytest.raises(IntegrityError):
+        _add(None)
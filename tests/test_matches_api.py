@@ -0,0 +1,35 @@
+import pytest
+
+from conftest import make_donor, make_recipient
+from matches_api import init_matches_api
+from models import db, PairScore
+
+
+@pytest.fixture
+def client(app):
+    db.session.add_all([make_donor(id=1), make_recipient(id=10), make_recipient(id=11)])
+    db.session.add_all([
+        PairScore(donor_id=1, recipient_id=10, model_version='v1', compatibility_score=91.5),
+        PairScore(donor_id=1, recipient_id=11, model_version='v1', compatibility_score=42.0),
+    ])
+    db.session.commit()
+    init_matches_api(app)
+    return app.test_client()
+
+
+@pytest.mark.parametrize('query', [
+    'min_score=high', 'min_score=nan', 'recipient_id=1.5', 'donor_id=abc', 'limit=ten',
+])
+def test_malformed_numbers_are_rejected(client, query):
+    response = client.get(f'/api/matches?model_version=v1&{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid ')
+
+
+def test_numeric_filters_apply(client):
+    response = client.get('/api/matches?model_version=v1&min_score=50&limit=10')
+    assert response.status_code == 200
+    assert [match['recipient_id'] for match in response.get_json()['matches']] == [10]
+
+    response = client.get('/api/matches?model_version=v1&recipient_id=11&min_score=')
+    assert [match['recipient_id'] for match in response.get_json()['matches']] == [11]
@@ -0,0 +1,90 @@
+from sqlalchemy import create_engine, insert, select
+
+import models
+from conftest import make_donor
+from models import db, DATA_VERSION_NAME, DataVersion, Donor, HLAAllele
+
+
+def _version():
+    row = db.session.get(DataVersion, DATA_VERSION_NAME)
+    return row.version if row is not None else 0
+
+
+def test_data_version_table_created_after_start(app, monkeypatch):
+    monkeypatch.setattr(models, '_data_version_tables', {})
+    DataVersion.__table__.drop(db.engine)
+
+    db.session.add(make_donor())
+    db.session.commit()
+    assert not models._has_data_version_table(db.session.connection())
+    db.session.commit()
+
+    # `init_db.py --upgrade` run while this worker is up
+    DataVersion.__table__.create(db.engine)
+    db.session.add(make_donor())
+    db.session.commit()
+    assert _version() == 1
+    assert models.data_version_token(db.session.connection()) == 1
+
+
+def _allele_ids():
+    return dict(db.session.execute(select(HLAAllele.name, HLAAllele.id)).all())
+
+
+def _bits(donor_id):
+    return int.from_bytes(db.session.get(Donor, donor_id).hla_bits, 'little')
+
+
+def _mask(ids):
+    return sum(1 << (allele_id - 1) for allele_id in ids)
+
+
+def test_rolled_back_alleles_are_not_cached(app):
+    db.session.add(make_donor(hla_typing='A1, B8, DR3'))
+    db.session.flush()
+    db.session.rollback()
+    assert models._hla_allele_ids == {}
+
+    # Another worker registers an allele, possibly reusing the rolled-back ids
+    other = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    with other.begin() as connection:
+        connection.execute(insert(HLAAllele.__table__).values(name='DR4'))
+    other.dispose()
+
+    donor = make_donor(hla_typing='A1, B8, DR3')
+    db.session.add(donor)
+    db.session.commit()
+    ids = _allele_ids()
+    assert len(set(ids.values())) == 4
+    assert models._hla_allele_ids == {name: ids[name] for name in ('A1', 'B8', 'DR3')}
+    assert _bits(donor.id) == _mask(ids[name] for name in ('A1', 'B8', 'DR3'))
+
+
+def test_savepoint_rollback_discards_its_alleles(app):
+    kept = make_donor(hla_typing='A1, B8')
+    db.session.add(kept)
+    db.session.flush()
+    nested = db.session.begin_nested()
+    db.session.add(make_donor(hla_typing='A2, DR52'))
+    db.session.flush()
+    nested.rollback()
+    db.session.commit()
+
+    ids = _allele_ids()
+    assert set(ids) == {'A1', 'B8'}
+    assert models._hla_allele_ids == ids
+    assert _bits(kept.id) == _mask(ids.values())
+
+
+def test_alleles_registered_by_another_worker_are_reused(app):
+    other = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    with other.begin() as connection:
+        connection.execute(insert(HLAAllele.__table__), [{'name': 'B8'}, {'name': 'A1'}])
+    other.dispose()
+
+    donor = make_donor(hla_typing='A1, B8, DR3')
+    db.session.add(donor)
+    db.session.commit()
+    ids = _allele_ids()
+    assert (ids['B8'], ids['A1']) == (1, 2)
+    assert _bits(donor.id) == _mask(ids.values())
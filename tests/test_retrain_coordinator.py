@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from models import db
+from ml import model_registry, retrain_coordinator
+from ml.retrain_coordinator import RetrainCoordinator, jobs
+
+
+class FakeTimer:
+    def __init__(self, interval, function):
+        self.function = function
+        self.daemon = False
+
+    def start(self):
+        pass
+
+
+@pytest.fixture
+def workers(app, monkeypatch):
+    """Two coordinators standing in for two gunicorn workers; starts are recorded, not run"""
+    monkeypatch.setattr(retrain_coordinator.threading, 'Timer', FakeTimer)
+    monkeypatch.setattr(model_registry, 'current_version', lambda: 'v2')
+    started = []
+    monkeypatch.setattr(RetrainCoordinator, '_start',
+                        lambda self, job_id, incremental: started.append((self.owner, job_id, incremental)))
+    pair = []
+    for name in ('worker-1', 'worker-2'):
+        coordinator = RetrainCoordinator(db.engine, database_uri='sqlite://', debounce_seconds=0, status_ttl=0)
+        coordinator.owner = name
+        pair.append(coordinator)
+    return pair, started
+
+
+def _jobs():
+    with db.engine.connect() as connection:
+        return connection.execute(select(jobs).order_by(jobs.c.id)).mappings().all()
+
+
+def _expire_lease():
+    with db.engine.begin() as connection:
+        connection.execute(update(jobs).where(jobs.c.status == 'running')
+                           .values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+
+
+def test_requests_fold_into_one_pending_job(workers):
+    (first, second), _ = workers
+    assert first.request(incremental=True) == 'queued'
+    assert second.request(incremental=True) == 'coalesced'
+    [job] = _jobs()
+    assert (job['requests'], job['incremental'], job['pending_slot']) == (2, True, 1)
+
+    assert first.request() == 'coalesced'
+    [job] = _jobs()
+    assert (job['requests'], job['incremental']) == (3, False)
+
+
+def test_only_one_worker_trains(workers):
+    (first, second), started = workers
+    first.request()
+    job_id = first.try_claim()
+    assert job_id is not None and second.try_claim() is None
+    assert started == [('worker-1', job_id, False)]
+
+    # A request during training waits as the next job, not a second trainer
+    second.request(incremental=True)
+    assert second.try_claim() is None and first.try_claim() is None
+    assert [job['status'] for job in _jobs()] == ['running', 'pending']
+    status = second.status()
+    assert status['in_progress'] and status['pending'] and status['pending_requests'] == 1
+
+
+def test_finished_job_frees_the_slot_and_starts_the_next(workers):
+    (first, second), started = workers
+    first.request()
+    job_id = first.try_claim()
+    second.request(incremental=True)
+
+    first._finish(job_id, retrain_coordinator.threading.Event(),
+                  {'status': 'success', 'message': 'Model retrained', 'duration': 1.5})
+    finished, running = _jobs()
+    assert (finished['status'], finished['running_slot'], finished['model_version']) == ('succeeded', None, 'v2')
+    assert (running['status'], running['lease_owner']) == ('running', 'worker-1')
+    assert started[-1] == ('worker-1', running['id'], True)
+
+    status = second.status()
+    assert status['model_version'] == 'v2' and second.finished_since(None)['last_job_id'] == job_id
+    assert second.finished_since(job_id) is None
+
+
+def test_expired_lease_is_taken_over(workers):
+    (first, second), started = workers
+    first.request()
+    job_id = first.try_claim()
+    second.request()
+    _expire_lease()
+
+    # The next status() poll in any worker notices the dead trainer
+    second.status()
+    dead, taken_over = _jobs()
+    assert (dead['id'], dead['status'], dead['message']) == (job_id, 'failed', 'Trainer stopped renewing its lease')
+    assert (taken_over['status'], taken_over['lease_owner']) == ('running', 'worker-2')
+    assert started[-1] == ('worker-2', taken_over['id'], False)
+
+    # The old trainer finishing late does not overwrite the new one's lease
+    first._finish(taken_over['id'], retrain_coordinator.threading.Event(), {'status': 'success'})
+    assert _jobs()[1]['status'] == 'running'
+
+
+def test_lease_renewal_survives_database_errors(workers, monkeypatch):
+    (first, _), _ = workers
+    first.request()
+    job_id = first.try_claim()
+    first.lease = timedelta(seconds=0.03)
+
+    failures = []
+    real_begin = db.engine.begin
+
+    def flaky_begin():
+        if not failures:
+            failures.append(True)
+            raise retrain_coordinator.OperationalError('UPDATE', {}, Exception('database is locked'))
+        return real_begin()
+
+    monkeypatch.setattr(first, 'engine', type('Engine', (), {'begin': staticmethod(flaky_begin)})())
+    stop = retrain_coordinator.threading.Event()
+    renewer = retrain_coordinator.threading.Thread(target=first._renew_lease, args=(job_id, stop))
+    _expire_lease()
+    before = datetime.utcnow()
+    renewer.start()
+    renewer.join(0.2)
+    stop.set()
+    renewer.join()
+    assert failures and _jobs()[0]['lease_expires_at'] > before
+
+
+def test_late_finish_does_not_revive_a_failed_job(workers):
+    (first, second), _ = workers
+    first.request()
+    job_id = first.try_claim()
+    _expire_lease()
+    second.status()
+
+    first._finish(job_id, retrain_coordinator.threading.Event(), {'status': 'success', 'message': 'done'})
+    [job] = _jobs()
+    assert (job['status'], job['message'], job['model_version']) == ('failed', 'Trainer stopped renewing its lease',
+                                                                     None)
+
+
+@pytest.mark.parametrize('fails', [False, True])
+def test_lease_renewal_starts_once_the_retrain_is_queued(app, monkeypatch, fails):
+    from ml import retrain_worker
+
+    monkeypatch.setattr(retrain_coordinator.threading, 'Timer', FakeTimer)
+    calls = []
+
+    def submit_retrain(*args, **kwargs):
+        calls.append('submit')
+        if fails:
+            raise RuntimeError('cannot spawn the worker process')
+        return 'started'
+
+    monkeypatch.setattr(retrain_worker, 'submit_retrain', submit_retrain)
+    monkeypatch.setattr(RetrainCoordinator, '_renew_lease', lambda self, job_id, stop: calls.append('renew'))
+    coordinator = RetrainCoordinator(db.engine, database_uri='sqlite://', debounce_seconds=0, status_ttl=0)
+    coordinator.request()
+    job_id = coordinator.try_claim()
+
+    [job] = _jobs()
+    if fails:
+        assert calls == ['submit']
+        assert (job['status'], job['running_slot'], job['message']) == (
+            'failed', None, 'Could not start the retrain: cannot spawn the worker process')
+    else:
+        assert calls[0] == 'submit' and (job['id'], job['status']) == (job_id, 'running')
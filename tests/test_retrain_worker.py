@@ -0,0 +1,148 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from conftest import make_donor, make_recipient
+from models import db
+from ml import model_registry, retrain_worker
+
+
+def age_features(donors_df, recipients_df):
+    """Stand-in for create_features: one recipient-major row per pair"""
+    rows = [(abs(donor.age - recipient.age), recipient.urgency_level)
+            for recipient in recipients_df.itertuples() for donor in donors_df.itertuples()]
+    X = pd.DataFrame(rows, columns=['age_difference', 'urgency_level'], dtype=float)
+    return X, list((X['age_difference'] < 15).astype(int))
+
+
+def test_model_config_defaults_and_overrides(tmp_path):
+    assert retrain_worker.load_model_config(str(tmp_path / 'missing.json')) == retrain_worker.DEFAULT_MODEL_CONFIG
+
+    path = tmp_path / 'model_config.json'
+    path.write_text(json.dumps({'n_estimators': 7}))
+    assert retrain_worker.load_model_config(str(path)) == {**retrain_worker.DEFAULT_MODEL_CONFIG, 'n_estimators': 7}
+
+
+def test_coalesced_requests_all_get_their_callback(monkeypatch):
+    release = threading.Event()
+    jobs = []
+
+    def run_retrain(*job):
+        jobs.append(job)
+        release.wait(5)
+        return {'status': 'success', 'message': f'run {len(jobs)}'}
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(retrain_worker, '_get_executor', lambda: executor)
+    monkeypatch.setattr(retrain_worker, 'run_retrain', run_retrain)
+    monkeypatch.setattr(retrain_worker, 'observe_retrain', lambda result: None)
+
+    results = {}
+    finished = threading.Event()
+
+    def callback(name):
+        def on_done(result):
+            results[name] = result['message']
+            if len(results) == 3:
+                finished.set()
+        return on_done
+
+    assert retrain_worker.submit_retrain('sqlite://', incremental=True, on_done=callback('first')) == 'started'
+    assert retrain_worker.submit_retrain('sqlite://', incremental=True, on_done=callback('second')) == 'pending'
+    assert retrain_worker.submit_retrain('sqlite://', incremental=False, on_done=callback('third')) == 'pending'
+    release.set()
+    assert finished.wait(5)
+    executor.shutdown()
+
+    assert results == {'first': 'run 1', 'second': 'run 2', 'third': 'run 2'}
+    # A full retrain request wins over the incremental one it was coalesced with
+    assert [job[3] for job in jobs] == [True, False]
+    assert not retrain_worker.is_retraining()
+
+
+def _add_records(donor_ages, recipient_ages):
+    db.session.add_all(make_donor(age=age) for age in donor_ages)
+    db.session.add_all(make_recipient(age=age, urgency_level=1 + age % 5) for age in recipient_ages)
+    db.session.commit()
+
+
+def test_run_retrain_full_then_incremental(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _add_records([25, 40, 55, 70], [22, 30, 45, 50, 62, 75])
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    model_path = str(tmp_path / 'model.joblib')
+    cache_path = str(tmp_path / 'cache')
+
+    result = retrain_worker.run_retrain(uri, model_path, cache_path, n_jobs=1, feature_fn=age_features)
+    assert result['status'] == 'success', result['message']
+    assert (result['mode'], result['computed_pairs'], result['reused_pairs']) == ('full', 24, 0)
+
+    db.session.add(make_donor(age=48))
+    db.session.commit()
+    result = retrain_worker.run_retrain(uri, model_path, cache_path, incremental=True, n_jobs=1,
+                                        feature_fn=age_features)
+    assert result['status'] == 'success', result['message']
+    assert (result['computed_pairs'], result['reused_pairs'], result['samples']) == (6, 24, 30)
+
+    import joblib
+    artifact = joblib.load(model_path)
+    assert artifact['feature_columns'] == ['age_difference', 'urgency_level']
+
+
+def test_run_retrain_reports_missing_feature_pipeline(app, tmp_path):
+    try:
+        import ml.feature_engineering  # noqa: F401
+        pytest.skip('ml.feature_engineering is installed')
+    except ImportError:
+        pass
+    _add_records([40], [45, 50])
+    result = retrain_worker.run_retrain(app.config['SQLALCHEMY_DATABASE_URI'], str(tmp_path / 'model.joblib'),
+                                        str(tmp_path / 'cache'))
+    assert result['status'] == 'error'
+    assert 'ml.feature_engineering is not installed' in result['message']
+
+
+def test_failing_callback_does_not_block_later_retrains(monkeypatch, capsys):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(retrain_worker, '_get_executor', lambda: executor)
+    monkeypatch.setattr(retrain_worker, 'run_retrain', lambda *job: {'status': 'success', 'message': 'done'})
+    monkeypatch.setattr(retrain_worker, 'observe_retrain', lambda result: None)
+
+    first_done = threading.Event()
+
+    def failing(result):
+        first_done.set()
+        raise RuntimeError('database is locked')
+
+    assert retrain_worker.submit_retrain('sqlite://', on_done=failing) == 'started'
+    assert first_done.wait(5)
+    executor.shutdown(wait=True)
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    second_done = threading.Event()
+    assert retrain_worker.submit_retrain('sqlite://', on_done=lambda result: second_done.set()) == 'started'
+    assert second_done.wait(5)
+    executor.shutdown()
+    assert 'Retrain callback failed: database is locked' in capsys.readouterr().out
+
+
+def test_successful_retrain_announces_the_published_version(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    results = iter([{'status': 'success', 'message': 'done'}, {'status': 'error', 'message': 'failed'}])
+    monkeypatch.setattr(retrain_worker, '_get_executor', lambda: executor)
+    monkeypatch.setattr(retrain_worker, 'run_retrain', lambda *job: next(results))
+    monkeypatch.setattr(retrain_worker, 'observe_retrain', lambda result: None)
+    monkeypatch.setattr(retrain_worker, 'current_version', lambda: 'v7')
+    monkeypatch.setattr(model_registry, '_publish_listeners', [])
+    published = []
+    model_registry.add_publish_listener(published.append)
+
+    for _ in range(2):
+        assert retrain_worker.submit_retrain('sqlite://') == 'started'
+        # Waits for the done callbacks too, which run on the pool thread
+        executor.shutdown(wait=True)
+        executor = ThreadPoolExecutor(max_workers=1)
+    assert published == ['v7']
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from conftest import make_donor, make_recipient
+from models import db, Donor, Recipient, Lease, PairScore
+from ml.score_store import RESCORE_LEASE, SQLITE_LEASE_SECONDS, release_lease, rescore_pairs, take_lease
+
+
+class Scorer:
+    """predict_compatibility stand-in that records the blocks it was given"""
+
+    def __init__(self):
+        self.blocks = []
+
+    def __call__(self, donors_df, recipients_df, model_path=None):
+        self.blocks.append((set(donors_df['id']), set(recipients_df['id'])))
+        return [
+            {'donor_id': donor['id'], 'recipient_id': recipient['id'],
+             'compatibility_percentage': donor['age'] + recipient['age'] / 100}
+            for _, donor in donors_df.iterrows() for _, recipient in recipients_df.iterrows()
+        ]
+
+
+def _scores(version='v1'):
+    return {(score.donor_id, score.recipient_id): score.compatibility_score
+            for score in PairScore.query.filter_by(model_version=version)}
+
+
+@pytest.fixture
+def records(app):
+    db.session.add_all([
+        make_donor(id=1, age=30, organ_type='Kidney', blood_group='O+'),
+        make_donor(id=2, age=40, organ_type='Liver', blood_group='A+'),
+        make_donor(id=3, age=50, organ_type='Kidney', blood_group='AB+'),
+        make_recipient(id=10, age=20, organ_needed='Kidney', blood_group='A+'),
+        make_recipient(id=11, age=21, organ_needed='Kidney', blood_group='O-'),
+        make_recipient(id=12, age=22, organ_needed='Liver', blood_group='AB+'),
+        make_recipient(id=13, age=23, organ_needed='Heart', blood_group='O+'),
+    ])
+    db.session.commit()
+
+
+def test_first_run_scores_candidate_pairs(records):
+    stats = rescore_pairs('v1', predict_fn=Scorer())
+    assert _scores() == {(1, 10): 30.2, (2, 12): 40.22}
+    assert stats['pairs_scored'] == 2
+    assert (stats['total_pairs'], stats['organ_pruned'], stats['blood_pruned']) == (12, 7, 3)
+
+
+def test_incremental_run_only_touches_changed_groups(records):
+    rescore_pairs('v1', predict_fn=Scorer())
+
+    db.session.get(Donor, 1).age = 35
+    db.session.add(make_recipient(id=14, age=24, organ_needed='Kidney', blood_group='AB+'))
+    db.session.delete(db.session.get(Recipient, 12))
+    db.session.commit()
+
+    scorer = Scorer()
+    rescore_pairs('v1', predict_fn=scorer)
+    assert _scores() == {(1, 10): 35.2, (1, 14): 35.24, (3, 14): 50.24}
+
+    loaded_donors = set().union(*(donors for donors, _ in scorer.blocks))
+    loaded_recipients = set().union(*(recipients for _, recipients in scorer.blocks))
+    assert 2 not in loaded_donors  # the Liver donor cannot pair with any changed row
+    assert not loaded_recipients & {12, 13}  # nor the deleted Liver or the Heart recipient
+
+    incremental = _scores()
+    rescore_pairs('v1', predict_fn=Scorer(), full=True)
+    assert _scores() == incremental
+
+
+def test_lease_is_exclusive_until_it_expires(app):
+    assert take_lease(db.engine, 'job', 'worker-a', lease_seconds=60)
+    assert take_lease(db.engine, 'job', 'worker-a', lease_seconds=60)
+    assert not take_lease(db.engine, 'job', 'worker-b', lease_seconds=60)
+
+    release_lease(db.engine, 'job', 'worker-a')
+    assert take_lease(db.engine, 'job', 'worker-b', lease_seconds=60)
+
+    lease = db.session.get(Lease, 'job')
+    lease.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert take_lease(db.engine, 'job', 'worker-a', lease_seconds=60)
+
+
+def test_rescore_waits_for_another_workers_lease(records):
+    assert take_lease(db.engine, RESCORE_LEASE, 'other-worker', lease_seconds=1)
+    started = time.monotonic()
+    rescore_pairs('v1', predict_fn=Scorer())
+    assert time.monotonic() - started >= 0.9
+    assert db.session.get(Lease, RESCORE_LEASE).owner is None
+
+
+def test_rescore_waits_through_a_locked_database(records, monkeypatch):
+    calls = []
+
+    def take(engine, name, owner, lease_seconds):
+        calls.append(lease_seconds)
+        if len(calls) == 1:
+            raise OperationalError('UPDATE leases', {}, Exception('database is locked'))
+        return take_lease(engine, name, owner, lease_seconds)
+
+    monkeypatch.setattr('ml.score_store.take_lease', take)
+    assert rescore_pairs('v1', predict_fn=Scorer())['pairs_scored'] > 0
+    # SQLite cannot renew during the pass, so the lease covers all of it
+    assert calls[:2] == [SQLITE_LEASE_SECONDS, SQLITE_LEASE_SECONDS]
+    assert db.session.get(Lease, RESCORE_LEASE).owner is None
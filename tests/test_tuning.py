@@ -0,0 +1,56 @@
+import subprocess
+
+import pytest
+
+from ml import tuning
+
+
+class FakeProcess:
+    pid = 4242
+    returncode = 0
+
+    def wait(self):
+        return 0
+
+
+@pytest.fixture
+def launches(monkeypatch):
+    calls = []
+
+    def popen(command, **kwargs):
+        calls.append((command, kwargs))
+        return FakeProcess()
+
+    monkeypatch.setattr(subprocess, 'Popen', popen)
+    return calls
+
+
+def test_start_tuning_keeps_the_database_uri_off_the_command_line(tmp_path, launches):
+    uri = 'postgresql://organ:s3cret@db/organmatch'
+    tuning.start_tuning(uri, str(tmp_path / 'tuning'), str(tmp_path / 'cache'), str(tmp_path / 'config.json'),
+                        candidates=4)
+    command, kwargs = launches[0]
+    assert not any('s3cret' in part for part in command)
+    assert kwargs['env'][tuning.DATABASE_URI_ENV] == uri
+    assert command[command.index('--candidates') + 1] == '4'
+
+
+def test_tuning_endpoint_passes_the_engine_url(tmp_path, launches, monkeypatch):
+    from flask import Flask
+    from flask_login import LoginManager
+    from models import db
+
+    monkeypatch.chdir(tmp_path)
+    app = Flask(__name__, instance_path=str(tmp_path / 'instance'))
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///organmatch.db', LOGIN_DISABLED=True, SECRET_KEY='test')
+    db.init_app(app)
+    LoginManager(app)
+    tuning.init_tuning(app, tuning_dir=str(tmp_path / 'tuning'), config_path=str(tmp_path / 'config.json'))
+
+    response = app.test_client().post('/api/tuning', json={'candidates': 4})
+    assert response.status_code == 202
+    _, kwargs = launches[0]
+    # Flask-SQLAlchemy puts a relative sqlite file in the instance folder
+    assert kwargs['env'][tuning.DATABASE_URI_ENV] == f"sqlite:///{tmp_path / 'instance' / 'organmatch.db'}"
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT
+from ml import vectorized_features
+from ml.candidates import BLOOD_COMPATIBILITY
+from ml.vectorized_features import FEATURE_COLUMNS, MAX_STORAGE_HOURS, create_features
+
+
+def _records():
+    donors = pd.read_csv(os.path.join(ROOT, 'data', 'donors_sample.csv'))
+    recipients = pd.read_csv(os.path.join(ROOT, 'data', 'recipients_sample.csv'))
+    donors['gender'] = np.where(donors['id'] % 2, 'Male', 'Female')
+    recipients['gender'] = np.where(recipients['id'] % 3, 'Female', 'Other')
+    # Missing and odd values the pipeline has to handle
+    donors.loc[0, ['bmi', 'hla_typing', 'organ_storage_hours']] = [np.nan, np.nan, np.nan]
+    donors.loc[1, 'blood_group'] = 'X+'
+    donors.loc[2, 'smoking'] = 1
+    recipients.loc[1, ['urgency_level', 'latitude']] = [np.nan, np.nan]
+    recipients.loc[2, 'hla_typing'] = 'a1, b8 ,DR52'
+    recipients = pd.concat([recipients, recipients.assign(id=recipients['id'] + 100, age=recipients['age'] + 7)],
+                           ignore_index=True)
+    return donors, recipients
+
+
+def _alleles(typing):
+    if pd.isna(typing):
+        return []
+    return [allele for allele in dict.fromkeys(str(typing).upper().replace(' ', '').split(',')) if allele]
+
+
+def _risk(*flags):
+    return sum(0.25 for flag in flags if flag == 1)
+
+
+def _reference(donors_df, recipients_df):
+    """Row-wise create_features, following the documented per-pair formulas"""
+    from geopy.distance import geodesic
+
+    rows, labels = [], []
+    for _, recipient in recipients_df.iterrows():
+        for _, donor in donors_df.iterrows():
+            if donor['organ_type'] != recipient['organ_needed']:
+                continue
+            donor_alleles, recipient_alleles = _alleles(donor['hla_typing']), _alleles(recipient['hla_typing'])
+            hla = (sum(allele in recipient_alleles for allele in donor_alleles) / len(donor_alleles)
+                   if donor_alleles else 0.5)
+            blood = float(recipient['blood_group'] in BLOOD_COMPATIBILITY.get(donor['blood_group'], []))
+            hours = donor['organ_storage_hours']
+            freshness = 0.0 if pd.isna(hours) else max(0, min(100, (1 - hours / MAX_STORAGE_HOURS[donor['organ_type']]) * 100))
+            try:
+                distance = geodesic((donor['latitude'], donor['longitude']),
+                                    (recipient['latitude'], recipient['longitude'])).kilometers
+            except ValueError:
+                distance = 0.0
+            donor_risk = _risk(donor['diabetes'], donor['hypertension'], donor['smoking'], donor['alcohol'])
+            recipient_risk = _risk(recipient['diabetes'], recipient['hypertension'])
+            features = {
+                'hla_match_score': hla,
+                'blood_group_compatible': blood,
+                'organ_freshness_score': freshness,
+                'gps_distance_km': distance,
+                'age_difference': abs(donor['age'] - recipient['age']),
+                'organ_size_difference': abs(donor['organ_size'] - recipient['organ_size_needed']),
+                'donor_bmi': 0.0 if pd.isna(donor['bmi']) else donor['bmi'],
+                'recipient_bmi': 0.0 if pd.isna(recipient['bmi']) else recipient['bmi'],
+                'donor_medical_risk': donor_risk,
+                'recipient_medical_risk': recipient_risk,
+                'urgency_level': 0.0 if pd.isna(recipient['urgency_level']) else recipient['urgency_level'],
+                'gender_compatible': 0.8 if donor['gender'] == recipient['gender'] else 0.6,
+            }
+            score = (hla * 0.3 + blood * 0.3 + freshness * 0.2
+                     + (1 - min(donor_risk, 1)) * 0.1 + (1 - min(recipient_risk, 1)) * 0.1)
+            rows.append(features)
+            labels.append(1 if score > 0.6 else 0)
+    return pd.DataFrame(rows, columns=FEATURE_COLUMNS), labels
+
+
+def _assert_parity(X, labels, X_reference, labels_reference):
+    assert list(X.columns) == FEATURE_COLUMNS
+    assert len(X) == len(X_reference) and labels == labels_reference
+    distance = X.pop('gps_distance_km')
+    reference_distance = X_reference.pop('gps_distance_km')
+    assert np.allclose(distance, reference_distance, rtol=0.01, atol=1e-6)
+    pd.testing.assert_frame_equal(X, X_reference, check_dtype=False)
+
+
+def test_matches_row_wise_reference():
+    donors, recipients = _records()
+    X, labels = create_features(donors, recipients)
+    X_reference, labels_reference = _reference(donors, recipients)
+    assert len(X) > 10 and 0 < sum(labels) <= len(labels)
+    _assert_parity(X, labels, X_reference, labels_reference)
+
+
+@pytest.mark.parametrize('block_size', [1, 5, 13, 10 ** 9])
+def test_block_size_bounds_memory_without_changing_output(block_size, monkeypatch):
+    donors, recipients = _records()
+    expected_X, expected_labels = create_features(donors, recipients)
+
+    blocks = []
+    real_block_features = vectorized_features.block_features
+
+    def recording(donor_block, recipient_block):
+        blocks.append(len(donor_block['age']) * len(recipient_block['age']))
+        return real_block_features(donor_block, recipient_block)
+
+    monkeypatch.setattr(vectorized_features, 'block_features', recording)
+    X, labels = create_features(donors, recipients, block_size=block_size)
+    pd.testing.assert_frame_equal(X, expected_X)
+    assert labels == expected_labels
+    assert max(blocks) <= max(block_size, 1)
+    if block_size >= len(donors) * len(recipients):
+        assert len(blocks) == 1
+
+
+def test_gender_follows_python_equality():
+    genders = pd.Series([None, np.nan, 'Other'], dtype=object)
+    donors = pd.DataFrame({'organ_type': ['Kidney'] * 3, 'gender': genders, 'age': [40] * 3})
+    recipients = pd.DataFrame({'organ_needed': ['Kidney'] * 3, 'gender': genders, 'age': [50] * 3})
+    X, _ = create_features(donors, recipients)
+    # Recipient-major: None == None, NaN never equals, 'Other' == 'Other'
+    assert X['gender_compatible'].to_numpy().reshape(3, 3).tolist() == [
+        [0.8, 0.6, 0.6], [0.6, 0.6, 0.6], [0.6, 0.6, 0.8]
+    ]
+
+
+def test_empty_inputs():
+    donors, recipients = _records()
+    X, labels = create_features(donors.iloc[:0], recipients)
+    assert list(X.columns) == FEATURE_COLUMNS and len(X) == 0 and labels == []
+    X, labels = create_features(donors[donors['organ_type'] == 'Heart'], recipients[recipients['organ_needed'] == 'Liver'])
+    assert len(X) == 0 and labels == []
+
+
+def test_matches_create_features():
+    reference = pytest.importorskip('ml.feature_engineering').create_features
+    donors, recipients = _records()
+    X_reference, labels_reference = reference(donors, recipients)
+    X, labels = create_features(donors, recipients)
+    _assert_parity(X, labels, X_reference[FEATURE_COLUMNS].copy(), list(labels_reference))
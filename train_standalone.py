@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 """
 Standalone script to train the OrganMatch ML model
+
+Features are kept in their own on-disk feature cache (the sample ids are
+not the database's), so running it again only computes pairs of rows that
+were added or changed in the CSV files.
 """
 
 import pandas as pd
@@ -10,7 +14,11 @@ import os
 # Add the project root to Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from ml.train_model import train_model
+from ml.feature_cache import FeatureCache
+from ml.model_registry import dataframe_fingerprint
+from ml.retrain_worker import default_feature_fn, fit_model
+
+FEATURE_CACHE_DIR = 'models/feature_cache_csv'
 
 def main():
     print("🚀 Starting OrganMatch Model Training")
@@ -32,15 +40,26 @@ def main():
         print(f"❌ Error loading data: {e}")
         return 1
 
-    # Train the model
+    # Build (or reuse) the candidate-pair features
     try:
-        print("\n🤖 Training ML model...")
-        model = train_model(donors_df, recipients_df)
+        print(f"\n🧮 Building features (cache: {FEATURE_CACHE_DIR})...")
+        matrix, stats = FeatureCache(FEATURE_CACHE_DIR).sync(donors_df, recipients_df, default_feature_fn())
+        X, y, new_rows = matrix.training_data()
+        print(f"✅ {len(X)} candidate pairs ({stats['computed_pairs']} computed, {stats['reused_pairs']} cached)")
 
-        if model is None:
-            print("❌ Model training failed")
+        if len(X) < 2 or len(set(y)) < 2:
+            print("❌ Not enough labelled pairs to train")
             return 1
 
+    except Exception as e:
+        print(f"❌ Error building features: {e}")
+        return 1
+
+    # Train the model
+    try:
+        print("\n🤖 Training ML model...")
+        fit_model(X, y, new_rows, data_fingerprint=dataframe_fingerprint(donors_df, recipients_df))
+
         print("\n🎉 Model training completed successfully!")
         print("📁 Model saved to: models/random_forest.joblib")
 
@@ -52,4 +71,4 @@ def main():
 
 if __name__ == "__main__":
     exit_code = main()
-    sys.exit(exit_code)
\ No newline at end of file
+    sys.exit(exit_code)